@@ -0,0 +1,169 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from joserfc import jwt
+from joserfc.errors import JoseError, InvalidKeyIdError
+from joserfc.jwk import KeySet
+
+
+from util import print_timestamp
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class JWKSUnavailable(Exception):
+    """The JWKS could not be fetched and no earlier key set is cached"""
+    pass
+
+
+class CognitoTokenVerifier(object):
+    """Verify Cognito access tokens locally against the user pool's JWKS.
+
+    The JWKS is fetched once and refreshed every `jwks_ttl` seconds, or early
+    when a token is signed with an unknown `kid` (key rotation). If a refresh
+    fails the last good key set keeps being served and the fetch is retried
+    after an exponential backoff (`retry_backoff` up to `max_retry_backoff`).
+    """
+
+    def __init__(self, issuer, client_id=None, jwks_ttl=3600, leeway=30, fetch_jwks=None,
+                 retry_backoff=5, max_retry_backoff=300):
+        self.issuer = issuer
+        self.client_id = client_id
+        self.jwks_ttl = jwks_ttl
+        self.leeway = leeway
+        self.fetch_jwks = fetch_jwks or self._fetch_jwks
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self._key_set = None
+        self._fetched_at = 0.0
+        self._failures = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def _fetch_jwks(self):
+        response = requests.get(f"{self.issuer}/.well-known/jwks.json", timeout=5)
+        response.raise_for_status()
+        return response.json()
+
+    def _keys(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            # Không refresh quá 1 lần / 60s khi gặp kid lạ, tránh bị spam token giả
+            stale = now - self._fetched_at > self.jwks_ttl
+            wanted = self._key_set is None or stale or (force and now - self._fetched_at > 60)
+            if wanted and now >= self._retry_at:
+                try:
+                    self._key_set = KeySet.import_key_set(self.fetch_jwks())
+                    self._fetched_at = now
+                    self._failures = 0
+                except Exception as e:
+                    # Lỗi mạng / non-200 / JWKS hỏng: giữ key set cũ, thử lại sau backoff
+                    backoff = min(self.retry_backoff * 2 ** self._failures, self.max_retry_backoff)
+                    self._failures += 1
+                    self._retry_at = now + backoff
+                    print_timestamp(f"JWKS refresh failed ({type(e).__name__}: {e}), retrying in {backoff}s")
+            if self._key_set is None:
+                raise JWKSUnavailable(f"No JWKS available for {self.issuer}")
+            return self._key_set
+
+    def _decode(self, token, key_set):
+        return jwt.decode(token, key_set, algorithms=["RS256"])
+
+    def verify(self, token: str) -> dict:
+        """Return the token claims, raise InvalidToken or JWKSUnavailable (no key set yet)"""
+        try:
+            try:
+                decoded = self._decode(token, self._keys())
+            except InvalidKeyIdError:
+                # kid không có trong JWKS đang cache -> thử lấy JWKS mới
+                decoded = self._decode(token, self._keys(force=True))
+
+            claims = decoded.claims
+            jwt.JWTClaimsRegistry(
+                leeway=self.leeway,
+                exp={"essential": True},
+                iss={"essential": True, "value": self.issuer},
+                token_use={"essential": True, "value": "access"},
+            ).validate(claims)
+        except (JoseError, ValueError) as e:
+            raise InvalidToken(str(e)) from e
+
+        if self.client_id and claims.get("client_id") != self.client_id:
+            raise InvalidToken("Token was issued for another client")
+        return claims
+
+
+class TTLCache(object):
+    """Small thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at=None):
+        expires_at = min(expires_at or float("inf"), time.time() + self.ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TokenAuthenticator(object):
+    """Map an access token to user_data (user_id, email, username).
+
+    Signature and claims are checked locally. The email is not part of a
+    Cognito access token, so it is looked up through `fetch_user` once per
+    user and cached by `sub`.
+    """
+
+    def __init__(self, verifier: CognitoTokenVerifier, fetch_user, token_ttl=300, profile_ttl=3600):
+        self.verifier = verifier
+        self.fetch_user = fetch_user
+        self.tokens = TTLCache(ttl=token_ttl)
+        self.profiles = TTLCache(ttl=profile_ttl)
+
+    def authenticate(self, token: str) -> dict:
+        token_key = hashlib.sha256(token.encode()).hexdigest()
+        user_data = self.tokens.get(token_key)
+        if user_data is not None:
+            return user_data
+
+        claims = self.verifier.verify(token)
+        user_id = claims["sub"]
+
+        profile = self.profiles.get(user_id)
+        if profile is None:
+            profile = self.fetch_user(token)
+            self.profiles.set(user_id, profile)
+
+        user_data = {
+            "user_id": user_id,
+            "email": profile.get("email", ""),
+            "username": claims.get("username") or profile.get("username", ""),
+        }
+        self.tokens.set(token_key, user_data, expires_at=claims["exp"])
+        return user_data
@@ -0,0 +1,77 @@
+"""Requests/sec of /api/chat/send as the number of parallel clients grows.
+
+LLM, embeddings, Qdrant, Elasticsearch, DynamoDB and Cognito are replaced with
+stubs from bench.stubs, so only the app's own concurrency is measured.
+
+    cd backend && python -m bench.chat_concurrency --clients 1 4 16 64
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import stubs
+
+import httpx
+
+import myapi
+import rag_pipeline
+
+
+def setup_app(llm_latency: float, search_latency: float, storage_latency: float):
+    app = myapi.app
+    app.state.llm = stubs.FakeLLM(latency=llm_latency)
+    app.state.embed_model = stubs.fake_embeddings()
+    app.state.reranker = None
+
+    rag_pipeline.get_history_session = stubs.HistoryStore()
+    rag_pipeline.find_similarity = stubs.blocking_search(search_latency)
+    rag_pipeline.bm25_search = stubs.blocking_search(search_latency)
+    rag_pipeline.search_tool = stubs.FakeSearchTool(search_latency)
+    app.state.chains = rag_pipeline.build_chain_registry(app.state.llm, app.state.embed_model, app.state.reranker)
+
+    table = stubs.InMemoryTable(["user_id", "conv_id"], latency=storage_latency)
+    table.put_item(Item={"user_id": "bench-user", "conv_id": "bench-conv", "name": "Bench"})
+    myapi.conversations_table = table
+
+    app.dependency_overrides[myapi.auth_middleware] = lambda: {
+        "user_id": "bench-user",
+        "email": "bench@example.com",
+        "username": "bench",
+    }
+    return app
+
+
+async def run_level(app, clients: int, requests_per_client: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for _ in range(requests_per_client):
+                response = await client.post("/api/chat/send", json={"conv_id": "bench-conv", "question": "Tài liệu nói gì?"})
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+    return clients * requests_per_client / elapsed
+
+
+async def main(args):
+    # Blocking stubs run in the default executor; size it so it is not the bottleneck
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max(args.clients) * 4))
+    app = setup_app(args.llm_latency, args.search_latency, args.storage_latency)
+
+    print(f"{'clients':>8} {'req/s':>10}")
+    for clients in args.clients:
+        rps = await run_level(app, clients, args.requests)
+        print(f"{clients:>8} {rps:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--requests", type=int, default=5, help="requests per client")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--search-latency", type=float, default=0.1)
+    parser.add_argument("--storage-latency", type=float, default=0.01)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,115 @@
+"""Cost of /api/documents/ for a user with many documents: S3 listing vs. document catalog.
+
+- s3      : the old list_user_files path — list_objects_v2 (1000 keys per call,
+            `--list-latency-ms` simulated per call) and one generate_presigned_url
+            per object (real botocore signing with dummy credentials)
+- catalog : one page query on a SQLiteDocumentCatalog in a temp dir, plus a
+            full walk of every page to show the cost of reading everything
+
+    cd backend && python -m bench.document_listing --documents 1000 5000 --page-size 50
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import bench.stubs  # noqa: F401  (dummy env trước khi import module backend)
+from bench.inference_backends import percentile
+from document_catalog import SQLiteDocumentCatalog
+from uploads3 import S3Upload
+
+USERNAME = "bench-user"
+BUCKET = "arag"
+
+
+class FakePaginator(object):
+    def __init__(self, objects, latency: float, calls: list):
+        self.objects = objects
+        self.latency = latency
+        self.calls = calls
+
+    def paginate(self, Bucket, Prefix):
+        for start in range(0, len(self.objects), 1000):
+            time.sleep(self.latency)
+            self.calls.append(1)
+            yield {"Contents": self.objects[start:start + 1000]}
+
+
+def fake_objects(n: int):
+    now = datetime.now(timezone.utc)
+    return [{"Key": f"{USERNAME}/{1700000000 + i}_report-{i}.pdf", "Size": 100000 + i,
+             "ETag": f'"{i:032x}"', "LastModified": now} for i in range(n)]
+
+
+def run_s3(aws, objects, latency: float):
+    """Old behaviour: every listing walks S3 and signs a URL per object"""
+    calls = []
+    aws.s3.get_paginator = lambda name: FakePaginator(objects, latency, calls)
+    started = time.perf_counter()
+    files = []
+    for info in aws.iter_user_files(BUCKET, USERNAME):
+        info["url"] = aws.get_presigned_url(BUCKET, info["key"])
+        files.append(info)
+    return time.perf_counter() - started, len(calls), len(files)
+
+
+def main(args):
+    aws = S3Upload()
+    report = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.documents:
+            objects = fake_objects(n)
+            catalog = SQLiteDocumentCatalog(os.path.join(tmp, f"catalog-{n}.sqlite3"))
+            catalog.put_many(USERNAME, [aws._file_info(USERNAME, o["Key"], o["Size"], o["ETag"], o["LastModified"])
+                                        for o in objects])
+
+            s3_times = []
+            for _ in range(args.repeat):
+                elapsed, list_calls, signed = run_s3(aws, objects, args.list_latency_ms / 1000)
+                s3_times.append(elapsed)
+
+            page_times, walk_times = [], []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                documents, cursor = catalog.page(USERNAME, args.page_size)
+                page_times.append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                documents, cursor = catalog.page(USERNAME, 1000)
+                pages = 1
+                while cursor:
+                    documents, cursor = catalog.page(USERNAME, 1000, cursor)
+                    pages += 1
+                walk_times.append(time.perf_counter() - started)
+
+            row = {
+                "documents": n,
+                "s3": {"p50_ms": percentile(s3_times, 50), "list_calls": list_calls, "urls_signed": signed},
+                "catalog_page": {"p50_ms": percentile(page_times, 50), "queries": 1, "urls_signed": 0,
+                                 "page_size": args.page_size},
+                "catalog_all": {"p50_ms": percentile(walk_times, 50), "queries": pages, "urls_signed": 0},
+            }
+            report.append(row)
+            print(json.dumps(row))
+
+    print(f"\n{'documents':>10} {'s3 ms':>10} {'list calls':>11} {'signed':>8} {'page ms':>9} {'all pages ms':>13}")
+    for row in report:
+        print(f"{row['documents']:>10} {row['s3']['p50_ms']:>10.1f} {row['s3']['list_calls']:>11} "
+              f"{row['s3']['urls_signed']:>8} {row['catalog_page']['p50_ms']:>9.2f} {row['catalog_all']['p50_ms']:>13.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--list-latency-ms", type=float, default=40,
+                        help="simulated round trip of one list_objects_v2 call")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the report as JSON")
+    main(parser.parse_args())
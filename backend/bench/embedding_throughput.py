@@ -0,0 +1,54 @@
+"""Chunks/sec of the ingestion embedding engine versus number of worker processes.
+
+Loads backend/test.pdf, splits it like process_files does (optionally with a
+smaller chunk size and repeated to get a bigger corpus), then embeds every
+chunk with EmbeddingEngine for each worker count.
+
+    cd backend && python -m bench.embedding_throughput --workers 1 2 4 --repeat 20
+"""
+import argparse
+import os
+import time
+
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from embedding_engine import EmbeddingEngine
+
+PDF_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test.pdf")
+
+
+def load_chunks(chunk_size: int, chunk_overlap: int, repeat: int):
+    docs = PyPDFLoader(PDF_PATH).load()
+    splits = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_documents(docs)
+    # Thêm hậu tố để các bản lặp không trùng nội dung tuyệt đối
+    return [f"{split.page_content} [{r}]" for r in range(repeat) for split in splits]
+
+
+def main(args):
+    texts = load_chunks(args.chunk_size, args.chunk_overlap, args.repeat)
+    print(f"{len(texts)} chunks, model={args.model}, batch_size={args.batch_size}, cpus={os.cpu_count()}")
+    print(f"{'workers':>8} {'seconds':>10} {'chunks/s':>10}")
+
+    for workers in args.workers:
+        engine = EmbeddingEngine(args.model, batch_size=args.batch_size, workers=workers)
+        try:
+            # Warm-up: nạp model trong mọi process trước khi đo
+            engine.embed_documents(texts[:args.batch_size * workers])
+            started = time.perf_counter()
+            engine.embed_documents(texts)
+            elapsed = time.perf_counter() - started
+        finally:
+            engine.close()
+        print(f"{workers:>8} {elapsed:>10.2f} {len(texts) / elapsed:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="intfloat/multilingual-e5-large")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--chunk-overlap", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=10, help="repeat the PDF's chunks to enlarge the corpus")
+    main(parser.parse_args())
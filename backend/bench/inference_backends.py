@@ -0,0 +1,133 @@
+"""Accuracy vs latency of the torch / ONNX / ONNX int8 inference backends.
+
+Each backend is loaded in its own process (so peak RSS is comparable) and runs:
+- embed_documents over the chunks of backend/test.pdf (throughput)
+- embed_query over pseudo-queries (p50/p95 latency)
+- cross-encoder scoring of query/chunk pairs (p50/p95 latency)
+Accuracy is measured against the first backend listed (normally torch):
+mean cosine of the embeddings, recall@k of the dense ranking and top-k overlap
+of the reranker ranking.
+
+    cd backend && python -m bench.inference_backends --backends torch onnx onnx-int8
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+
+from bench.embedding_throughput import load_chunks
+
+
+def percentile(values, q):
+    return float(np.percentile(np.asarray(values) * 1000, q))
+
+
+def run_backend(backend, args, texts, queries, queue):
+    from inference_backends import load_embedding_model, load_cross_encoder
+
+    started = time.perf_counter()
+    embed_model = load_embedding_model(args.embed_model, backend=backend)
+    cross_encoder = load_cross_encoder(args.reranker_model, backend=backend)
+    load_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    doc_vectors = embed_model.embed_documents(texts)
+    docs_per_second = len(texts) / (time.perf_counter() - started)
+
+    query_vectors, query_latency = [], []
+    for query in queries:
+        started = time.perf_counter()
+        query_vectors.append(embed_model.embed_query(query))
+        query_latency.append(time.perf_counter() - started)
+
+    rerank_scores, rerank_latency = [], []
+    for query in queries:
+        pairs = [(query, text[:args.passage_chars]) for text in texts[:args.candidates]]
+        started = time.perf_counter()
+        rerank_scores.append(list(map(float, cross_encoder.score(pairs))))
+        rerank_latency.append(time.perf_counter() - started)
+
+    queue.put({
+        "backend": backend,
+        "load_seconds": load_seconds,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "embed_docs_per_second": docs_per_second,
+        "embed_query_ms_p50": percentile(query_latency, 50),
+        "embed_query_ms_p95": percentile(query_latency, 95),
+        "rerank_ms_p50": percentile(rerank_latency, 50),
+        "rerank_ms_p95": percentile(rerank_latency, 95),
+        "doc_vectors": doc_vectors,
+        "query_vectors": query_vectors,
+        "rerank_scores": rerank_scores,
+    })
+
+
+def topk(scores, k):
+    return set(np.argsort(scores)[::-1][:k].tolist())
+
+
+def compare(reference, result, k):
+    ref_docs, docs = np.asarray(reference["doc_vectors"]), np.asarray(result["doc_vectors"])
+    cosine = np.sum(ref_docs * docs, axis=1) / (np.linalg.norm(ref_docs, axis=1) * np.linalg.norm(docs, axis=1))
+
+    recalls = []
+    for ref_query, query in zip(reference["query_vectors"], result["query_vectors"]):
+        expected = topk(ref_docs @ np.asarray(ref_query), k)
+        recalls.append(len(expected & topk(docs @ np.asarray(query), k)) / len(expected))
+
+    overlaps = []
+    for ref_scores, scores in zip(reference["rerank_scores"], result["rerank_scores"]):
+        top_n = min(k, len(ref_scores))
+        overlaps.append(len(topk(ref_scores, top_n) & topk(scores, top_n)) / top_n)
+
+    return {
+        "embed_cosine_mean": float(cosine.mean()),
+        "embed_cosine_min": float(cosine.min()),
+        f"dense_recall@{k}": float(np.mean(recalls)),
+        f"rerank_top{k}_overlap": float(np.mean(overlaps)),
+    }
+
+
+def main(args):
+    texts = load_chunks(args.chunk_size, args.chunk_overlap, 1)
+    # Pseudo-queries: câu đầu của một số chunk
+    queries = [text.split(".")[0][:200] for text in texts[::max(1, len(texts) // args.queries)]][:args.queries]
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for backend in args.backends:
+        queue = context.Queue()
+        process = context.Process(target=run_backend, args=(backend, args, texts, queries, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+
+    reference = results[0]
+    report = []
+    for result in results:
+        row = {key: value for key, value in result.items() if not isinstance(value, list)}
+        row.update(compare(reference, result, args.k))
+        report.append(row)
+        print(json.dumps(row, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--embed-model", default="intfloat/multilingual-e5-large")
+    parser.add_argument("--reranker-model", default="BAAI/bge-reranker-v2-m3")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--candidates", type=int, default=20, help="passages scored per query by the reranker")
+    parser.add_argument("--passage-chars", type=int, default=2000)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--output", help="write the report as JSON")
+    main(parser.parse_args())
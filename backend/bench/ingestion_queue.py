@@ -0,0 +1,156 @@
+"""End-to-end run of the ingestion job queue with stubbed S3, Qdrant, Elasticsearch and DynamoDB.
+
+Enqueues `--jobs` process_documents jobs spread over `--users` users into a
+temporary SQLite queue, then starts `--processes` worker processes. Every
+worker runs the real process_files pipeline against backend/test.pdf with an
+in-memory Qdrant and a fake embedding model. The first attempt of one job
+fails on purpose to exercise retries. Checks that no two jobs of the same
+user overlapped and prints jobs/sec.
+
+    cd backend && python -m bench.ingestion_queue --processes 1 2 4 --users 4 --jobs 12
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import bench.stubs  # noqa: F401  (dummy env trước khi import module backend)
+from job_queue import SQLiteJobQueue, DONE, FAILED
+
+PDF_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test.pdf")
+
+
+class FakeS3(object):
+    def download_file(self, bucket, key, path, Config=None):
+        shutil.copy(PDF_PATH, path)
+
+
+class FakeAWS(object):
+    def __init__(self, files_per_user: int):
+        self.s3 = FakeS3()
+        self.files_per_user = files_per_user
+
+    def iter_user_files(self, bucket_name, username):
+        return [{"key": f"{username}/{i}.pdf", "etag": f"{time.time()}"} for i in range(self.files_per_user)]
+
+
+def _stub_backends(status_table):
+    from qdrant_client import QdrantClient
+    import dense
+    import ingestion
+
+    client = QdrantClient(":memory:")
+    dense.get_qdrant_client = lambda: client
+    ingestion.ensure_index_bm25 = lambda *args, **kwargs: None
+    ingestion.index_splits_bm25 = lambda *args, **kwargs: None
+    ingestion.refresh_index_bm25 = lambda *args, **kwargs: None
+    ingestion.delete_document_bm25 = lambda *args, **kwargs: None
+    ingestion.update_document_status = lambda *args, **kwargs: None
+    ingestion.update_document_progress = lambda *args, **kwargs: None
+    ingestion.get_indexed_files = lambda username: status_table.setdefault(username, {})
+    ingestion.reset_indexed_files = lambda username: status_table.__setitem__(username, {})
+    ingestion.set_indexed_file = lambda username, key, etag: status_table.setdefault(username, {}).__setitem__(key, etag)
+    ingestion.remove_indexed_file = lambda username, key: status_table.get(username, {}).pop(key, None)
+    ingestion.get_indexed_model = lambda username: None
+    ingestion.set_indexed_model = lambda username, model_id: None
+
+
+def _worker(queue_path: str, log_path: str, files_per_user: int, fail_job: int, index: int):
+    import warnings
+    warnings.filterwarnings("ignore")
+    from worker import build_handlers, run_job
+
+    _stub_backends({})
+    job_queue = SQLiteJobQueue(queue_path, retry_delay=0.2)
+    handlers = build_handlers(bench.stubs.HashingEmbeddings(size=256), FakeAWS(files_per_user))
+    process_documents = handlers["process_documents"]
+
+    def timed(job):
+        started = time.time()
+        try:
+            if job.id == fail_job and job.attempts == 1:
+                raise RuntimeError("injected failure")
+            process_documents(job)
+        finally:
+            with open(log_path, "a") as log:
+                log.write(json.dumps({"user": job.username, "start": started, "end": time.time()}) + "\n")
+
+    handlers["process_documents"] = timed
+    worker_id = f"bench-{index}"
+    idle_since = None
+    # Dừng khi hàng đợi rỗng một lúc (job retry có thể quay lại sau retry_delay)
+    while idle_since is None or time.time() - idle_since < 1.0:
+        job = job_queue.claim(worker_id)
+        if job is None:
+            idle_since = idle_since or time.time()
+            time.sleep(0.05)
+            continue
+        idle_since = None
+        run_job(job_queue, handlers, job)
+
+
+def overlaps(intervals):
+    by_user = {}
+    for interval in intervals:
+        by_user.setdefault(interval["user"], []).append((interval["start"], interval["end"]))
+    count = 0
+    for spans in by_user.values():
+        spans.sort()
+        count += sum(1 for (_, end), (start, _) in zip(spans, spans[1:]) if start < end)
+    return count
+
+
+def run(processes: int, users: int, jobs: int, files_per_user: int):
+    workdir = tempfile.mkdtemp()
+    # Worker (spawn) kế thừa env: cache embedding riêng cho mỗi lần chạy
+    os.environ["EMBEDDING_CACHE_DIR"] = os.path.join(workdir, "embedding_cache")
+    try:
+        queue_path = os.path.join(workdir, "jobs.sqlite3")
+        log_path = os.path.join(workdir, "intervals.jsonl")
+        job_queue = SQLiteJobQueue(queue_path)
+        ids = [job_queue.enqueue("process_documents", f"user{i % users}", {"bucket_name": "bench"}, coalesce=False)
+               for i in range(jobs)]
+
+        context = multiprocessing.get_context("spawn")
+        children = [context.Process(target=_worker, args=(queue_path, log_path, files_per_user, ids[0], i))
+                    for i in range(processes)]
+        for child in children:
+            child.start()
+        for child in children:
+            child.join()
+
+        statuses = [job_queue.get(job_id) for job_id in ids]
+        with open(log_path) as log:
+            intervals = [json.loads(line) for line in log]
+        # Từ job đầu tiên tới job cuối cùng, không tính thời gian khởi động process
+        elapsed = max(i["end"] for i in intervals) - min(i["start"] for i in intervals)
+        return {
+            "done": sum(job.status == DONE for job in statuses),
+            "failed": sum(job.status == FAILED for job in statuses),
+            "attempts": sum(job.attempts for job in statuses),
+            "overlaps": overlaps(intervals),
+            "seconds": elapsed,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(args):
+    print(f"{args.jobs} jobs, {args.users} users, {args.files} PDF(s) per job, cpus={os.cpu_count()}")
+    print(f"{'processes':>9} {'done':>5} {'failed':>6} {'attempts':>8} {'overlaps':>8} {'seconds':>8} {'jobs/s':>7}")
+    for processes in args.processes:
+        result = run(processes, args.users, args.jobs, args.files)
+        print(f"{processes:>9} {result['done']:>5} {result['failed']:>6} {result['attempts']:>8} "
+              f"{result['overlaps']:>8} {result['seconds']:>8.2f} {result['done'] / result['seconds']:>7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--jobs", type=int, default=12)
+    parser.add_argument("--files", type=int, default=2, help="PDFs listed per job")
+    main(parser.parse_args())
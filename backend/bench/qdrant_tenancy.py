@@ -0,0 +1,169 @@
+"""Memory and query latency of per-user collections vs. one shared multi-tenant collection.
+
+For every `--tenants` level and tenancy mode, a fresh child process loads
+`--chunks-per-tenant` random `--dim`-d vectors per tenant through
+dense.ensure_collection / upsert_vectors, then runs `--queries` searches for
+random tenants through dense.find_similarity (after one warm-up search per
+queried tenant) and checks that no result leaks from another tenant.
+
+- collection : QDRANT_TENANCY=collection, one collection per tenant
+- shared     : QDRANT_TENANCY=shared, one collection filtered on metadata.username
+
+Qdrant:
+- --url    : a local Qdrant server (default http://localhost:6333, e.g.
+             `docker run -p 6333:6333 qdrant/qdrant`); memory = growth of the
+             server's resident bytes (/telemetry). Bench collections are
+             deleted afterwards.
+- --local  : qdrant_client local mode (":memory:"); memory = RSS growth of
+             the child process. Local mode builds no HNSW graph and no payload
+             index and filters points in Python: it only checks tenant
+             isolation and gives a brute-force worst case. It says nothing
+             about m=0 / payload_m tenant indexing, so it is never used as a
+             silent fallback.
+
+    cd backend && python -m bench.qdrant_tenancy --tenants 1000 10000
+    cd backend && python -m bench.qdrant_tenancy --local --tenants 1000 10000 --chunks-per-tenant 5 --queries 20
+"""
+import argparse
+import json
+import multiprocessing
+import queue
+import random
+import time
+import uuid
+
+from bench import stubs  # noqa: F401  (dummy env trước khi import module backend)
+
+import httpx
+import numpy as np
+
+from bench.inference_backends import percentile
+
+PREFIX = "bench_tenant_"
+SHARED = "bench_shared_chunks"
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * 4096
+
+
+def server_bytes(url: str) -> int:
+    telemetry = httpx.get(f"{url}/telemetry", params={"details_level": 1}).json()["result"]
+    return telemetry.get("memory", {}).get("resident_bytes", 0)
+
+
+def run(mode: str, tenants: int, args, results):
+    import warnings
+    warnings.filterwarnings("ignore")
+    from langchain_core.documents import Document
+    from qdrant_client import QdrantClient
+    import clients
+    import dense
+
+    dense.QDRANT_TENANCY = mode
+    dense.QDRANT_SHARED_COLLECTION = SHARED
+    client = QdrantClient(url=args.url, timeout=120) if args.url else QdrantClient(":memory:")
+    clients._qdrant_client = client
+    embed_model = stubs.fake_embeddings(size=args.dim)
+    rng = np.random.default_rng(args.seed)
+    names = [f"{PREFIX}{i}" for i in range(tenants)]
+
+    memory = (lambda: server_bytes(args.url)) if args.url else rss_bytes
+    before = memory()
+    started = time.perf_counter()
+    for username in names:
+        dense.ensure_collection(username, embed_model)
+        vectors = rng.standard_normal((args.chunks_per_tenant, args.dim)).astype(np.float32)
+        splits = [Document(page_content=f"chunk {c} of {username}", metadata={
+            "chunk_id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"{username}#{c}")), "file_key": f"{username}/doc.pdf",
+            "source": "doc.pdf", "username": username}) for c in range(args.chunks_per_tenant)]
+        dense.upsert_vectors(username, splits, vectors)
+    load_seconds = time.perf_counter() - started
+    time.sleep(args.settle)
+    used = memory() - before
+
+    picker = random.Random(args.seed)
+    queried = [picker.choice(names) for _ in range(args.queries)]
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32).tolist()
+    warmup_started = time.perf_counter()
+    for username in sorted(set(queried)):
+        dense.find_similarity(queries[0], 10, embed_model, username)
+    warmup_seconds = time.perf_counter() - warmup_started
+
+    latencies, leaks = [], 0
+    for username, vector in zip(queried, queries):
+        started = time.perf_counter()
+        docs = dense.find_similarity(vector, 10, embed_model, username)
+        latencies.append(time.perf_counter() - started)
+        leaks += sum(doc.metadata.get("username") != username for doc in docs)
+
+    if args.url:
+        for name in (names if mode == "collection" else [SHARED]):
+            client.delete_collection(name)
+    results.put({
+        "qdrant": args.url or "local",
+        "mode": mode,
+        "tenants": tenants,
+        "points": tenants * args.chunks_per_tenant,
+        "collections": tenants if mode == "collection" else 1,
+        "load_seconds": load_seconds,
+        "memory_mb": used / 1e6,
+        "first_query_per_tenant_ms": warmup_seconds / len(set(queried)) * 1000,
+        "query_p50_ms": percentile(latencies, 50),
+        "query_p95_ms": percentile(latencies, 95),
+        "query_p99_ms": percentile(latencies, 99),
+        "leaked_results": leaks,
+    })
+
+
+def main(args):
+    if args.local:
+        args.url = None
+    else:
+        try:
+            httpx.get(f"{args.url}/healthz", timeout=2).raise_for_status()
+        except httpx.HTTPError as e:
+            raise SystemExit(f"No Qdrant server at {args.url} ({e}); start one or pass --local")
+    context = multiprocessing.get_context("spawn")
+    report = []
+    for tenants in args.tenants:
+        for mode in args.modes:
+            results = context.Queue()
+            process = context.Process(target=run, args=(mode, tenants, args, results))
+            process.start()
+            while True:
+                try:
+                    row = results.get(timeout=1)
+                    break
+                except queue.Empty:
+                    if not process.is_alive():
+                        raise RuntimeError(f"{mode} run with {tenants} tenants died (exit code {process.exitcode})")
+            process.join()
+            report.append(row)
+            print(json.dumps(row))
+
+    print(f"\n{'tenants':>8} {'mode':>11} {'load s':>8} {'memory MB':>10} {'first q ms':>11} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'leaks':>6}")
+    for row in report:
+        print(f"{row['tenants']:>8} {row['mode']:>11} {row['load_seconds']:>8.1f} {row['memory_mb']:>10.1f} "
+              f"{row['first_query_per_tenant_ms']:>11.2f} {row['query_p50_ms']:>8.2f} {row['query_p95_ms']:>8.2f} "
+              f"{row['query_p99_ms']:>8.2f} {row['leaked_results']:>6}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--modes", nargs="+", default=["collection", "shared"])
+    parser.add_argument("--chunks-per-tenant", type=int, default=20)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--url", default="http://localhost:6333", help="Qdrant server URL")
+    parser.add_argument("--local", action="store_true", help="use qdrant_client local mode instead of a server")
+    parser.add_argument("--settle", type=float, default=0, help="seconds to wait before reading memory")
+    parser.add_argument("--seed", type=int, default=3)
+    parser.add_argument("--output", help="write the report as JSON")
+    main(parser.parse_args())
@@ -0,0 +1,371 @@
+"""Offline end-to-end RAG benchmark: ingestion, retrieval quality and per-stage latency.
+
+Ingests a corpus through the real ingestion.process_files pipeline, then
+replays a golden question set through retrieve -> context packing -> answer
+chain, all in-process:
+- Qdrant      : in-memory QdrantClient
+- BM25        : the in-process sparse backend (bm25_index.LocalBM25Index) in a temp dir
+- embeddings  : bench.stubs.HashingEmbeddings, or a real model (--embed-model)
+- LLM         : bench.stubs.FakeLLM sleeping --llm-latency seconds; HyDE echoes
+                the question, so the dense branch searches with the question text
+
+Corpus:
+- default     : backend/test.pdf with bench/data/golden_test_pdf.json
+- synthetic   : --synthetic-docs N generated documents with planted facts and
+                one golden question per fact (--questions)
+
+A retrieved chunk is relevant when it contains every evidence string of the
+question (case/whitespace-insensitive). Reports recall@1/5/10 and MRR for the
+fused, dense and BM25 lists, whether the evidence survived context packing,
+per-stage latency percentiles (from telemetry spans), end-to-end latency and
+questions/sec. Every run is saved as JSON; --compare prints the deltas
+against an earlier run.
+
+    cd backend && python -m bench.rag_eval
+    cd backend && python -m bench.rag_eval --synthetic-docs 200 --questions 100 --concurrency 8
+    cd backend && python -m bench.rag_eval --compare bench/results/rag_eval-<earlier>.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext, redirect_stdout
+
+os.environ.setdefault("SPAN_LOG", "0")
+os.environ.setdefault("EMBEDDING_CACHE_DIR", tempfile.mkdtemp(prefix="rag-eval-cache-"))
+
+from bench import stubs  # noqa: E402  (dummy env trước khi import module backend)
+
+import numpy as np  # noqa: E402
+from langchain_core.documents import Document  # noqa: E402
+from qdrant_client import QdrantClient  # noqa: E402
+
+import clients  # noqa: E402
+import ingestion  # noqa: E402
+import rag_pipeline  # noqa: E402
+import sparse  # noqa: E402
+import telemetry  # noqa: E402
+from bm25_index import LocalBM25Index  # noqa: E402
+from context_packer import ContextPacker  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PDF_PATH = os.path.join(BACKEND_DIR, "test.pdf")
+GOLDEN_PATH = os.path.join(BACKEND_DIR, "bench", "data", "golden_test_pdf.json")
+RESULTS_DIR = os.path.join(BACKEND_DIR, "bench", "results")
+USERNAME = "eval-user"
+KS = (1, 5, 10)
+LISTS = ("fused", "dense", "bm25")
+
+_WORDS = ("revenue", "shipment", "warehouse", "customer", "inventory", "contract", "supplier", "quarter",
+          "forecast", "logistics", "pricing", "margin", "segment", "capacity", "region", "policy", "audit",
+          "service", "network", "storage", "compute", "vendor", "payment", "retail", "demand", "report")
+_ATTRIBUTES = ("budget code", "project lead", "launch city", "safety rating", "partner firm")
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", "", text).lower()
+
+
+def percentiles(values) -> dict:
+    """p50/p95/p99/mean of `values` (ms)"""
+    if not values:
+        return {"count": 0}
+    array = np.asarray(values)
+    return {"count": len(values), "mean_ms": float(array.mean()), "p50_ms": float(np.percentile(array, 50)),
+            "p95_ms": float(np.percentile(array, 95)), "p99_ms": float(np.percentile(array, 99))}
+
+
+# ==== Corpus ====
+
+class FakeS3(object):
+    def download_file(self, bucket, key, path, Config=None):
+        shutil.copy(PDF_PATH, path)
+
+
+def pdf_corpus():
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        golden = json.load(f)
+    return [{"key": f"{USERNAME}/1700000000_test.pdf", "etag": "test-pdf"}], golden["questions"]
+
+
+def synthetic_corpus(documents: int, pages: int, questions: int, seed: int):
+    """Generated pages of filler text; each planted fact answers exactly one question"""
+    rng = random.Random(seed)
+    files, pages_by_key, golden = [], {}, []
+    facts = [(d, a) for d in range(documents) for a in range(len(_ATTRIBUTES))]
+    planted = {fact: i for i, fact in enumerate(rng.sample(facts, min(questions, len(facts))))}
+    for d in range(documents):
+        key = f"{USERNAME}/{1700000000 + d}_unit-{d}.pdf"
+        files.append({"key": key, "etag": f"synthetic-{seed}-{d}"})
+        texts = []
+        for p in range(pages):
+            texts.append(" ".join(rng.choice(_WORDS) for _ in range(rng.randint(250, 400))) + ".")
+        for a, attribute in enumerate(_ATTRIBUTES):
+            if (d, a) not in planted:
+                continue
+            value = f"{rng.choice(_WORDS)}-{rng.randrange(10000):04d}"
+            fact = f"The {attribute} of unit {d} is {value}."
+            page = rng.randrange(pages)
+            words = texts[page].split(" ")
+            position = rng.randrange(len(words))
+            texts[page] = " ".join(words[:position] + [fact] + words[position:])
+            golden.append({"id": f"s{planted[(d, a)]:04d}", "question": f"What is the {attribute} of unit {d}?",
+                           "evidence": [fact], "pages": [page]})
+        pages_by_key[key] = texts
+    golden.sort(key=lambda q: q["id"])
+    return files, golden, pages_by_key
+
+
+def install_synthetic_loader(pages_by_key: dict):
+    @contextmanager
+    def download_pdf(s3_client, bucket_name, key):
+        yield key
+
+    def iter_pdf_pages(path, source=None, **kwargs):
+        texts = pages_by_key[path]
+        for number, text in enumerate(texts):
+            yield Document(page_content=text, metadata={"source": source or path, "page": number,
+                                                        "page_label": str(number + 1), "total_pages": len(texts)})
+
+    ingestion.download_pdf = download_pdf
+    ingestion.iter_pdf_pages = iter_pdf_pages
+
+
+# ==== Local backends ====
+
+def install_backends(bm25_dir: str):
+    clients._qdrant_client = QdrantClient(":memory:")
+    clients._vector_stores.clear()
+    sparse._sparse_index = LocalBM25Index(bm25_dir)
+    status = {}
+    ingestion.update_document_status = lambda *args, **kwargs: None
+    ingestion.update_document_progress = lambda *args, **kwargs: None
+    ingestion.get_indexed_files = lambda username: status.get(username)
+    ingestion.reset_indexed_files = lambda username: status.__setitem__(username, {})
+    ingestion.set_indexed_file = lambda username, key, etag: status.setdefault(username, {}).__setitem__(key, etag)
+    ingestion.remove_indexed_file = lambda username, key: status.get(username, {}).pop(key, None)
+    ingestion.get_indexed_model = lambda username: None
+    ingestion.set_indexed_model = lambda username, model_id: None
+
+
+class StageRecorder(object):
+    """Keeps every telemetry observation (exact ms, not histogram buckets)"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+        self._observe = telemetry.registry.observe
+        telemetry.registry.observe = self.observe
+
+    def observe(self, stage: str, duration_ms: float, error: bool = False):
+        self._observe(stage, duration_ms, error)
+        with self._lock:
+            self.samples[stage].append(duration_ms)
+
+    def take(self) -> dict:
+        with self._lock:
+            samples, self.samples = self.samples, defaultdict(list)
+        return {stage: percentiles(values) for stage, values in sorted(samples.items())}
+
+
+class FusionCapture(object):
+    """Wraps rag_pipeline._fuse to keep the dense/BM25/fused lists of the current thread's question"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._fuse = rag_pipeline._fuse
+        rag_pipeline._fuse = self.fuse
+
+    def fuse(self, dense_results, sparse_results, limit=10):
+        fused = self._fuse(dense_results, sparse_results, limit=limit)
+        self._local.lists = {"dense": list(dense_results), "bm25": list(sparse_results), "fused": list(fused)}
+        return fused
+
+    def take(self) -> dict:
+        lists, self._local.lists = getattr(self._local, "lists", {}), {}
+        return lists
+
+
+# ==== Metrics ====
+
+def first_relevant(docs, evidence) -> int:
+    """1-based rank of the first chunk containing every evidence string, 0 if none"""
+    needles = [normalize(e) for e in evidence]
+    for rank, doc in enumerate(docs, 1):
+        text = normalize(doc.page_content)
+        if all(needle in text for needle in needles):
+            return rank
+    return 0
+
+
+def quality(rows) -> dict:
+    result = {}
+    for name in LISTS:
+        ranks = [row["rank"][name] for row in rows]
+        result[name] = {f"recall@{k}": sum(0 < r <= k for r in ranks) / len(ranks) for k in KS}
+        result[name]["mrr"] = sum(1 / r for r in ranks if r) / len(ranks)
+    result["context_hit"] = sum(row["context_hit"] for row in rows) / len(rows)
+    return result
+
+
+# ==== Run ====
+
+def ingest(embed_model, files, recorder):
+    started = time.perf_counter()
+    ingestion.process_files(embed_model, files, USERNAME, s3_client=FakeS3())
+    elapsed = time.perf_counter() - started
+    chunks = clients.get_qdrant_client().count(USERNAME).count
+    return {"documents": len(files), "chunks": chunks, "seconds": elapsed, "chunks_per_sec": chunks / elapsed,
+            "stages": recorder.take()}
+
+
+def replay(questions, context_chain, answer_chain, capture, concurrency: int):
+    config = {"configurable": {"username": USERNAME}}
+
+    def ask(question):
+        started = time.perf_counter()
+        with telemetry.request_context(f"eval-{question['id']}", USERNAME):
+            inputs = context_chain.invoke({"question": question["question"], "history": []}, config=config)
+            answer_chain.invoke(inputs)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        lists = capture.take()
+        return {
+            "id": question["id"],
+            "question": question["question"],
+            "e2e_ms": elapsed_ms,
+            "rank": {name: first_relevant(lists.get(name, []), question["evidence"]) for name in LISTS},
+            "context_hit": all(normalize(e) in normalize(inputs["context"]) for e in question["evidence"]),
+            "context_tokens": inputs.get("context_stats", {}).get("packed_tokens"),
+        }
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        rows = list(pool.map(ask, questions))
+    return rows, time.perf_counter() - started
+
+
+def load_embed_model(args):
+    if args.embed_model:
+        from inference_backends import load_embedding_model
+        return load_embedding_model(args.embed_model)
+    return stubs.HashingEmbeddings(args.embed_dim)
+
+
+def compare(report: dict, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} ({baseline.get('started_at')})")
+    print(f"{'metric':<32} {'before':>10} {'after':>10} {'delta':>10}")
+
+    def line(name, before, after):
+        if before is None or after is None:
+            return
+        print(f"{name:<32} {before:>10.3f} {after:>10.3f} {after - before:>+10.3f}")
+
+    for name in LISTS:
+        for metric in [f"recall@{k}" for k in KS] + ["mrr"]:
+            line(f"{name} {metric}", baseline["quality"].get(name, {}).get(metric), report["quality"][name][metric])
+    line("context_hit", baseline["quality"].get("context_hit"), report["quality"]["context_hit"])
+    line("e2e p50 ms", baseline["e2e"].get("p50_ms"), report["e2e"]["p50_ms"])
+    line("e2e p95 ms", baseline["e2e"].get("p95_ms"), report["e2e"]["p95_ms"])
+    line("questions/sec", baseline.get("questions_per_sec"), report["questions_per_sec"])
+    line("ingest chunks/sec", baseline["ingest"].get("chunks_per_sec"), report["ingest"]["chunks_per_sec"])
+    for stage, stats in report["stages"].items():
+        line(f"{stage} p95 ms", baseline["stages"].get(stage, {}).get("p95_ms"), stats.get("p95_ms"))
+
+
+def main(args):
+    started_at = time.strftime("%Y%m%d-%H%M%S")
+    if args.synthetic_docs:
+        files, questions, pages_by_key = synthetic_corpus(args.synthetic_docs, args.synthetic_pages, args.questions,
+                                                          args.seed)
+        install_synthetic_loader(pages_by_key)
+        corpus = f"synthetic:{args.synthetic_docs}x{args.synthetic_pages}:seed={args.seed}"
+    else:
+        files, questions = pdf_corpus()
+        corpus = "test.pdf"
+
+    install_backends(tempfile.mkdtemp(prefix="rag-eval-bm25-"))
+    recorder = StageRecorder()
+    capture = FusionCapture()
+    embed_model = load_embed_model(args)
+    llm = stubs.FakeLLM(latency=args.llm_latency)
+
+    # Log của pipeline (print/print_timestamp) rất dài -> tắt trừ khi --verbose
+    quiet = nullcontext() if args.verbose else redirect_stdout(open(os.devnull, "w"))
+    with quiet:
+        ingest_report = ingest(embed_model, files, recorder)
+    print(f"Ingested {ingest_report['documents']} documents, {ingest_report['chunks']} chunks "
+          f"in {ingest_report['seconds']:.2f}s")
+
+    context_chain = rag_pipeline.create_rag_context(llm, embed_model, None, ContextPacker())
+    answer_chain = rag_pipeline.create_answer_chain(rag_pipeline.rag_prompt, llm)
+    with quiet:
+        if args.warmup:
+            replay(questions[:1], context_chain, answer_chain, capture, 1)
+            recorder.take()
+        rows, elapsed = replay(questions * args.repeat, context_chain, answer_chain, capture, args.concurrency)
+
+    report = {
+        "started_at": started_at,
+        "corpus": corpus,
+        "embed_model": getattr(embed_model, "model_name", type(embed_model).__name__),
+        "llm_latency": args.llm_latency,
+        "concurrency": args.concurrency,
+        "questions": len(rows),
+        "ingest": ingest_report,
+        "quality": quality(rows),
+        "e2e": percentiles([row["e2e_ms"] for row in rows]),
+        "questions_per_sec": len(rows) / elapsed,
+        "stages": recorder.take(),
+        "per_question": rows[:len(questions)],
+    }
+
+    print(f"\n{'list':<8} " + " ".join(f"{f'recall@{k}':>10}" for k in KS) + f" {'MRR':>8}")
+    for name in LISTS:
+        metrics = report["quality"][name]
+        print(f"{name:<8} " + " ".join(f"{metrics[f'recall@{k}']:>10.3f}" for k in KS) + f" {metrics['mrr']:>8.3f}")
+    print(f"evidence kept after context packing: {report['quality']['context_hit']:.3f}")
+    missed = [row["id"] for row in report["per_question"] if not row["rank"]["fused"]]
+    if missed:
+        print(f"not retrieved: {', '.join(missed)}")
+
+    print(f"\n{'stage':<24} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, stats in list(report["stages"].items()) + [("e2e", report["e2e"])]:
+        print(f"{stage:<24} {stats['count']:>6} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}")
+    print(f"\n{report['questions_per_sec']:.2f} questions/sec at concurrency {args.concurrency}, "
+          f"ingest {ingest_report['chunks_per_sec']:.1f} chunks/sec")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"rag_eval-{started_at}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Saved {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic-docs", type=int, default=0, help="use a generated corpus instead of test.pdf")
+    parser.add_argument("--synthetic-pages", type=int, default=5, help="pages per synthetic document")
+    parser.add_argument("--questions", type=int, default=50, help="golden questions for the synthetic corpus")
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--embed-model", help="real embedding model instead of the hashing stand-in")
+    parser.add_argument("--embed-dim", type=int, default=384)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--concurrency", type=int, default=1, help="questions in flight")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the question set this many times")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's own log output")
+    parser.add_argument("--output", help="report path (default bench/results/rag_eval-<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier report to diff against")
+    main(parser.parse_args())
@@ -0,0 +1,97 @@
+"""p50/p95 latency of the cross-encoder reranking stage on CPU for 10 and 20 candidates.
+
+Candidates are the 10k-character chunks process_files produces from
+backend/test.pdf, with RRF-like fusion scores that never trigger the
+early-exit, so every mode really scores. Modes:
+- full    : one score() call over untruncated passages (what
+            CrossEncoderReranker did before it was disabled)
+- batched : Reranker (best --windows windows of RERANK_MAX_TOKENS per chunk,
+            batched), no cache, no budget
+- budget  : same, with the latency budget (--budget-ms)
+- cached  : Reranker repeating the same queries (pair-score cache hits)
+
+    cd backend && python -m bench.reranker_latency --candidates 10 20 --queries 20
+"""
+import argparse
+import json
+import time
+
+from langchain_core.documents import Document
+
+from bench.embedding_throughput import load_chunks
+from bench.inference_backends import percentile
+from inference_backends import INFERENCE_BACKEND, load_cross_encoder
+from reranker import Reranker, RERANK_LATENCY_BUDGET_MS, RERANK_WINDOWS
+
+
+def candidates_for(texts, offset: int, n: int):
+    docs = []
+    for rank in range(n):
+        text = texts[(offset + rank) % len(texts)]
+        docs.append(Document(page_content=text, metadata={"fusion_score": 1 / (60 + rank)}))
+    return docs
+
+
+def measure(rerank, queries, texts, n):
+    latencies = []
+    for i, query in enumerate(queries):
+        docs = candidates_for(texts, i, n)
+        started = time.perf_counter()
+        rerank(query, docs)
+        latencies.append(time.perf_counter() - started)
+    return {"p50_ms": percentile(latencies, 50), "p95_ms": percentile(latencies, 95)}
+
+
+def main(args):
+    texts = load_chunks(args.chunk_size, args.chunk_overlap, 2)
+    queries = [text.split(".")[0][:200] for text in texts[::max(1, len(texts) // args.queries)]][:args.queries]
+    cross_encoder = load_cross_encoder(args.model, backend=args.backend)
+    # Warm-up
+    cross_encoder.score([(queries[0], texts[0][:1000])])
+
+    report = []
+    for n in args.candidates:
+        row = {"candidates": n}
+        if not args.skip_full:
+            # Chạy trước khi tạo Reranker: Reranker đặt max_length của model
+            row["full"] = measure(lambda q, docs: cross_encoder.score([(q, d.page_content) for d in docs]),
+                                  queries, texts, n)
+        batched = Reranker(cross_encoder, candidates=n, skip_margin=float("inf"), latency_budget_ms=float("inf"),
+                           cache_size=0, windows=args.windows)
+        row["batched"] = measure(batched.rerank, queries, texts, n)
+        budget = Reranker(cross_encoder, candidates=n, skip_margin=float("inf"), latency_budget_ms=args.budget_ms,
+                          cache_size=0, windows=args.windows)
+        row["budget"] = measure(budget.rerank, queries, texts, n)
+        row["budget_pairs_scored"] = budget.pairs_scored / len(queries)
+        cached = Reranker(cross_encoder, candidates=n, skip_margin=float("inf"), latency_budget_ms=float("inf"),
+                          windows=args.windows)
+        measure(cached.rerank, queries, texts, n)
+        row["cached"] = measure(cached.rerank, queries, texts, n)
+        report.append(row)
+        print(json.dumps(row))
+
+    print(f"\n{'candidates':>10} " + " ".join(f"{mode + ' p50/p95 ms':>24}" for mode in ("full", "batched", "budget", "cached")))
+    for row in report:
+        cells = []
+        for mode in ("full", "batched", "budget", "cached"):
+            cells.append(f"{row[mode]['p50_ms']:>11.0f}/{row[mode]['p95_ms']:<12.0f}" if mode in row else f"{'-':>24}")
+        print(f"{row['candidates']:>10} " + " ".join(cells))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="BAAI/bge-reranker-v2-m3")
+    parser.add_argument("--backend", default=INFERENCE_BACKEND)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[10, 20])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--windows", type=int, default=RERANK_WINDOWS, help="windows scored per chunk")
+    parser.add_argument("--budget-ms", type=float, default=RERANK_LATENCY_BUDGET_MS)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--chunk-overlap", type=int, default=500)
+    parser.add_argument("--skip-full", action="store_true", help="skip the slow untruncated baseline")
+    parser.add_argument("--output", help="write the report as JSON")
+    main(parser.parse_args())
@@ -0,0 +1,196 @@
+"""Lexical search latency: Elasticsearch path vs. the in-process BM25 index (bm25_index).
+
+Corpus: chunks of backend/test.pdf, topped up with chunks re-sampled from its
+sentences to reach each `--chunks` size (one tenant per size). Queries: the
+golden questions of bench/data/golden_test_pdf.json plus random 2-6 word
+queries drawn from the corpus.
+
+- es    : sparse.ElasticsearchBM25 -> elastic_search.bm25_search ->
+          ElasticsearchRetriever, the code the app runs today. Without --es the
+          client is simulated: each search sleeps --es-rtt-ms (a round trip to
+          the managed cluster) and answers with the local index's hits. With
+          --es the real cluster from clients.py is used (needs the API key);
+          the bench index is deleted afterwards and top-10 overlap with the
+          local index is reported.
+- local : sparse.LocalBM25Index in a temp dir — indexing time (one refresh per
+          `--chunks-per-file` chunks, as ingestion does per file), size on disk,
+          cold open (memory-mapped load + first query) and warm query latency.
+
+    cd backend && python -m bench.sparse_backends --chunks 100 1000 10000
+"""
+import argparse
+import json
+import os
+import random
+import re
+import tempfile
+import time
+
+from bench import stubs  # noqa: F401  (dummy env trước khi import module backend)
+
+from elasticsearch import Elasticsearch
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+import clients
+from bench.inference_backends import percentile
+from pdf_loader import iter_pdf_pages
+from sparse import ElasticsearchBM25, LocalBM25Index
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PDF_PATH = os.path.join(BACKEND_DIR, "test.pdf")
+GOLDEN_PATH = os.path.join(BACKEND_DIR, "bench", "data", "golden_test_pdf.json")
+
+
+class SimulatedES(Elasticsearch):
+    """Answers search() from a LocalBM25Index after sleeping one network round trip"""
+
+    def __init__(self, index: LocalBM25Index, rtt: float):
+        super().__init__("http://localhost:9200")
+        self.local = index
+        self.rtt = rtt
+
+    def options(self, **kwargs):
+        # langchain_elasticsearch gắn user-agent qua options(), vốn tạo client mới
+        return self
+
+    def search(self, index, body=None, **kwargs):
+        time.sleep(self.rtt)
+        query = body["query"]["match"]["content"]
+        hits = [{"_index": index, "_id": doc.metadata["_id"], "_score": doc.metadata["_score"],
+                 "_source": {"content": doc.page_content, "source": doc.metadata["source"],
+                             "file_key": doc.metadata["file_key"], "chunk_id": doc.metadata["chunk_id"],
+                             "page": doc.metadata["page"]}}
+                for doc in self.local.search(index, query)]
+        return {"hits": {"hits": hits}}
+
+
+def load_corpus(size: int, rng: random.Random):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    texts = [split.page_content for split in splitter.split_documents(list(iter_pdf_pages(PDF_PATH)))]
+    sentences = [s for text in texts for s in re.split(r"(?<=[.!?])\s+", text) if len(s) > 20]
+    while len(texts) < size:
+        chunk = []
+        while sum(len(s) for s in chunk) < 900:
+            chunk.append(rng.choice(sentences))
+        texts.append(" ".join(chunk))
+    return texts[:size]
+
+
+def make_splits(texts, chunks_per_file: int):
+    return [Document(page_content=text, metadata={
+        "chunk_id": f"chunk-{i}", "file_key": f"bench/{i // chunks_per_file}.pdf",
+        "source": f"{i // chunks_per_file}.pdf", "page": i % chunks_per_file,
+    }) for i, text in enumerate(texts)]
+
+
+def make_queries(texts, count: int, rng: random.Random):
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        queries = [question["question"] for question in json.load(f)["questions"]]
+    while len(queries) < count:
+        words = re.findall(r"\w{3,}", rng.choice(texts))
+        queries.append(" ".join(rng.sample(words, min(len(words), rng.randint(2, 6)))))
+    return queries[:count]
+
+
+def timed(search, queries, repeat: int = 1):
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            started = time.perf_counter()
+            search(query)
+            latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def summary(latencies) -> dict:
+    return {"p50_ms": percentile(latencies, 50), "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99), "qps": len(latencies) / sum(latencies)}
+
+
+def run_size(size: int, args, tmp: str):
+    rng = random.Random(args.seed)
+    texts = load_corpus(size, rng)
+    splits = make_splits(texts, args.chunks_per_file)
+    queries = make_queries(texts, args.queries, rng)
+    username = f"bench-sparse-{size}"
+
+    path = os.path.join(tmp, str(size))
+    local = LocalBM25Index(path)
+    started = time.perf_counter()
+    local.ensure_index(username, reset=True)
+    for start in range(0, len(splits), args.chunks_per_file):
+        local.index_splits(username, splits[start:start + args.chunks_per_file], refresh=False)
+        local.refresh(username)
+    index_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    reopened = LocalBM25Index(path)
+    reopened.search(username, queries[0])
+    cold_ms = (time.perf_counter() - started) * 1000
+    local_latencies = timed(lambda query: reopened.search(username, query), queries, args.repeat)
+
+    es = ElasticsearchBM25()
+    overlap = None
+    if args.es:
+        es.ensure_index(username, reset=True)
+        started = time.perf_counter()
+        for start in range(0, len(splits), 500):
+            es.index_splits(username, splits[start:start + 500], refresh=False)
+        es.refresh(username)
+        es_index_seconds = time.perf_counter() - started
+        shared = [len({d.metadata["_id"] for d in es.search(username, q)}
+                      & {d.metadata["_id"] for d in reopened.search(username, q)}) / 10 for q in queries]
+        overlap = sum(shared) / len(shared)
+    else:
+        clients._es_client = SimulatedES(reopened, args.es_rtt_ms / 1000)
+        es_index_seconds = None
+    clients.forget_collection(username)
+    es_latencies = timed(lambda query: es.search(username, query), queries)
+    if args.es:
+        clients.get_es_client().indices.delete(index=username)
+
+    stats = reopened.stats(username)
+    return {
+        "chunks": size,
+        "queries": len(queries),
+        "es": {"mode": "cluster" if args.es else f"simulated rtt {args.es_rtt_ms:g} ms",
+               "index_seconds": es_index_seconds, "top10_overlap_with_local": overlap, **summary(es_latencies)},
+        "local": {"index_seconds": index_seconds, "chunks_per_sec": size / index_seconds, "cold_open_ms": cold_ms,
+                  "disk_mb": stats["bytes"] / 1e6, "segments": stats["segments"], "terms": stats["terms"],
+                  **summary(local_latencies)},
+    }
+
+
+def main(args):
+    report = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.chunks:
+            row = run_size(size, args, tmp)
+            report.append(row)
+            print(json.dumps(row))
+
+    print(f"\n{'chunks':>7} {'es p50':>8} {'es p95':>8} {'local p50':>10} {'local p95':>10} {'local p99':>10} "
+          f"{'cold ms':>8} {'index s':>8} {'disk MB':>8}")
+    for row in report:
+        es, local = row["es"], row["local"]
+        print(f"{row['chunks']:>7} {es['p50_ms']:>8.2f} {es['p95_ms']:>8.2f} {local['p50_ms']:>10.3f} "
+              f"{local['p95_ms']:>10.3f} {local['p99_ms']:>10.3f} {local['cold_open_ms']:>8.1f} "
+              f"{local['index_seconds']:>8.2f} {local['disk_mb']:>8.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[100, 1000, 10000], help="tenant sizes")
+    parser.add_argument("--chunks-per-file", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the queries for the local index")
+    parser.add_argument("--es", action="store_true", help="query the real cluster instead of simulating it")
+    parser.add_argument("--es-rtt-ms", type=float, default=20, help="simulated round trip to the ES cluster")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write the report as JSON")
+    main(parser.parse_args())
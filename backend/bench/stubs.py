@@ -0,0 +1,199 @@
+"""Local stand-ins for the LLM, embedding model and AWS storage used by the benchmarks.
+
+Import this module before myapi/rag_pipeline: it fills the environment variables
+those modules read at import time with dummy values.
+"""
+import asyncio
+import hashlib
+import math
+import os
+import re
+import time
+from collections import Counter
+from typing import Any, List, Optional
+
+for _name, _value in {
+    "AWS_REGION_NAME": "ap-southeast-1",
+    "AWS_ACCESS_KEY_ID": "bench",
+    "AWS_SECRET_ACCESS_KEY": "bench",
+    "ELASTIC_SEARCH_API_KEY": "bench",
+    "Qdrant_api_key": "bench",
+    "TAVILY_API_KEY": "bench",
+    "GOOGLE_API_KEY": "bench",
+}.items():
+    os.environ.setdefault(_name, _value)
+
+from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeLLM(BaseChatModel):
+    """Chat model that sleeps for `latency` seconds and returns canned text.
+
+    Routing prompts get `route` back so the benchmark controls which branch runs.
+    """
+    latency: float = 0.5
+    route: str = "retrieve"
+    answer: str = "Đây là câu trả lời mẫu dựa trên tài liệu của bạn."
+    # HyDE trả lại chính câu hỏi -> nhánh dense vẫn tìm theo nội dung câu hỏi
+    hyde_echo: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-bench"
+
+    def _reply(self, messages) -> str:
+        text = "\n".join(str(m.content) for m in messages)
+        if "routing classifier" in text:
+            return self.route
+        if self.hyde_echo and "(HyDE)" in text:
+            match = re.search(r'Câu hỏi: "(.*)"', text, re.S)
+            if match:
+                return match.group(1)
+        return self.answer
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = re.findall(r"\S+\s*", self._reply(messages))
+        for token in tokens:
+            await asyncio.sleep(self.latency / max(len(tokens), 1))
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def fake_embeddings(size: int = 1024):
+    return DeterministicFakeEmbedding(size=size)
+
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+class HashingEmbeddings(Embeddings):
+    """Bag-of-words hashed into `size` dimensions (L2-normalized).
+
+    Unlike DeterministicFakeEmbedding, texts sharing words get similar vectors,
+    so dense retrieval quality is meaningful without downloading a model.
+    """
+
+    def __init__(self, size: int = 384):
+        self.size = size
+        self.model_name = f"hashing-bow-{size}"
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.size
+        for token, count in Counter(tokenize(text)).items():
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.size
+            vector[index] += (1.0 if digest[4] & 1 else -1.0) * (1 + math.log(count))
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class InMemoryTable(object):
+    """Tiny subset of the boto3 DynamoDB Table API backed by a dict."""
+
+    def __init__(self, key_names, latency: float = 0.0):
+        self.key_names = key_names
+        self.latency = latency
+        self.items = {}
+
+    def _key(self, key: dict):
+        return tuple(key[name] for name in self.key_names)
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def put_item(self, Item: dict, **kwargs):
+        self._wait()
+        self.items[self._key(Item)] = dict(Item)
+        return {}
+
+    def get_item(self, Key: dict, **kwargs):
+        self._wait()
+        item = self.items.get(self._key(Key))
+        return {"Item": dict(item)} if item is not None else {}
+
+    def delete_item(self, Key: dict, **kwargs):
+        self._wait()
+        self.items.pop(self._key(Key), None)
+        return {}
+
+    def update_item(self, Key: dict, UpdateExpression: str, ExpressionAttributeValues: dict = None,
+                    ExpressionAttributeNames: dict = None, **kwargs):
+        """Supports only plain `SET a = :a, #b = :b` expressions."""
+        self._wait()
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        item = self.items.setdefault(self._key(Key), dict(Key))
+        assignments = UpdateExpression.strip()[len("SET"):].split(",")
+        for assignment in assignments:
+            name, value = (part.strip() for part in assignment.split("="))
+            item[names.get(name, name)] = values[value]
+        return {"Attributes": dict(item)}
+
+
+class HistoryStore(object):
+    """In-memory replacement for rag_pipeline.get_history_session."""
+
+    def __init__(self):
+        self.sessions = {}
+
+    def __call__(self, session_id: str):
+        return self.sessions.setdefault(session_id, InMemoryChatMessageHistory())
+
+
+def sample_documents(n: int = 10) -> List[Document]:
+    return [
+        Document(page_content=f"Đoạn tài liệu số {i} mô tả nội dung mẫu.", metadata={"source": f"doc-{i % 3}.pdf"})
+        for i in range(n)
+    ]
+
+
+def blocking_search(latency: float, docs: Optional[List[Document]] = None):
+    """Search stub that blocks like a network client would."""
+    docs = docs if docs is not None else sample_documents()
+
+    def _search(*args: Any, **kwargs: Any) -> List[Document]:
+        time.sleep(latency)
+        return list(docs)
+
+    return _search
+
+
+class FakeSearchTool(object):
+    """Stand-in for TavilySearch with a fixed latency."""
+
+    def __init__(self, latency: float = 0.3):
+        self.latency = latency
+
+    def invoke(self, query):
+        time.sleep(self.latency)
+        return {"results": [{"content": f"Kết quả web cho: {query}"}]}
+
+    async def ainvoke(self, query):
+        await asyncio.sleep(self.latency)
+        return {"results": [{"content": f"Kết quả web cho: {query}"}]}
@@ -0,0 +1,185 @@
+"""Throughput and peak memory of /api/upload/ against a local S3 stand-in.
+
+Both modes parse the same chunked multipart body through a real Starlette
+Request; the S3 stand-in sleeps `--request-latency-ms` per call plus the
+transfer time at `--bandwidth-mbps` per connection.
+- buffered  : the old endpoint — request.form(), `await file.read()` of each
+              file, then files uploaded one after another (upload_fileobj
+              defaults: 8 MiB parts, 10 threads)
+- streaming : streaming_upload.stream_upload straight from request.stream()
+
+Peak memory is the tracemalloc peak of Python allocations (Starlette spools
+form files above 1 MB to disk, which is not counted).
+
+    cd backend && python -m bench.upload_streaming --files 30 --size-mb 20
+"""
+import argparse
+import asyncio
+import io
+import json
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.requests import Request
+
+import bench.stubs  # noqa: F401  (dummy env trước khi import module backend)
+from streaming_upload import stream_upload, S3_UPLOAD_PART_SIZE, S3_UPLOAD_MAX_INFLIGHT
+
+BOUNDARY = "----benchboundary7MA4YWxkTrZu0gW"
+CHUNK = 64 * 1024
+MB = 1024 * 1024
+
+
+class LocalS3(object):
+    """Thread-safe stand-in for the S3 calls used by the uploaders; keeps only object sizes"""
+
+    def __init__(self, latency: float, bandwidth: float):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.objects = {}
+        self.uploads = {}
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def _transfer(self, size: int = 0):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.latency + size / self.bandwidth)
+        with self._lock:
+            self.active -= 1
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._transfer(len(Body))
+        self.objects[Key] = len(Body)
+        return {"ETag": '"put"'}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._transfer()
+        upload_id = f"{Key}-{time.time()}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._transfer(len(Body))
+        self.uploads[UploadId][PartNumber] = len(Body)
+        return {"ETag": f'"part-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self._transfer()
+        parts = self.uploads.pop(UploadId)
+        assert [p["PartNumber"] for p in MultipartUpload["Parts"]] == sorted(parts)
+        self.objects[Key] = sum(parts.values())
+        return {"ETag": '"multipart"'}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+
+
+def body_chunks(files: int, size: int):
+    """The multipart body, generated chunk by chunk"""
+    payload = bytes(range(256)) * (CHUNK // 256)
+    for i in range(files):
+        yield (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"files\"; filename=\"doc-{i}.pdf\"\r\n"
+               f"Content-Type: application/pdf\r\n\r\n").encode()
+        remaining = size
+        while remaining:
+            n = min(CHUNK, remaining)
+            yield payload[:n]
+            remaining -= n
+        yield b"\r\n"
+    yield f"--{BOUNDARY}--\r\n".encode()
+
+
+def make_request(files: int, size: int) -> Request:
+    chunks = body_chunks(files, size)
+
+    async def receive():
+        chunk = next(chunks, None)
+        if chunk is None:
+            return {"type": "http.request", "body": b"", "more_body": False}
+        return {"type": "http.request", "body": chunk, "more_body": True}
+
+    scope = {"type": "http", "method": "POST", "path": "/api/upload/", "headers": [
+        (b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]}
+    return Request(scope, receive)
+
+
+def upload_fileobj(s3, bucket, key, fileobj, part_size=8 * MB, threads=10):
+    """What boto3's upload_fileobj does with its default TransferConfig"""
+    data = fileobj.read()
+    if len(data) < part_size:
+        return s3.put_object(Bucket=bucket, Key=key, Body=data)
+    upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+    with ThreadPoolExecutor(threads) as pool:
+        futures = [pool.submit(s3.upload_part, Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=n + 1,
+                               Body=data[start:start + part_size])
+                   for n, start in enumerate(range(0, len(data), part_size))]
+        parts = [{"PartNumber": n + 1, "ETag": f.result()["ETag"]} for n, f in enumerate(futures)]
+    return s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+
+
+async def buffered(request: Request, s3):
+    form = await request.form()
+    loop = asyncio.get_running_loop()
+    for i, file in enumerate(form.getlist("files")):
+        contents = await file.read()
+        file_stream = io.BytesIO(contents)
+        # Endpoint cũ gọi upload đồng bộ, từng file một
+        await loop.run_in_executor(None, upload_fileobj, s3, "arag", f"bench/{i}_{file.filename}", file_stream)
+    await form.close()
+
+
+async def streaming(request: Request, s3, part_size: int, max_inflight: int):
+    results = await stream_upload(request.stream(), request.headers["content-type"], s3, "arag", "bench",
+                                  part_size=part_size, max_inflight=max_inflight)
+    assert all("key" in result for result in results), results
+
+
+def run(mode: str, args):
+    s3 = LocalS3(args.request_latency_ms / 1000, args.bandwidth_mbps * MB / 8)
+    request = make_request(args.files, int(args.size_mb * MB))
+    tracemalloc.start()
+    started = time.perf_counter()
+    if mode == "buffered":
+        asyncio.run(buffered(request, s3))
+    else:
+        asyncio.run(streaming(request, s3, args.part_size_mb * MB, args.max_inflight))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    total = args.files * args.size_mb
+    assert len(s3.objects) == args.files and all(size == int(args.size_mb * MB) for size in s3.objects.values())
+    return {"mode": mode, "seconds": elapsed, "mb_per_sec": total / elapsed, "peak_mb": peak / MB,
+            "s3_calls": s3.calls, "max_concurrent_calls": s3.max_active}
+
+
+def main(args):
+    report = [run(mode, args) for mode in args.modes]
+    for row in report:
+        print(json.dumps(row))
+    print(f"\n{'mode':>10} {'seconds':>8} {'MB/s':>8} {'peak MB':>8} {'S3 calls':>9} {'max conc':>9}")
+    for row in report:
+        print(f"{row['mode']:>10} {row['seconds']:>8.2f} {row['mb_per_sec']:>8.1f} {row['peak_mb']:>8.1f} "
+              f"{row['s3_calls']:>9} {row['max_concurrent_calls']:>9}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=30)
+    parser.add_argument("--size-mb", type=float, default=20)
+    parser.add_argument("--modes", nargs="+", default=["buffered", "streaming"])
+    parser.add_argument("--part-size-mb", type=int, default=S3_UPLOAD_PART_SIZE // MB)
+    parser.add_argument("--max-inflight", type=int, default=S3_UPLOAD_MAX_INFLIGHT)
+    parser.add_argument("--request-latency-ms", type=float, default=30)
+    parser.add_argument("--bandwidth-mbps", type=float, default=400, help="per connection, megabits/s")
+    parser.add_argument("--output", help="write the report as JSON")
+    main(parser.parse_args())
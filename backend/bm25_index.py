@@ -0,0 +1,391 @@
+import fcntl
+import heapq
+import json
+import mmap
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Optional
+from urllib.parse import quote
+
+import numpy as np
+from langchain_core.documents import Document
+
+# ==== In-process BM25 ====
+# Inverted index local thay cho Elasticsearch (SPARSE_BACKEND=local):
+# - mỗi user một thư mục gồm các segment bất biến + manifest.json
+# - segment = term dictionary (terms.txt) + postings dạng mảng numpy
+#   (offsets / doc ids int32 / tf uint16) + độ dài doc + nội dung chunk;
+#   mảng và nội dung được memory-map khi load, không đọc hết vào RAM
+# - index_splits gom chunk vào buffer, refresh ghi buffer thành segment mới
+#   (giống refresh của ES: chỉ thấy khi đã refresh)
+# - xóa = bitmap deleted (file mới mỗi lần, copy-on-write); quá
+#   BM25_MAX_SEGMENTS segment (hoặc user còn nhỏ) thì gộp segment và bỏ doc đã xóa
+# API và worker là hai process: ghi giữ flock trên thư mục user, đọc kiểm tra
+# inode của manifest.json để load lại khi worker vừa commit.
+# Điểm số theo công thức BM25 của Lucene (như ES): idf * tf / (tf + k1 * (1 - b + b * dl / avgdl)).
+BM25_INDEX_DIR = os.getenv("BM25_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "bm25"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# ES trả về 10 hit mặc định
+BM25_TOP_K = int(os.getenv("BM25_TOP_K", "10"))
+BM25_MAX_SEGMENTS = int(os.getenv("BM25_MAX_SEGMENTS", "8"))
+# User nhỏ (<= số chunk này) luôn được gộp thành một segment: query nhanh nhất, ghi lại rẻ
+BM25_MERGE_ALL_DOCS = int(os.getenv("BM25_MERGE_ALL_DOCS", "2000"))
+
+MANIFEST = "manifest.json"
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+_MAX_TF = np.iinfo(np.uint16).max
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens, close to the ES standard analyzer"""
+    return _TOKEN.findall(text.lower())
+
+
+def _atomic_write(path: str, write):
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def write_segment(path: str, docs: List[dict]):
+    """Build an immutable segment from {chunk_id, content, source, file_key, page} dicts"""
+    vocabulary = {}
+    term_ids, doc_ids, freqs = [], [], []
+    lengths = np.zeros(len(docs), dtype=np.int32)
+    for doc_id, doc in enumerate(docs):
+        counts = Counter(tokenize(doc["content"]))
+        lengths[doc_id] = sum(counts.values())
+        term_ids.extend(vocabulary.setdefault(term, len(vocabulary)) for term in counts)
+        doc_ids.extend([doc_id] * len(counts))
+        freqs.extend(counts.values())
+
+    # Sắp postings theo thứ tự term (stable -> doc id trong mỗi list vẫn tăng dần)
+    terms = sorted(vocabulary)
+    rank = np.empty(len(terms), dtype=np.int64)
+    rank[[vocabulary[term] for term in terms]] = np.arange(len(terms))
+    term_ranks = rank[np.asarray(term_ids, dtype=np.int64)]
+    order = np.argsort(term_ranks, kind="stable")
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_ranks, minlength=len(terms)), out=offsets[1:])
+    doc_ids = np.asarray(doc_ids, dtype=np.int32)[order]
+    freqs = np.minimum(np.asarray(freqs, dtype=np.int64), _MAX_TF).astype(np.uint16)[order]
+
+    contents = [doc["content"].encode("utf-8") for doc in docs]
+    content_offsets = np.zeros(len(docs) + 1, dtype=np.int64)
+    np.cumsum([len(content) for content in contents], out=content_offsets[1:])
+
+    tmp = f"{path}.tmp"
+    os.makedirs(tmp)
+    with open(os.path.join(tmp, "terms.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(terms))
+    np.save(os.path.join(tmp, "offsets.npy"), offsets)
+    np.save(os.path.join(tmp, "docs.npy"), doc_ids)
+    np.save(os.path.join(tmp, "freqs.npy"), freqs)
+    np.save(os.path.join(tmp, "lengths.npy"), lengths)
+    np.save(os.path.join(tmp, "content_offsets.npy"), content_offsets)
+    with open(os.path.join(tmp, "content.bin"), "wb") as f:
+        f.writelines(contents)
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump([[doc["chunk_id"], doc["source"], doc["file_key"], doc["page"]] for doc in docs], f,
+                  ensure_ascii=False)
+    os.rename(tmp, path)
+
+
+def _mapped(path: str) -> np.ndarray:
+    # view ndarray thường trên cùng vùng mmap: np.memmap tốn thêm overhead mỗi lần slice
+    return np.load(path, mmap_mode="r").view(np.ndarray)
+
+
+class Segment(object):
+    """Read-only view of one segment; postings and contents are memory-mapped"""
+
+    def __init__(self, path: str, name: str, deleted: Optional[str] = None):
+        self.name = name
+        self.deleted_file = deleted
+        directory = os.path.join(path, name)
+        with open(os.path.join(directory, "terms.txt"), encoding="utf-8") as f:
+            text = f.read()
+        self.term_ids = {term: i for i, term in enumerate(text.split("\n"))} if text else {}
+        self.offsets = _mapped(os.path.join(directory, "offsets.npy"))
+        self.docs = _mapped(os.path.join(directory, "docs.npy"))
+        self.freqs = _mapped(os.path.join(directory, "freqs.npy"))
+        self.lengths = _mapped(os.path.join(directory, "lengths.npy"))
+        self.content_offsets = _mapped(os.path.join(directory, "content_offsets.npy"))
+        with open(os.path.join(directory, "content.bin"), "rb") as f:
+            # mmap không nhận file rỗng (segment toàn chunk rỗng)
+            self.content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.size = len(self.meta)
+        self.total_length = int(self.lengths.sum())
+        self.deleted = np.load(os.path.join(path, deleted)) if deleted else np.zeros(self.size, dtype=bool)
+        self.live = self.size - int(self.deleted.sum())
+        self._norms = (None, None)
+
+    def norms(self, k1: float, b: float, average_length: float) -> np.ndarray:
+        """k1 * (1 - b + b * dl / avgdl) per doc, cached until the index-wide average changes"""
+        key, norms = self._norms
+        if key != (k1, b, average_length):
+            norms = (k1 * (1 - b + b * self.lengths / average_length)).astype(np.float32)
+            self._norms = ((k1, b, average_length), norms)
+        return norms
+
+    def postings(self, term: str):
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return None
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.docs[start:end], self.freqs[start:end]
+
+    def text(self, doc_id: int) -> str:
+        return bytes(self.content[self.content_offsets[doc_id]:self.content_offsets[doc_id + 1]]).decode("utf-8")
+
+    def stored(self, doc_id: int) -> dict:
+        chunk_id, source, file_key, page = self.meta[doc_id]
+        return {"chunk_id": chunk_id, "content": self.text(doc_id), "source": source, "file_key": file_key,
+                "page": page}
+
+
+class _UserIndex(object):
+    """Segments of one user; `snapshot` = (manifest version, segments) is swapped as a whole"""
+
+    def __init__(self):
+        self.snapshot = (None, [])
+        self.pending = {}  # chunk_id -> stored fields, chưa refresh
+        self.lock = threading.Lock()
+
+
+class LocalBM25Index(object):
+    """Per-user BM25 indexes on local disk, same contract as the Elasticsearch functions"""
+
+    def __init__(self, path: str = BM25_INDEX_DIR, k1: float = BM25_K1, b: float = BM25_B,
+                 top_k: int = BM25_TOP_K, max_segments: int = BM25_MAX_SEGMENTS,
+                 merge_all_docs: int = BM25_MERGE_ALL_DOCS):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.top_k = top_k
+        self.max_segments = max_segments
+        self.merge_all_docs = merge_all_docs
+        self._users = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _dir(self, username: str) -> str:
+        return os.path.join(self.path, quote(username, safe=""))
+
+    def _user(self, username: str) -> _UserIndex:
+        with self._lock:
+            user = self._users.get(username)
+            if user is None:
+                user = self._users[username] = _UserIndex()
+            return user
+
+    def _current(self, username: str) -> List[Segment]:
+        """The user's segments, reloaded if another process committed since the last load"""
+        user = self._user(username)
+        directory = self._dir(username)
+        for _ in range(3):
+            try:
+                stat = os.stat(os.path.join(directory, MANIFEST))
+            except FileNotFoundError:
+                user.snapshot = (None, [])
+                return []
+            version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            current_version, current = user.snapshot
+            if version == current_version:
+                return current
+            try:
+                with open(os.path.join(directory, MANIFEST), encoding="utf-8") as f:
+                    manifest = json.load(f)
+                loaded = {segment.name: segment for segment in current}
+                segments = []
+                for entry in manifest["segments"]:
+                    segment = loaded.get(entry["name"])
+                    if segment is None or segment.deleted_file != entry["deleted"]:
+                        segment = Segment(directory, entry["name"], entry["deleted"])
+                    segments.append(segment)
+            except FileNotFoundError:
+                # Writer vừa commit và dọn file cũ giữa lúc đọc -> đọc lại manifest mới
+                continue
+            user.snapshot = (version, segments)
+            return segments
+        raise RuntimeError(f"BM25 index of {username} keeps changing while loading")
+
+    @contextmanager
+    def _writing(self, username: str):
+        """Exclusive (threads and processes) access to the user's directory, with its latest segments"""
+        directory = self._dir(username)
+        os.makedirs(directory, exist_ok=True)
+        user = self._user(username)
+        with user.lock, open(os.path.join(directory, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._current(username)
+                yield user
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _commit(self, username: str, segments: List[Segment]):
+        directory = self._dir(username)
+        manifest = {"segments": [{"name": s.name, "deleted": s.deleted_file} for s in segments]}
+        _atomic_write(os.path.join(directory, MANIFEST),
+                      lambda f: f.write(json.dumps(manifest).encode("utf-8")))
+        stat = os.stat(os.path.join(directory, MANIFEST))
+        self._user(username).snapshot = ((stat.st_ino, stat.st_mtime_ns, stat.st_size), list(segments))
+        # Process khác đang map file cũ vẫn đọc được sau khi unlink
+        used = {s.name for s in segments} | {s.deleted_file for s in segments} | {MANIFEST, ".lock"}
+        for name in os.listdir(directory):
+            if name not in used and not name.endswith(".tmp"):
+                target = os.path.join(directory, name)
+                shutil.rmtree(target) if os.path.isdir(target) else os.remove(target)
+
+    @staticmethod
+    def _with_deleted(directory: str, segment: Segment, mask: np.ndarray) -> Segment:
+        deleted = segment.deleted | mask
+        name = f"deleted-{segment.name}-{uuid.uuid4().hex[:8]}.npy"
+        _atomic_write(os.path.join(directory, name), lambda f: np.save(f, deleted))
+        return Segment(directory, segment.name, name)
+
+    def _delete_where(self, directory: str, segments: List[Segment], predicate):
+        """Segments with every live doc matching predicate(chunk_id, file_key) marked deleted"""
+        result, removed = [], 0
+        for segment in segments:
+            mask = np.array([predicate(chunk_id, file_key) for chunk_id, _, file_key, _ in segment.meta], dtype=bool)
+            mask &= ~segment.deleted
+            count = int(mask.sum())
+            removed += count
+            result.append(self._with_deleted(directory, segment, mask) if count else segment)
+        return result, removed
+
+    def _merge(self, directory: str, segments: List[Segment]) -> List[Segment]:
+        segments = [segment for segment in segments if segment.live]
+        if len(segments) > 1 and sum(segment.live for segment in segments) <= self.merge_all_docs:
+            keep, merged = [], segments
+        elif len(segments) > self.max_segments:
+            # Giữ nguyên nửa lớn nhất, gộp phần còn lại -> segment lớn không bị ghi lại mỗi lần
+            segments = sorted(segments, key=lambda segment: -segment.live)
+            keep, merged = segments[:self.max_segments // 2], segments[self.max_segments // 2:]
+        else:
+            return segments
+        docs = [segment.stored(doc_id) for segment in merged for doc_id in np.flatnonzero(~segment.deleted)]
+        name = f"seg-{uuid.uuid4().hex[:12]}"
+        write_segment(os.path.join(directory, name), docs)
+        return keep + [Segment(directory, name)]
+
+    # ---- contract của elastic_search ----
+
+    def ensure_index(self, username: str, reset: bool = False):
+        with self._writing(username) as user:
+            if reset:
+                user.pending.clear()
+                self._commit(username, [])
+            elif user.snapshot[0] is None:
+                self._commit(username, [])
+
+    def index_splits(self, username: str, splits, refresh: bool = True) -> int:
+        user = self._user(username)
+        with user.lock:
+            for doc in splits:
+                user.pending[doc.metadata["chunk_id"]] = {
+                    "chunk_id": doc.metadata["chunk_id"],
+                    "content": doc.page_content,
+                    "source": doc.metadata.get("source", ""),
+                    "file_key": doc.metadata.get("file_key", ""),
+                    "page": doc.metadata.get("page"),
+                }
+        if refresh:
+            self.refresh(username)
+        return len(splits)
+
+    def refresh(self, username: str):
+        """Make buffered chunks searchable as one new segment"""
+        with self._writing(username) as user:
+            if not user.pending:
+                return
+            directory = self._dir(username)
+            docs = list(user.pending.values())
+            # Cùng chunk_id = ghi đè (như index op của ES)
+            segments, _ = self._delete_where(directory, user.snapshot[1], lambda chunk_id, _: chunk_id in user.pending)
+            name = f"seg-{uuid.uuid4().hex[:12]}"
+            write_segment(os.path.join(directory, name), docs)
+            segments = self._merge(directory, segments + [Segment(directory, name)])
+            self._commit(username, segments)
+            user.pending.clear()
+
+    def delete_document(self, username: str, file_key: str, refresh: bool = True) -> int:
+        """Remove every chunk of one document; deletes are visible immediately"""
+        if not os.path.exists(os.path.join(self._dir(username), MANIFEST)):
+            return 0
+        with self._writing(username) as user:
+            pending = [chunk_id for chunk_id, doc in user.pending.items() if doc["file_key"] == file_key]
+            for chunk_id in pending:
+                del user.pending[chunk_id]
+            directory = self._dir(username)
+            segments, removed = self._delete_where(directory, user.snapshot[1], lambda _, key: key == file_key)
+            if removed:
+                self._commit(username, self._merge(directory, segments))
+            return removed + len(pending)
+
+    def search(self, username: str, query: str, top_k: Optional[int] = None) -> List[Document]:
+        segments = self._current(username)
+        terms = Counter(tokenize(query))
+        # Thống kê như Lucene: doc đã xóa vẫn được tính cho tới khi merge
+        count = sum(segment.size for segment in segments)
+        if not terms or not count:
+            return []
+        average_length = max(sum(segment.total_length for segment in segments) / count, 1e-9)
+        postings = [[segment.postings(term) for term in terms] for segment in segments]
+        weights = []
+        for i, (term, repeats) in enumerate(terms.items()):
+            df = sum(len(per_segment[i][0]) for per_segment in postings if per_segment[i] is not None)
+            weights.append(repeats * np.log1p((count - df + 0.5) / (df + 0.5)) if df else 0.0)
+
+        top_k = top_k or self.top_k
+        best = []
+        for segment, per_segment in zip(segments, postings):
+            scores = np.zeros(segment.size, dtype=np.float32)
+            norms = segment.norms(self.k1, self.b, average_length)
+            for weight, entry in zip(weights, per_segment):
+                if entry is None or not weight:
+                    continue
+                doc_ids, freqs = entry
+                tf = freqs.astype(np.float32)
+                # doc id trong một postings list là duy nhất -> cộng theo index được
+                scores[doc_ids] += weight * tf / (tf + norms[doc_ids])
+            if segment.live < segment.size:
+                scores[segment.deleted] = 0
+            hits = np.flatnonzero(scores)
+            if len(hits) > top_k:
+                hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+            best.extend((float(scores[doc_id]), segment, int(doc_id)) for doc_id in hits)
+
+        results = []
+        for score, segment, doc_id in heapq.nlargest(top_k, best, key=lambda hit: hit[0]):
+            chunk_id, source, file_key, page = segment.meta[doc_id]
+            results.append(Document(
+                page_content=segment.text(doc_id),
+                metadata={"source": source, "file_key": file_key, "chunk_id": chunk_id, "page": page,
+                          "_id": chunk_id, "_score": score, "_index": username}
+            ))
+        return results
+
+    def stats(self, username: str) -> dict:
+        segments = self._current(username)
+        return {
+            "segments": len(segments),
+            "documents": sum(segment.live for segment in segments),
+            "deleted": sum(segment.size - segment.live for segment in segments),
+            "terms": sum(len(segment.term_ids) for segment in segments),
+            "bytes": sum(os.path.getsize(os.path.join(root, name))
+                         for root, _, names in os.walk(self._dir(username)) for name in names),
+        }
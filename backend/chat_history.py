@@ -0,0 +1,305 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from telemetry import span, in_context
+from util import print_timestamp
+
+# ==== Bounded conversation history ====
+# Mỗi message là một item riêng trong bảng ChatMessages
+#   user_id (PK) | message_key = "<conv_id>#<seq 10 chữ số>" (SK)
+# nên thêm message là ghi O(1) và đọc lịch sử có thể phân trang.
+# Item trong bảng Conversations giữ bộ đếm message_count (cấp seq), bản tóm tắt
+# cuộn `summary` và `summarized_until` (seq cuối cùng đã được tóm tắt).
+# LLM nhận bản tóm tắt + mọi message chưa được tóm tắt: HISTORY_WINDOW_MESSAGES
+# message gần nhất cộng tối đa HISTORY_SUMMARY_BATCH - 1 message đã rời cửa sổ
+# nhưng chưa đủ một batch để tóm tắt (không message nào bị bỏ quên).
+CHAT_MESSAGES_TABLE = os.getenv("CHAT_MESSAGES_TABLE", "ChatMessages")
+CONVERSATIONS_TABLE = os.getenv("CONVERSATIONS_TABLE", "Conversations")
+HISTORY_WINDOW_MESSAGES = int(os.getenv("HISTORY_WINDOW_MESSAGES", "12"))
+# Chỉ tóm tắt lại khi đã có thêm ít nhất chừng này message rơi ra khỏi cửa sổ
+HISTORY_SUMMARY_BATCH = int(os.getenv("HISTORY_SUMMARY_BATCH", "8"))
+HISTORY_SUMMARY_MAX_CHARS = int(os.getenv("HISTORY_SUMMARY_MAX_CHARS", "2000"))
+
+region = os.getenv("AWS_REGION_NAME")
+dynamodb = boto3.resource('dynamodb', region_name=region)
+
+_SEQ_WIDTH = 10
+
+
+def message_key(conv_id: str, seq: int) -> str:
+    return f"{conv_id}#{seq:0{_SEQ_WIDTH}d}"
+
+
+def _message_type(message: BaseMessage) -> str:
+    return "human" if isinstance(message, HumanMessage) else "ai"
+
+
+def _to_message(item: dict) -> BaseMessage:
+    if item.get("type") == "human":
+        return HumanMessage(content=item.get("content", ""))
+    return AIMessage(content=item.get("content", ""))
+
+
+def _legacy_entry(entry):
+    """(type, content) of one entry of the old DynamoDBChatMessageHistory `history` list"""
+    if isinstance(entry, dict):
+        entry_type = entry.get("type") or entry.get("role") or ""
+        data = entry.get("data") or {}
+        content = data.get("content") or entry.get("content") or ""
+    else:
+        entry_type, content = "ai", str(entry)
+    return ("human" if entry_type in ("human", "user") else "ai"), content
+
+
+class ConversationStore(object):
+    """DynamoDB access for messages, counters and summaries of conversations."""
+
+    def __init__(self, messages_table=None, conversations_table=None):
+        self.messages = messages_table or dynamodb.Table(CHAT_MESSAGES_TABLE)
+        self.conversations = conversations_table or dynamodb.Table(CONVERSATIONS_TABLE)
+
+    def _conversation(self, user_id: str, conv_id: str) -> dict:
+        response = self.conversations.get_item(Key={"user_id": user_id, "conv_id": conv_id})
+        return response.get("Item", {})
+
+    def _reserve(self, user_id: str, conv_id: str, count: int) -> int:
+        """Atomically reserve `count` sequence numbers; returns the first one"""
+        response = self.conversations.update_item(
+            Key={"user_id": user_id, "conv_id": conv_id},
+            UpdateExpression="ADD message_count :n",
+            ExpressionAttributeValues={":n": count},
+            ReturnValues="UPDATED_NEW"
+        )
+        return int(response["Attributes"]["message_count"]) - count + 1
+
+    def _put(self, user_id: str, conv_id: str, first_seq: int, entries: Sequence[tuple]):
+        timestamp = datetime.now(timezone.utc).isoformat()
+        with self.messages.batch_writer() as batch:
+            for offset, (message_type, content) in enumerate(entries):
+                seq = first_seq + offset
+                batch.put_item(Item={
+                    "user_id": user_id,
+                    "message_key": message_key(conv_id, seq),
+                    "seq": seq,
+                    "type": message_type,
+                    "content": content,
+                    "created_at": timestamp,
+                })
+
+    def migrate_legacy(self, user_id: str, conv_id: str, item: dict = None) -> dict:
+        """Move the old single-item `history` list into message items (once)"""
+        item = item if item is not None else self._conversation(user_id, conv_id)
+        legacy = item.get("history")
+        if not isinstance(legacy, list) or "message_count" in item:
+            return item
+        entries = [_legacy_entry(entry) for entry in legacy]
+        # Ghi các message trước (khóa theo seq nên ghi lại không sao): nếu lỗi/chết giữa
+        # chừng thì `history` vẫn còn và lần sau migrate lại từ đầu
+        self._put(user_id, conv_id, 1, entries)
+        try:
+            # Điều kiện: chưa ai migrate -> chỉ một request đặt message_count
+            self.conversations.update_item(
+                Key={"user_id": user_id, "conv_id": conv_id},
+                UpdateExpression="SET message_count = :count REMOVE history",
+                ConditionExpression="attribute_not_exists(message_count)",
+                ExpressionAttributeValues={":count": len(entries)}
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return self._conversation(user_id, conv_id)
+            raise
+        item = dict(item, message_count=len(entries))
+        item.pop("history", None)
+        return item
+
+    def append(self, user_id: str, conv_id: str, messages: Sequence[BaseMessage]) -> int:
+        """Write messages as new items; returns the conversation's message count"""
+        if not messages:
+            return 0
+        first_seq = self._reserve(user_id, conv_id, len(messages))
+        self._put(user_id, conv_id, first_seq,
+                  [(_message_type(message), str(message.content)) for message in messages])
+        return first_seq + len(messages) - 1
+
+    def page(self, user_id: str, conv_id: str, limit: int, before: Optional[int] = None,
+             after: int = 0) -> List[dict]:
+        """Up to `limit` items with after < seq < before, newest first"""
+        upper = message_key(conv_id, before) if before is not None else f"{conv_id}#{'9' * (_SEQ_WIDTH + 1)}"
+        response = self.messages.query(
+            KeyConditionExpression=Key("user_id").eq(user_id)
+            & Key("message_key").between(message_key(conv_id, after + 1), upper),
+            ScanIndexForward=False,
+            # `between` là khoảng đóng -> lấy dư một item cho trường hợp seq == before
+            Limit=limit + 1
+        )
+        items = [item for item in response.get("Items", []) if before is None or int(item["seq"]) < before]
+        return items[:limit]
+
+    def recent(self, user_id: str, conv_id: str) -> tuple:
+        """(summary, every message not folded into the summary yet oldest first, conversation item)"""
+        item = self.migrate_legacy(user_id, conv_id)
+        summarized_until = int(item.get("summarized_until", 0))
+        message_count = int(item.get("message_count", 0))
+        messages = self.range(user_id, conv_id, summarized_until, message_count) \
+            if message_count > summarized_until else []
+        return item.get("summary", ""), messages, item
+
+    def range(self, user_id: str, conv_id: str, after: int, until: int) -> List[BaseMessage]:
+        """Messages with after < seq <= until, oldest first"""
+        messages = []
+        start_key = None
+        while True:
+            kwargs = {
+                "KeyConditionExpression": Key("user_id").eq(user_id)
+                & Key("message_key").between(message_key(conv_id, after + 1), message_key(conv_id, until)),
+            }
+            if start_key:
+                kwargs["ExclusiveStartKey"] = start_key
+            response = self.messages.query(**kwargs)
+            messages.extend(_to_message(i) for i in response.get("Items", []))
+            start_key = response.get("LastEvaluatedKey")
+            if not start_key:
+                return messages
+
+    def save_summary(self, user_id: str, conv_id: str, summary: str, until: int, previous: int) -> bool:
+        try:
+            self.conversations.update_item(
+                Key={"user_id": user_id, "conv_id": conv_id},
+                UpdateExpression="SET summary = :summary, summarized_until = :until",
+                # Chỉ ghi nếu không có bản tóm tắt mới hơn được ghi trong lúc gọi LLM
+                ConditionExpression="attribute_not_exists(summarized_until) OR summarized_until = :previous",
+                ExpressionAttributeValues={":summary": summary, ":until": until, ":previous": previous}
+            )
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+
+    def delete(self, user_id: str, conv_id: str):
+        """Delete every message item of a conversation"""
+        start_key = None
+        while True:
+            kwargs = {
+                "KeyConditionExpression": Key("user_id").eq(user_id) & Key("message_key").begins_with(f"{conv_id}#"),
+                "ProjectionExpression": "user_id, message_key",
+            }
+            if start_key:
+                kwargs["ExclusiveStartKey"] = start_key
+            response = self.messages.query(**kwargs)
+            with self.messages.batch_writer() as batch:
+                for item in response.get("Items", []):
+                    batch.delete_item(Key={"user_id": item["user_id"], "message_key": item["message_key"]})
+            start_key = response.get("LastEvaluatedKey")
+            if not start_key:
+                return
+
+
+_summary_prompt = """Bạn tóm tắt một cuộc hội thoại giữa người dùng và trợ lý.
+Kết hợp bản tóm tắt hiện có với các tin nhắn mới thành một bản tóm tắt ngắn gọn
+(tối đa {max_chars} ký tự), giữ lại tên riêng, số liệu, yêu cầu và kết luận quan trọng.
+
+Bản tóm tắt hiện có:
+{summary}
+
+Tin nhắn mới:
+{messages}
+
+Bản tóm tắt mới:"""
+
+
+class HistorySummarizer(object):
+    """Folds messages that left the window into the rolling summary, off the request path."""
+
+    def __init__(self, llm, store: ConversationStore = None, window: int = HISTORY_WINDOW_MESSAGES,
+                 batch: int = HISTORY_SUMMARY_BATCH, max_chars: int = HISTORY_SUMMARY_MAX_CHARS):
+        self.llm = llm
+        self.store = store
+        self.window = window
+        self.batch = batch
+        self.max_chars = max_chars
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def maybe_schedule(self, user_id: str, conv_id: str, message_count: int, summarized_until: int):
+        until = message_count - self.window
+        if until - summarized_until < self.batch:
+            return
+        with self._lock:
+            if (user_id, conv_id) in self._running:
+                return
+            self._running.add((user_id, conv_id))
+        self._executor.submit(in_context(self._summarize), user_id, conv_id, until, summarized_until)
+
+    def _summarize(self, user_id: str, conv_id: str, until: int, summarized_until: int):
+        store = self.store or ConversationStore()
+        try:
+            item = store.migrate_legacy(user_id, conv_id)
+            messages = store.range(user_id, conv_id, summarized_until, until)
+            transcript = "\n".join(
+                f"{'Người dùng' if isinstance(m, HumanMessage) else 'Trợ lý'}: {m.content}" for m in messages
+            )
+            with span("history.summarize", messages=len(messages)):
+                response = self.llm.invoke(_summary_prompt.format(
+                    max_chars=self.max_chars, summary=item.get("summary", "") or "(chưa có)", messages=transcript
+                ))
+            summary = str(getattr(response, "content", response)).strip()[:self.max_chars]
+            if store.save_summary(user_id, conv_id, summary, until, summarized_until):
+                print_timestamp(f"🧾 [History] summarized {conv_id} up to message {until}")
+        except Exception as e:
+            print_timestamp(f"⚠️ [History] summarization failed for {conv_id}: {e!r}")
+        finally:
+            with self._lock:
+                self._running.discard((user_id, conv_id))
+
+
+class WindowedChatHistory(BaseChatMessageHistory):
+    """Chat history for RunnableWithMessageHistory: rolling summary + the unsummarized messages.
+
+    The summarizer folds messages once a batch of them has left its window, so
+    the unsummarized tail stays within window + batch - 1 messages.
+    """
+
+    def __init__(self, user_id: str, conv_id: str, store: ConversationStore = None,
+                 summarizer: HistorySummarizer = None):
+        self.user_id = user_id
+        self.conv_id = conv_id
+        self.store = store or ConversationStore()
+        self.summarizer = summarizer
+        self._summarized_until = 0
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        with span("history.read"):
+            summary, messages, item = self.store.recent(self.user_id, self.conv_id)
+        self._summarized_until = int(item.get("summarized_until", 0))
+        if not summary:
+            return messages
+        # Cặp human/ai để giữ thứ tự luân phiên của hội thoại
+        return [
+            HumanMessage(content=f"Tóm tắt phần hội thoại trước:\n{summary}"),
+            AIMessage(content="Đã nắm được bối cảnh."),
+        ] + messages
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        with span("history.write"):
+            count = self.store.append(self.user_id, self.conv_id, list(messages))
+        if self.summarizer is not None and count:
+            self.summarizer.maybe_schedule(self.user_id, self.conv_id, count, self._summarized_until)
+
+    def clear(self) -> None:
+        self.store.delete(self.user_id, self.conv_id)
+        self.store.conversations.update_item(
+            Key={"user_id": self.user_id, "conv_id": self.conv_id},
+            UpdateExpression="REMOVE summary, summarized_until, message_count"
+        )
@@ -0,0 +1,99 @@
+import os
+import threading
+
+from elasticsearch import Elasticsearch
+from langchain_elasticsearch import ElasticsearchRetriever
+from langchain_qdrant import QdrantVectorStore
+from qdrant_client import QdrantClient
+
+# ==== Backend clients ====
+# Một client Qdrant và một client Elasticsearch cho cả process: cả hai giữ
+# connection pool keep-alive, nên mỗi query chỉ tốn round trip tìm kiếm.
+QDRANT_URL = "https://6fbd9042-2153-49e0-8c5b-d9da2f8d9e60.us-west-2-0.aws.cloud.qdrant.io:6333"
+ELASTIC_SEARCH_URL = "https://my-elasticsearch-project-b2562c.es.ap-southeast-1.aws.elastic.cloud:443"
+
+ES_CONNECTIONS_PER_NODE = int(os.getenv("ES_CONNECTIONS_PER_NODE", "16"))
+
+_lock = threading.Lock()
+_qdrant_client = None
+_es_client = None
+_vector_stores = {}
+_bm25_retrievers = {}
+
+
+def get_qdrant_client() -> QdrantClient:
+    global _qdrant_client
+    if _qdrant_client is None:
+        with _lock:
+            if _qdrant_client is None:
+                _qdrant_client = QdrantClient(
+                    url=QDRANT_URL,
+                    api_key=os.environ["Qdrant_api_key"],
+                    timeout=30
+                )
+    return _qdrant_client
+
+
+def get_es_client() -> Elasticsearch:
+    global _es_client
+    if _es_client is None:
+        with _lock:
+            if _es_client is None:
+                _es_client = Elasticsearch(
+                    ELASTIC_SEARCH_URL,
+                    api_key=os.environ["ELASTIC_SEARCH_API_KEY"],
+                    connections_per_node=ES_CONNECTIONS_PER_NODE
+                )
+    return _es_client
+
+
+def get_vector_store(collection_name: str, embed_model) -> QdrantVectorStore:
+    """Cached per-collection store; the collection is validated only on first use."""
+    store = _vector_stores.get(collection_name)
+    if store is None:
+        store = QdrantVectorStore(
+            client=get_qdrant_client(),
+            collection_name=collection_name,
+            embedding=embed_model
+        )
+        _vector_stores[collection_name] = store
+    return store
+
+
+def get_bm25_retriever(index_name: str, body_func, content_field: str, document_mapper=None) -> ElasticsearchRetriever:
+    retriever = _bm25_retrievers.get(index_name)
+    if retriever is None:
+        retriever = ElasticsearchRetriever(
+            es_client=get_es_client(),
+            index_name=index_name,
+            body_func=body_func,
+            # langchain_elasticsearch chỉ cho phép một trong hai
+            content_field=None if document_mapper else content_field,
+            document_mapper=document_mapper
+        )
+        _bm25_retrievers[index_name] = retriever
+    return retriever
+
+
+def forget_collection(name: str):
+    """Drop cached handles after a collection/index is recreated."""
+    _vector_stores.pop(name, None)
+    _bm25_retrievers.pop(name, None)
+
+
+def init_clients():
+    get_qdrant_client()
+    get_es_client()
+
+
+def close_clients():
+    global _qdrant_client, _es_client
+    with _lock:
+        if _qdrant_client is not None:
+            _qdrant_client.close()
+        if _es_client is not None:
+            _es_client.close()
+        _qdrant_client = None
+        _es_client = None
+        _vector_stores.clear()
+        _bm25_retrievers.clear()
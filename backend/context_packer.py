@@ -0,0 +1,203 @@
+import math
+import os
+import re
+import threading
+from collections import deque
+from typing import List
+
+import numpy as np
+from langchain_core.documents import Document
+
+from util import print_timestamp
+
+# ==== Token-budgeted context packing ====
+# Thay vì nối nguyên 10 chunk x 10k ký tự vào prompt:
+# - tách chunk thành các đoạn ngắn (theo câu), bỏ câu trùng do overlap 500 ký tự
+# - chấm đoạn theo độ khớp từ khóa với câu hỏi + thứ hạng của chunk
+# - chọn tham lam tới khi hết ngân sách token, rồi ghép lại theo thứ tự gốc
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# Ước lượng token ~ ký tự / 4 (không gọi API đếm token của Gemini mỗi request)
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4"))
+CONTEXT_PASSAGE_CHARS = int(os.getenv("CONTEXT_PASSAGE_CHARS", "800"))
+# Tỉ trọng của thứ hạng chunk (reranker/fusion) so với độ khớp từ khóa
+CONTEXT_RANK_WEIGHT = float(os.getenv("CONTEXT_RANK_WEIGHT", "0.3"))
+CONTEXT_METRICS_WINDOW = int(os.getenv("CONTEXT_METRICS_WINDOW", "1000"))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…;:])\s+|\s*\n\s*")
+_WORD = re.compile(r"\w+", re.UNICODE)
+# Câu ngắn hơn ngưỡng này chỉ coi là trùng khi giống hệt (tránh khớp nhầm "Có." ...)
+_MIN_SUBSTRING_CHARS = 30
+# Mảnh câu dài hơn ngưỡng trên là trùng khi mọi shingle (n từ liên tiếp) của nó đã gặp
+_SHINGLE_WORDS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CONTEXT_CHARS_PER_TOKEN) if text else 0
+
+
+def _normalize(text: str) -> str:
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def _shingles(normalized: str) -> set:
+    words = normalized.split()
+    if len(words) <= _SHINGLE_WORDS:
+        return {tuple(words)}
+    return {tuple(words[i:i + _SHINGLE_WORDS]) for i in range(len(words) - _SHINGLE_WORDS + 1)}
+
+
+class _Passage(object):
+    __slots__ = ("doc", "position", "text", "tokens", "words", "score")
+
+    def __init__(self, doc: int, position: int, text: str):
+        self.doc = doc
+        self.position = position
+        self.text = text
+        self.tokens = estimate_tokens(text)
+        self.words = set(_WORD.findall(text.lower()))
+        self.score = 0.0
+
+
+class ContextPacker(object):
+    """Packs ranked documents into a context string that fits `budget` tokens.
+
+    Also keeps a rolling window of prompt sizes for /api/metrics.
+    """
+
+    def __init__(self, budget: int = CONTEXT_TOKEN_BUDGET, passage_chars: int = CONTEXT_PASSAGE_CHARS,
+                 rank_weight: float = CONTEXT_RANK_WEIGHT, window: int = CONTEXT_METRICS_WINDOW):
+        self.budget = budget
+        self.passage_chars = passage_chars
+        self.rank_weight = rank_weight
+        self._lock = threading.Lock()
+        self._prompt_tokens = deque(maxlen=window)
+        self._packed_tokens = deque(maxlen=window)
+        self._dropped_tokens = deque(maxlen=window)
+        self.requests = 0
+        self.over_budget = 0
+
+    def _passages(self, docs: List[Document]):
+        """Passages of consecutive sentences/lines, minus those already seen in earlier chunks of the same file"""
+        passages = []
+        duplicate_tokens = 0
+        # file_key -> (câu đã chuẩn hóa, shingle _SHINGLE_WORDS từ) của các chunk trước
+        seen_by_file = {}
+        for d, doc in enumerate(docs):
+            file_key = doc.metadata.get("file_key") or doc.metadata.get("source", "")
+            seen_sentences, seen_shingles = seen_by_file.setdefault(file_key, (set(), set()))
+            # Chỉ so với chunk trước: câu lặp lại trong chính chunk này (ô bảng, "Có.") được giữ
+            chunk_sentences, chunk_shingles = set(), set()
+            current, position = [], 0
+            for sentence in _SENTENCE_END.split(doc.page_content):
+                sentence = sentence.strip()
+                if not sentence:
+                    continue
+                normalized = _normalize(sentence)
+                shingles = _shingles(normalized)
+                # Vùng overlap giữa hai chunk liền nhau: câu (hoặc mảnh câu đầu chunk) đã có trong chunk trước
+                if normalized and (normalized in seen_sentences or (
+                        len(normalized) >= _MIN_SUBSTRING_CHARS and shingles <= seen_shingles)):
+                    duplicate_tokens += estimate_tokens(sentence)
+                    continue
+                if normalized:
+                    chunk_sentences.add(normalized)
+                    chunk_shingles.update(shingles)
+                if current and sum(len(s) for s in current) + len(sentence) > self.passage_chars:
+                    passages.append(_Passage(d, position, "\n".join(current)))
+                    current, position = [], position + 1
+                current.append(sentence)
+            if current:
+                passages.append(_Passage(d, position, "\n".join(current)))
+            seen_sentences.update(chunk_sentences)
+            seen_shingles.update(chunk_shingles)
+        return passages, duplicate_tokens
+
+    def _score(self, query: str, passages: List[_Passage]):
+        terms = set(_WORD.findall(query.lower()))
+        if not passages:
+            return
+        # idf của từng từ trong câu hỏi, tính trên các đoạn của request này
+        df = {term: sum(term in p.words for p in passages) for term in terms}
+        idf = {term: math.log(1 + len(passages) / count) for term, count in df.items() if count}
+        lexical = np.array([sum(idf.get(term, 0.0) for term in p.words & terms) for p in passages])
+        if lexical.max() > 0:
+            lexical = lexical / lexical.max()
+        for p, score in zip(passages, lexical):
+            p.score = (1 - self.rank_weight) * score + self.rank_weight / (1 + p.doc)
+
+    def pack(self, query: str, docs: List[Document], history_tokens: int = 0):
+        """Return (context, used_docs, report)"""
+        candidate_tokens = sum(estimate_tokens(doc.page_content) for doc in docs)
+        passages, duplicate_tokens = self._passages(docs)
+        self._score(query, passages)
+
+        selected, packed_tokens = [], 0
+        # Chọn theo điểm, hòa thì ưu tiên chunk xếp hạng cao hơn và đoạn đứng trước
+        for p in sorted(passages, key=lambda p: (-p.score, p.doc, p.position)):
+            if packed_tokens + p.tokens > self.budget:
+                continue
+            selected.append(p)
+            packed_tokens += p.tokens
+
+        by_doc = {}
+        for p in selected:
+            by_doc.setdefault(p.doc, []).append(p)
+        blocks, used_docs = [], []
+        for d in sorted(by_doc):
+            parts = sorted(by_doc[d], key=lambda p: p.position)
+            text = parts[0].text
+            for previous, p in zip(parts, parts[1:]):
+                # Đánh dấu chỗ bị lược bỏ giữa hai đoạn không liền nhau
+                text += ("\n" if p.position == previous.position + 1 else "\n[...]\n") + p.text
+            blocks.append(text)
+            used_docs.append(docs[d])
+        context = "\n\n".join(blocks)
+
+        report = {
+            "budget_tokens": self.budget,
+            "candidate_tokens": candidate_tokens,
+            "packed_tokens": packed_tokens,
+            "duplicate_tokens": duplicate_tokens,
+            "dropped_tokens": max(0, candidate_tokens - packed_tokens - duplicate_tokens),
+            "docs_used": len(used_docs),
+            "docs_total": len(docs),
+            "passages_used": len(selected),
+            "passages_total": len(passages),
+            "prompt_tokens": packed_tokens + estimate_tokens(query) + history_tokens,
+        }
+        self.record(report)
+        print_timestamp(f"📦 [Context] packed {packed_tokens}/{candidate_tokens} tokens "
+                        f"({duplicate_tokens} duplicate) from {len(used_docs)}/{len(docs)} chunks")
+        return context, used_docs, report
+
+    def record(self, report: dict):
+        with self._lock:
+            self.requests += 1
+            self._prompt_tokens.append(report["prompt_tokens"])
+            self._packed_tokens.append(report["packed_tokens"])
+            self._dropped_tokens.append(report["dropped_tokens"])
+            if report["candidate_tokens"] - report["duplicate_tokens"] > report["budget_tokens"]:
+                self.over_budget += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            prompt = np.array(self._prompt_tokens, dtype=np.float64)
+            packed = np.array(self._packed_tokens, dtype=np.float64)
+            dropped = np.array(self._dropped_tokens, dtype=np.float64)
+            requests, over_budget = self.requests, self.over_budget
+        if not len(prompt):
+            return {"requests": requests, "budget_tokens": self.budget}
+        return {
+            "requests": requests,
+            "budget_tokens": self.budget,
+            "over_budget_requests": over_budget,
+            "prompt_tokens_avg": float(prompt.mean()),
+            "prompt_tokens_p50": float(np.percentile(prompt, 50)),
+            "prompt_tokens_p95": float(np.percentile(prompt, 95)),
+            "packed_tokens_avg": float(packed.mean()),
+            "dropped_tokens_avg": float(dropped.mean()),
+        }
+
+
+def history_tokens(messages) -> int:
+    return sum(estimate_tokens(str(getattr(message, "content", message))) for message in messages or [])
@@ -1,20 +1,129 @@
 import os
-from langchain_qdrant import QdrantVectorStore
+
+from qdrant_client import models
+
+from clients import get_vector_store, get_qdrant_client
+
+# ==== Tenancy ====
+# QDRANT_TENANCY=collection : mỗi user một collection (tên = username), như trước
+# QDRANT_TENANCY=shared     : mọi user chung QDRANT_SHARED_COLLECTION, lọc theo
+#   payload metadata.username (keyword index is_tenant, HNSW theo từng tenant
+#   với payload_m, không dựng graph toàn cục). Chuyển dữ liệu cũ sang bằng
+#   `python qdrant_migrate.py --all`.
+QDRANT_TENANCY = os.getenv("QDRANT_TENANCY", "collection")
+QDRANT_SHARED_COLLECTION = os.getenv("QDRANT_SHARED_COLLECTION", "shared_chunks")
+QDRANT_TENANT_HNSW_M = int(os.getenv("QDRANT_TENANT_HNSW_M", "16"))
+
+FILE_KEY_FIELD = "metadata.file_key"
+USERNAME_FIELD = "metadata.username"
+
+
+def shared_tenancy() -> bool:
+    return QDRANT_TENANCY == "shared"
+
+
+def collection_for(username: str) -> str:
+    return QDRANT_SHARED_COLLECTION if shared_tenancy() else username
+
+
+def tenant_filter(username: str, *conditions) -> models.Filter:
+    """Filter on the user's points (plus `conditions`); per-user collections need no tenant condition"""
+    must = list(conditions)
+    if shared_tenancy():
+        must.insert(0, models.FieldCondition(key=USERNAME_FIELD, match=models.MatchValue(value=username)))
+    return models.Filter(must=must)
+
 
 def find_similarity(hypo_emb,k,embed_model,username):
-    # doc_store = QdrantVectorStore.from_documents(
-    #     documents=splits,
-    #     embedding=embed_model,
-    #     url="https://6fbd9042-2153-49e0-8c5b-d9da2f8d9e60.us-west-2-0.aws.cloud.qdrant.io:6333",
-    #     api_key=api_key,
-    #     collection_name="demo2")
-    doc_store = QdrantVectorStore.from_existing_collection(
-        embedding=embed_model,
-        url="https://6fbd9042-2153-49e0-8c5b-d9da2f8d9e60.us-west-2-0.aws.cloud.qdrant.io:6333",
-        api_key=os.environ["Qdrant_api_key"],
-        collection_name=username)
-    results = doc_store.similarity_search_by_vector(hypo_emb, k)
+    # Store được cache theo collection, dùng chung client Qdrant của process
+    doc_store = get_vector_store(collection_for(username), embed_model)
+    search_filter = tenant_filter(username) if shared_tenancy() else None
+    results = []
+    # Giữ điểm cosine trong metadata["_score"] (giống kết quả BM25) để fusion dùng
+    for doc, score in doc_store.similarity_search_with_score_by_vector(hypo_emb, k, filter=search_filter):
+        doc.metadata["_score"] = score
+        results.append(doc)
     return results
 
 
+def create_shared_collection(client, dim: int, name: str = None):
+    """Create the multi-tenant collection with its tenant and file_key payload indexes"""
+    name = name or QDRANT_SHARED_COLLECTION
+    if not client.collection_exists(name):
+        client.create_collection(
+            name,
+            vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE),
+            # m=0: không có graph toàn cục, mỗi tenant một graph riêng (payload_m)
+            hnsw_config=models.HnswConfigDiff(m=0, payload_m=QDRANT_TENANT_HNSW_M)
+        )
+    client.create_payload_index(
+        name,
+        field_name=USERNAME_FIELD,
+        field_schema=models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True)
+    )
+    client.create_payload_index(name, field_name=FILE_KEY_FIELD, field_schema=models.PayloadSchemaType.KEYWORD)
+
+
+def ensure_collection(username, embed_model, reset=False):
+    """Create the user's collection (or the shared one) and its payload indexes if they do not exist yet.
+
+    With `reset` the user's existing chunks are dropped.
+    """
+    client = get_qdrant_client()
+    if shared_tenancy():
+        if not client.collection_exists(QDRANT_SHARED_COLLECTION):
+            create_shared_collection(client, len(embed_model.embed_query("dimension probe")))
+        elif reset:
+            client.delete(QDRANT_SHARED_COLLECTION,
+                          points_selector=models.FilterSelector(filter=tenant_filter(username)))
+        return
+
+    exists = client.collection_exists(username)
+    if exists and reset:
+        client.delete_collection(username)
+        exists = False
+
+    if not exists:
+        dim = len(embed_model.embed_query("dimension probe"))
+        client.create_collection(
+            username,
+            vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE)
+        )
+    client.create_payload_index(
+        username,
+        field_name=FILE_KEY_FIELD,
+        field_schema=models.PayloadSchemaType.KEYWORD
+    )
+
+
+def upsert_vectors(username, splits, vectors, batch_size=64):
+    """Upsert precomputed vectors using the payload layout of langchain_qdrant"""
+    client = get_qdrant_client()
+    points = [
+        models.PointStruct(
+            id=split.metadata["chunk_id"],
+            vector=[float(x) for x in vector],
+            # metadata.username là khóa tenant của collection chung
+            payload={"page_content": split.page_content, "metadata": {**split.metadata, "username": username}}
+        )
+        for split, vector in zip(splits, vectors)
+    ]
+    collection_name = collection_for(username)
+    for start in range(0, len(points), batch_size):
+        client.upsert(collection_name, points=points[start:start + batch_size])
+    return len(points)
+
 
+def delete_document(username, file_key):
+    """Remove every chunk of one document from the user's points"""
+    client = get_qdrant_client()
+    collection_name = collection_for(username)
+    if not client.collection_exists(collection_name):
+        return
+    client.delete(
+        collection_name,
+        points_selector=models.FilterSelector(
+            filter=tenant_filter(username, models.FieldCondition(key=FILE_KEY_FIELD,
+                                                                 match=models.MatchValue(value=file_key)))
+        )
+    )
@@ -0,0 +1,232 @@
+import base64
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Iterable, List, Optional
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+# ==== Document catalog ====
+# Metadata của tài liệu (key, tên, size, etag...) được ghi khi upload/xóa, nên
+# /api/documents/ chỉ cần một query có index thay vì list_objects_v2 + ký URL
+# cho từng object. URL tải về được ký lúc cần qua /api/documents/{key}/url.
+#   username (PK) | file_key (SK)  — key có dạng "<username>/<timestamp>_<tên>"
+# nên thứ tự theo SK chính là thứ tự upload.
+DOCUMENT_CATALOG_BACKEND = os.getenv("DOCUMENT_CATALOG_BACKEND", "dynamodb")
+DOCUMENT_CATALOG_TABLE = os.getenv("DOCUMENT_CATALOG_TABLE", "DocumentCatalog")
+DOCUMENT_CATALOG_PATH = os.getenv("DOCUMENT_CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "documents.sqlite3"))
+DOCUMENT_PAGE_SIZE = int(os.getenv("DOCUMENT_PAGE_SIZE", "50"))
+DOCUMENT_MAX_PAGE_SIZE = int(os.getenv("DOCUMENT_MAX_PAGE_SIZE", "1000"))
+
+FIELDS = ("key", "filename", "size", "etag", "last_modified", "type")
+
+region = os.getenv("AWS_REGION_NAME")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    username TEXT NOT NULL,
+    file_key TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    type TEXT,
+    indexed_at TEXT NOT NULL,
+    PRIMARY KEY (username, file_key)
+) WITHOUT ROWID;
+"""
+
+
+def encode_cursor(file_key: str) -> str:
+    return base64.urlsafe_b64encode(file_key.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class DynamoDocumentCatalog(object):
+    """Catalog stored in a DynamoDB table (username HASH, file_key RANGE)"""
+
+    def __init__(self, table_name: str = DOCUMENT_CATALOG_TABLE):
+        self.table = boto3.resource('dynamodb', region_name=region).Table(table_name)
+
+    @staticmethod
+    def _item(username: str, info: dict) -> dict:
+        return {
+            "username": username,
+            "file_key": info["key"],
+            "filename": info["filename"],
+            "size": int(info["size"]),
+            "etag": info.get("etag"),
+            "last_modified": info.get("last_modified"),
+            "type": info.get("type"),
+            "indexed_at": _now(),
+        }
+
+    @staticmethod
+    def _info(item: dict) -> dict:
+        info = {field: item.get(field) for field in FIELDS}
+        info["key"] = item["file_key"]
+        if isinstance(info["size"], Decimal):
+            info["size"] = int(info["size"])
+        return info
+
+    def put(self, username: str, info: dict):
+        self.table.put_item(Item=self._item(username, info))
+
+    def put_many(self, username: str, infos: Iterable[dict]):
+        with self.table.batch_writer(overwrite_by_pkeys=["username", "file_key"]) as batch:
+            for info in infos:
+                batch.put_item(Item=self._item(username, info))
+
+    def remove(self, username: str, file_key: str):
+        self.table.delete_item(Key={"username": username, "file_key": file_key})
+
+    def remove_many(self, username: str, file_keys: Iterable[str]):
+        with self.table.batch_writer(overwrite_by_pkeys=["username", "file_key"]) as batch:
+            for file_key in file_keys:
+                batch.delete_item(Key={"username": username, "file_key": file_key})
+
+    def get(self, username: str, file_key: str) -> Optional[dict]:
+        item = self.table.get_item(Key={"username": username, "file_key": file_key}).get("Item")
+        return self._info(item) if item else None
+
+    def page(self, username: str, limit: int = DOCUMENT_PAGE_SIZE, cursor: Optional[str] = None):
+        """(documents newest first, next cursor or None)"""
+        kwargs = {
+            "KeyConditionExpression": Key("username").eq(username),
+            "ScanIndexForward": False,
+            "Limit": limit,
+        }
+        if cursor:
+            kwargs["ExclusiveStartKey"] = {"username": username, "file_key": decode_cursor(cursor)}
+        response = self.table.query(**kwargs)
+        documents = [self._info(item) for item in response.get("Items", [])]
+        last = response.get("LastEvaluatedKey")
+        return documents, encode_cursor(last["file_key"]) if last else None
+
+    def keys(self, username: str) -> List[str]:
+        keys, kwargs = [], {
+            "KeyConditionExpression": Key("username").eq(username),
+            "ProjectionExpression": "file_key",
+        }
+        while True:
+            response = self.table.query(**kwargs)
+            keys.extend(item["file_key"] for item in response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                return keys
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+class SQLiteDocumentCatalog(object):
+    """Local stand-in for the DynamoDB catalog, one SQLite file shared by API and worker"""
+
+    def __init__(self, path: str = DOCUMENT_CATALOG_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(username: str, info: dict, now: str):
+        return (username, info["key"], info["filename"], int(info["size"]), info.get("etag"),
+                info.get("last_modified"), info.get("type"), now)
+
+    @staticmethod
+    def _info(row) -> dict:
+        info = {field: row[field] for field in FIELDS if field != "key"}
+        info["key"] = row["file_key"]
+        return info
+
+    def put(self, username: str, info: dict):
+        self.put_many(username, [info])
+
+    def put_many(self, username: str, infos: Iterable[dict]):
+        now = _now()
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             [self._row(username, info, now) for info in infos])
+
+    def remove(self, username: str, file_key: str):
+        self.remove_many(username, [file_key])
+
+    def remove_many(self, username: str, file_keys: Iterable[str]):
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM documents WHERE username = ? AND file_key = ?",
+                             [(username, file_key) for file_key in file_keys])
+
+    def get(self, username: str, file_key: str) -> Optional[dict]:
+        row = self._connect().execute("SELECT * FROM documents WHERE username = ? AND file_key = ?",
+                                      (username, file_key)).fetchone()
+        return self._info(row) if row else None
+
+    def page(self, username: str, limit: int = DOCUMENT_PAGE_SIZE, cursor: Optional[str] = None):
+        """(documents newest first, next cursor or None)"""
+        # Lấy thêm 1 dòng để biết còn trang sau hay không
+        if cursor:
+            rows = self._connect().execute(
+                "SELECT * FROM documents WHERE username = ? AND file_key < ? ORDER BY file_key DESC LIMIT ?",
+                (username, decode_cursor(cursor), limit + 1)).fetchall()
+        else:
+            rows = self._connect().execute(
+                "SELECT * FROM documents WHERE username = ? ORDER BY file_key DESC LIMIT ?",
+                (username, limit + 1)).fetchall()
+        documents = [self._info(row) for row in rows[:limit]]
+        return documents, encode_cursor(documents[-1]["key"]) if len(rows) > limit else None
+
+    def keys(self, username: str) -> List[str]:
+        rows = self._connect().execute("SELECT file_key FROM documents WHERE username = ?", (username,))
+        return [row["file_key"] for row in rows]
+
+
+def sync_catalog(catalog, username: str, files: List[dict]):
+    """Make the user's catalog match an S3 listing (backfill + drop deleted objects)"""
+    listed = {info["key"] for info in files}
+    stale = [file_key for file_key in catalog.keys(username) if file_key not in listed]
+    if files:
+        catalog.put_many(username, files)
+    if stale:
+        catalog.remove_many(username, stale)
+    return len(files), len(stale)
+
+
+BACKENDS = {
+    "dynamodb": DynamoDocumentCatalog,
+    "sqlite": SQLiteDocumentCatalog,
+}
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_document_catalog():
+    """Process-wide catalog for the backend selected by DOCUMENT_CATALOG_BACKEND"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            if DOCUMENT_CATALOG_BACKEND not in BACKENDS:
+                raise ValueError(f"Unknown DOCUMENT_CATALOG_BACKEND {DOCUMENT_CATALOG_BACKEND!r}, "
+                                 f"expected one of {sorted(BACKENDS)}")
+            _catalog = BACKENDS[DOCUMENT_CATALOG_BACKEND]()
+        return _catalog
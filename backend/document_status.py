@@ -0,0 +1,143 @@
+import os
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import List
+
+import boto3
+
+region = os.getenv("AWS_REGION_NAME")
+dynamodb = boto3.resource('dynamodb', region_name=region)
+
+
+def _to_dynamo(value):
+    # DynamoDB không nhận float -> Decimal
+    if isinstance(value, float):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: _to_dynamo(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_dynamo(v) for v in value]
+    return value
+
+
+# Document status tracking
+def get_document_status_table():
+    return dynamodb.Table('DocumentStatus')
+
+def update_document_status(username: str, status: str, file_keys: List[str] = None, extra: dict = None):
+    """Update document processing status for a user; `extra` attributes are set alongside"""
+    table = get_document_status_table()
+    timestamp = datetime.now(timezone.utc).isoformat()
+    
+    try:
+        if status == "processing":
+            # Start processing - store file keys being processed
+            # (update_item thay vì put_item để giữ lại manifest indexed_files)
+            table.update_item(
+                Key={"username": username},
+                UpdateExpression="SET #status = :status, file_keys = :file_keys, "
+                                 "started_at = :timestamp, updated_at = :timestamp REMOVE progress",
+                ExpressionAttributeNames={"#status": "status"},
+                ExpressionAttributeValues={
+                    ":status": status,
+                    ":file_keys": file_keys or [],
+                    ":timestamp": timestamp
+                }
+            )
+        else:
+            # Update existing status
+            names = {"#status": "status"}
+            values = {
+                ":status": status,
+                ":updated_at": timestamp
+            }
+            expression = "SET #status = :status, updated_at = :updated_at"
+            for i, (name, value) in enumerate((extra or {}).items()):
+                names[f"#extra{i}"] = name
+                values[f":extra{i}"] = _to_dynamo(value)
+                expression += f", #extra{i} = :extra{i}"
+            table.update_item(
+                Key={"username": username},
+                UpdateExpression=expression,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+    except Exception as e:
+        print(f"Error updating document status: {e}")
+
+def update_document_progress(username: str, progress: dict):
+    """Store per-stage ingestion counters ({stage: {chunks, chunks_per_sec, percent}})"""
+    try:
+        get_document_status_table().update_item(
+            Key={"username": username},
+            UpdateExpression="SET progress = :progress, updated_at = :timestamp",
+            ExpressionAttributeValues={
+                ":progress": _to_dynamo(progress),
+                ":timestamp": datetime.now(timezone.utc).isoformat()
+            }
+        )
+    except Exception as e:
+        print(f"Error updating document progress: {e}")
+
+def get_document_status(username: str):
+    """Get current document processing status for a user"""
+    table = get_document_status_table()
+    try:
+        response = table.get_item(Key={"username": username})
+        if 'Item' in response:
+            item = response['Item']
+            item.pop("indexed_files", None)
+            return item
+        return {"status": "no_documents", "updated_at": datetime.now(timezone.utc).isoformat()}
+    except Exception as e:
+        print(f"Error getting document status: {e}")
+        return {"status": "no_documents", "updated_at": datetime.now(timezone.utc).isoformat()}
+
+
+# ==== Index manifest ====
+# indexed_files: {file_key: content_hash} của các file đã nằm trong Qdrant/ES.
+# None nghĩa là corpus được index theo kiểu cũ (rebuild toàn bộ, không có file_key).
+def get_indexed_files(username: str):
+    """Return {file_key: content_hash} of indexed documents, or None if never tracked"""
+    response = get_document_status_table().get_item(
+        Key={"username": username},
+        ProjectionExpression="indexed_files"
+    )
+    return response.get("Item", {}).get("indexed_files")
+
+def reset_indexed_files(username: str):
+    get_document_status_table().update_item(
+        Key={"username": username},
+        UpdateExpression="SET indexed_files = :empty",
+        ExpressionAttributeValues={":empty": {}}
+    )
+
+# indexed_model: model/backend đã tạo vector trong collection của user (inference_backends.embedding_model_id)
+def get_indexed_model(username: str):
+    response = get_document_status_table().get_item(
+        Key={"username": username},
+        ProjectionExpression="indexed_model"
+    )
+    return response.get("Item", {}).get("indexed_model")
+
+def set_indexed_model(username: str, model_id: str):
+    get_document_status_table().update_item(
+        Key={"username": username},
+        UpdateExpression="SET indexed_model = :model",
+        ExpressionAttributeValues={":model": model_id}
+    )
+
+def set_indexed_file(username: str, file_key: str, content_hash: str):
+    get_document_status_table().update_item(
+        Key={"username": username},
+        UpdateExpression="SET indexed_files.#key = :hash",
+        ExpressionAttributeNames={"#key": file_key},
+        ExpressionAttributeValues={":hash": content_hash}
+    )
+
+def remove_indexed_file(username: str, file_key: str):
+    get_document_status_table().update_item(
+        Key={"username": username},
+        UpdateExpression="REMOVE indexed_files.#key",
+        ExpressionAttributeNames={"#key": file_key}
+    )
@@ -1,56 +1,79 @@
-import os
 from typing import Dict
 
-from elasticsearch import Elasticsearch, helpers
-from langchain_elasticsearch import ElasticsearchRetriever
+from elasticsearch import helpers
+from langchain_core.documents import Document
 
-es_client = Elasticsearch("https://my-elasticsearch-project-b2562c.es.ap-southeast-1.aws.elastic.cloud:443",
-                          api_key=os.environ["ELASTIC_SEARCH_API_KEY"])
+from clients import get_es_client, get_bm25_retriever
 
 text_field = "content"
 
 
-def create_index_bm25(username):
-    # Nếu index đã tồn tại thì bỏ qua
-    if es_client.indices.exists(index=username):
+def ensure_index_bm25(username, reset=False):
+    es_client = get_es_client()
+    exists = es_client.indices.exists(index=username)
+    if exists and reset:
         es_client.indices.delete(index=username)
-
-    es_client.indices.create(
-        index=username,
-        body={
-            "mappings": {
-                "properties": {
-                    "content": {"type": "text"}
-                }
-            }
-        }
-    )
+        exists = False
+
+    properties = {
+        "content": {"type": "text"},
+        "source": {"type": "keyword"},
+        "file_key": {"type": "keyword"},
+        "chunk_id": {"type": "keyword"},
+        "page": {"type": "integer"}
+    }
+    if not exists:
+        es_client.indices.create(index=username, body={"mappings": {"properties": properties}})
+    else:
+        # Index cũ chỉ có field content -> bổ sung mapping cho các field mới
+        es_client.indices.put_mapping(index=username, properties=properties)
 
 
 def index_splits_bm25(username, splits, refresh=True):
-    create_index_bm25(username)
-
     requests = []
-    for i, doc in enumerate(splits):
+    for doc in splits:
         body = {
             text_field: doc.page_content,
+            "source": doc.metadata.get("source", ""),
+            "file_key": doc.metadata.get("file_key", ""),
+            # để fusion gộp với kết quả Qdrant theo chunk_id
+            "chunk_id": doc.metadata["chunk_id"],
+            "page": doc.metadata.get("page"),
         }
 
         requests.append({
             "_op_type": "index",
             "_index": username,
-            "_id": f"{doc.metadata.get('source', '')}-{i}",
+            # cùng id với point trong Qdrant
+            "_id": doc.metadata["chunk_id"],
             **body
         })
 
-    helpers.bulk(es_client, requests)
+    helpers.bulk(get_es_client(), requests)
 
     if refresh:
-        es_client.indices.refresh(index=username)
+        get_es_client().indices.refresh(index=username)
 
     return len(requests)
 
 
+def refresh_index_bm25(username):
+    get_es_client().indices.refresh(index=username)
+
+
+def delete_document_bm25(username, file_key, refresh=True):
+    """Remove every chunk of one document from the user's index"""
+    es_client = get_es_client()
+    if not es_client.indices.exists(index=username):
+        return 0
+    response = es_client.delete_by_query(
+        index=username,
+        query={"term": {"file_key": file_key}},
+        refresh=refresh
+    )
+    return response.get("deleted", 0)
+
+
 def bm25_query(search_query: str) -> Dict:
     return {
         "query": {
@@ -61,13 +84,17 @@ def bm25_query(search_query: str) -> Dict:
     }
 
 
-def bm25_search(username, query):
-    bm25_retriever = ElasticsearchRetriever.from_es_params(
-        index_name=username,
-        body_func=bm25_query,
-        content_field=text_field,
-        url="https://my-elasticsearch-project-b2562c.es.ap-southeast-1.aws.elastic.cloud:443",
-        api_key=os.environ["ELASTIC_SEARCH_API_KEY"],
+def bm25_hit_to_document(hit) -> Document:
+    """Flatten an ES hit so metadata looks like the Qdrant results (source, file_key, ...)"""
+    source = dict(hit["_source"])
+    content = source.pop(text_field)
+    return Document(
+        page_content=content,
+        metadata={**source, "_id": hit["_id"], "_score": hit["_score"], "_index": hit["_index"]}
     )
 
+
+def bm25_search(username, query):
+    bm25_retriever = get_bm25_retriever(username, bm25_query, text_field, bm25_hit_to_document)
+
     return bm25_retriever.invoke(query)
@@ -0,0 +1,241 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# ==== Content-addressed embedding cache ====
+# Key = sha256(model name, normalize flag, chunk text). Vector lưu dạng float16
+# trong một file memmap, vị trí (slot) của từng key nằm trong index SQLite.
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "data/embedding_cache")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+
+
+# Số tham số tối đa mỗi câu IN (...), dưới giới hạn host parameter của SQLite
+_SQL_BATCH = 500
+
+
+def embedding_key(model_name: str, normalize: bool, text: str) -> str:
+    payload = f"{model_name}\0{int(normalize)}\0{text}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _tag(key: str) -> np.uint64:
+    # 64 bit đầu của sha256, khác 0 (0 đánh dấu slot đang ghi)
+    return np.uint64(int(key[:16], 16) | 1)
+
+
+def _open_memmap(path: str, dtype, shape):
+    """Memory-map `path`, growing it to `shape` without truncating data another process wrote"""
+    size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    with open(path, "ab") as f:
+        if f.tell() < size:
+            f.truncate(size)
+    return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+
+class EmbeddingCache(object):
+    """float16 vectors in a memory-mapped file plus an SQLite key -> slot index.
+
+    When `max_entries` slots are used, the least recently used entries are
+    evicted and their slots reused. Safe to share between processes: slot
+    allocation happens inside an SQLite write transaction, and every slot
+    carries a tag of the key it holds (zeroed while the vector is rewritten),
+    so a reader racing a slot reuse gets a miss instead of another chunk's vector.
+    """
+
+    def __init__(self, path: str, dim: int, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        os.makedirs(path, exist_ok=True)
+        self.dim = dim
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        self.db = sqlite3.connect(os.path.join(path, "index.sqlite3"), timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, slot INTEGER UNIQUE NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.db.execute("INSERT OR IGNORE INTO meta VALUES ('dim', ?), ('max_entries', ?)", (dim, max_entries))
+        self.db.commit()
+
+        stored = dict(self.db.execute("SELECT name, value FROM meta"))
+        if stored["dim"] != dim or stored["max_entries"] != max_entries:
+            raise ValueError(f"Embedding cache at {path} was created with dim={stored['dim']}, "
+                             f"max_entries={stored['max_entries']}")
+
+        self.vectors = _open_memmap(os.path.join(path, "vectors.f16"), np.float16, (max_entries, dim))
+        # Tag (64 bit đầu của key) của slot; 0 = đang ghi / trống. Cache cũ chưa có file
+        # này -> mọi entry thành miss một lần rồi được ghi lại kèm tag
+        self.tags = _open_memmap(os.path.join(path, "tags.u64"), np.uint64, (max_entries,))
+
+    def get_many(self, keys: List[str]) -> dict:
+        """Return {key: float32 vector} for the keys that are cached"""
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _SQL_BATCH):
+                batch = keys[start:start + _SQL_BATCH]
+                rows = self.db.execute(
+                    f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, slot in rows:
+                    # Đọc tag trước và sau vector: process khác có thể đang ghi đè slot này
+                    tag = _tag(key)
+                    if self.tags[slot] != tag:
+                        continue
+                    vector = np.array(self.vectors[slot], dtype=np.float32)
+                    if self.tags[slot] == tag:
+                        found[key] = vector
+            if found:
+                now = time.time()
+                self.db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                self.db.commit()
+        return found
+
+    def put_many(self, keys: List[str], vectors) -> int:
+        """Store vectors, evicting LRU entries when full. Returns the number evicted"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        evicted = 0
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                unique = list(dict.fromkeys(keys))
+                existing = {}
+                for start in range(0, len(unique), _SQL_BATCH):
+                    batch = unique[start:start + _SQL_BATCH]
+                    existing.update(self.db.execute(
+                        f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch
+                    ).fetchall())
+                new_keys = [key for key in unique if key not in existing]
+
+                used = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                free = max(0, self.max_entries - used)
+                slots = list(range(used, used + min(free, len(new_keys))))
+                if len(slots) < len(new_keys):
+                    # Hết chỗ -> lấy lại slot của các entry lâu không dùng nhất, trừ các key
+                    # của chính batch này (slot của chúng sẽ được ghi vector mới bên dưới)
+                    needed = len(new_keys) - len(slots)
+                    victims = [(key, slot) for key, slot in self.db.execute(
+                        "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (needed + len(existing),)
+                    ) if key not in existing][:needed]
+                    self.db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in victims])
+                    slots.extend(slot for _, slot in victims)
+                    evicted = len(victims)
+
+                # slot trống có thể ít hơn số key mới nếu cache nhỏ hơn batch
+                assigned = dict(zip(new_keys, slots))
+                self.db.executemany(
+                    "INSERT INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                    [(key, slot, now) for key, slot in assigned.items()]
+                )
+                assigned.update(existing)
+                for key, vector in zip(keys, vectors):
+                    slot = assigned.get(key)
+                    if slot is not None:
+                        # tag = 0 trong lúc ghi: reader đang đọc slot cũ sẽ thấy miss
+                        self.tags[slot] = 0
+                        self.vectors[slot] = vector
+                        self.tags[slot] = _tag(key)
+                self.vectors.flush()
+                self.tags.flush()
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+        return evicted
+
+    def __len__(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model_name: str, dim: int = None):
+    """Process-wide cache, one directory per model/dimension.
+
+    With dim=None an existing on-disk cache for the model is opened, or None is returned.
+    """
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+    if dim is None:
+        prefix = f"{slug}-"
+        existing = [name for name in os.listdir(EMBEDDING_CACHE_DIR) if name.startswith(prefix)] \
+            if os.path.isdir(EMBEDDING_CACHE_DIR) else []
+        dims = [int(name[len(prefix):]) for name in existing if name[len(prefix):].isdigit()]
+        if not dims:
+            return None
+        dim = dims[0]
+    with _caches_lock:
+        cache = _caches.get((slug, dim))
+        if cache is None:
+            cache = EmbeddingCache(os.path.join(EMBEDDING_CACHE_DIR, f"{slug}-{dim}"), dim)
+            _caches[(slug, dim)] = cache
+        return cache
+
+
+class CachedEmbeddings(Embeddings):
+    """Wrap an embedding model so embed_documents only computes uncached chunks.
+
+    Create one per ingestion job: hits/misses are counted per instance.
+    """
+
+    def __init__(self, embeddings, model_name: str = None, normalize: bool = None):
+        self.embeddings = embeddings
+        # Không có tên model thì vector của các model khác nhau trùng key trong cache
+        self.model_name = model_name or getattr(embeddings, "model_name", None)
+        if not self.model_name:
+            raise ValueError(f"CachedEmbeddings needs a model identity: pass model_name for {type(embeddings).__name__}")
+        if normalize is None:
+            normalize = bool(getattr(embeddings, "encode_kwargs", {}).get("normalize_embeddings", False))
+        self.normalize = normalize
+        self.cache = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _cache(self, dim: int = None):
+        if self.cache is None or (dim is not None and self.cache.dim != dim):
+            self.cache = get_embedding_cache(self.model_name, dim)
+        return self.cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_key(self.model_name, self.normalize, text) for text in texts]
+        cache = self._cache()
+        found = cache.get_many(keys) if cache is not None else {}
+
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            cache = self._cache(len(computed[0]))
+            self.evictions += cache.put_many([keys[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                found[keys[i]] = vector
+
+        return [list(map(float, found[key])) for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def report(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,132 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+# ==== Embedding engine for ingestion ====
+# - Batch theo độ dài (sort theo len) để mỗi batch ít padding
+# - EMBED_WORKERS > 1: chia batch cho nhiều process, mỗi process một bản model
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+
+_worker_model = None
+
+
+def _init_worker(model_name: str, device: str, threads: int, model_kwargs: dict):
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    # Tránh oversubscription: mỗi process chỉ dùng phần core của mình
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name, device=device, **model_kwargs)
+
+
+def _encode_in_worker(texts: List[str], batch_size: int, normalize: bool):
+    vectors = _worker_model.encode(texts, batch_size=batch_size, normalize_embeddings=normalize,
+                                   show_progress_bar=False)
+    return vectors.tolist()
+
+
+def length_buckets(texts: List[str], batch_size: int) -> List[List[int]]:
+    """Indices of texts grouped into batches of similar length"""
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+class EmbeddingEngine(Embeddings):
+    """Length-bucketed batching over one in-process model or a pool of worker processes.
+
+    `model` is an already loaded SentenceTransformer used when workers == 1.
+    """
+
+    def __init__(self, model_name: str, model=None, batch_size: int = EMBED_BATCH_SIZE,
+                 workers: int = EMBED_WORKERS, normalize: bool = True, device: str = "cpu",
+                 model_kwargs: dict = None):
+        self.model_name = model_name
+        self.encode_kwargs = {"normalize_embeddings": normalize}
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+        self.normalize = normalize
+        self._model = model
+        self._pool = None
+
+        if self.workers > 1:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(model_name, device, threads, model_kwargs or {}),
+            )
+        elif self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(model_name, device=device, **(model_kwargs or {}))
+
+    @classmethod
+    def from_huggingface(cls, embed_model, **kwargs):
+        """Reuse the model already loaded by a langchain HuggingFaceEmbeddings"""
+        model_kwargs = dict(embed_model.model_kwargs)
+        return cls(
+            embed_model.model_name,
+            model=getattr(embed_model, "_client", None),
+            normalize=bool(embed_model.encode_kwargs.get("normalize_embeddings", False)),
+            device=model_kwargs.pop("device", "cpu"),
+            model_kwargs=model_kwargs,
+            **kwargs
+        )
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        vectors = self._model.encode(texts, batch_size=self.batch_size, normalize_embeddings=self.normalize,
+                                     show_progress_bar=False)
+        return vectors.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        buckets = length_buckets(texts, self.batch_size)
+        if self._pool is not None:
+            results = self._pool.map(
+                _encode_in_worker,
+                [[texts[i] for i in bucket] for bucket in buckets],
+                [self.batch_size] * len(buckets),
+                [self.normalize] * len(buckets),
+            )
+        else:
+            results = (self._encode([texts[i] for i in bucket]) for bucket in buckets)
+
+        # Trả về đúng thứ tự ban đầu
+        output = [None] * len(texts)
+        for bucket, vectors in zip(buckets, results):
+            for i, vector in zip(bucket, vectors):
+                output[i] = vector
+        return output
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_embedding_engine(embed_model):
+    """Process-wide engine built from the app's HuggingFaceEmbeddings.
+
+    Other Embeddings implementations are returned unchanged.
+    """
+    global _engine
+    if getattr(embed_model, "_client", None) is None:
+        return embed_model
+    with _engine_lock:
+        if _engine is None:
+            _engine = EmbeddingEngine.from_huggingface(embed_model)
+        return _engine
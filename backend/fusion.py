@@ -1,16 +1,102 @@
-from collections import defaultdict
+import hashlib
+import os
+from typing import List, Optional, Sequence, Tuple
 
-def rrf_fusion(results_list, k=60):
-    score_dict = defaultdict(float)
-    doc_map = {}
+import numpy as np
+from langchain_core.documents import Document
 
+# ==== Fusion of dense + sparse results ====
+# Tài liệu được gộp theo chunk_id (cùng id trong Qdrant và ES), không hash cả chunk.
+# rrf     : sum w / (k + rank), rank bắt đầu từ 1
+# linear  : sum w * min-max(score)  (điểm thật của Qdrant / BM25)
+# combsum : sum score / max(score) của từng danh sách
+FUSION_METHOD = os.getenv("FUSION_METHOD", "rrf")
+FUSION_RRF_K = float(os.getenv("FUSION_RRF_K", "60"))
+# Trọng số theo thứ tự danh sách: dense, sparse
+FUSION_WEIGHTS = [float(w) for w in os.getenv("FUSION_WEIGHTS", "1,1").split(",")]
+
+METHODS = ("rrf", "linear", "combsum")
+
+
+def doc_key(doc: Document) -> str:
+    chunk_id = doc.metadata.get("chunk_id")
+    if chunk_id:
+        return chunk_id
+    # Corpus cũ chưa có chunk_id: hash nội dung để dense/sparse vẫn khớp nhau
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+
+def _raw_scores(results: Sequence[Document]) -> np.ndarray:
+    scores = [doc.metadata.get("_score") for doc in results]
+    if any(score is None for score in scores):
+        # Không có điểm gốc -> dùng điểm theo thứ hạng
+        return 1.0 - np.arange(len(results), dtype=np.float64) / max(len(results), 1)
+    return np.asarray(scores, dtype=np.float64)
+
+
+def _min_max(scores: np.ndarray) -> np.ndarray:
+    low, high = scores.min(), scores.max()
+    if high == low:
+        return np.ones_like(scores)
+    return (scores - low) / (high - low)
+
+
+def _max_norm(scores: np.ndarray) -> np.ndarray:
+    high = np.abs(scores).max()
+    return scores / high if high else np.ones_like(scores)
+
+
+def fuse(results_list: Sequence[Sequence[Document]], method: str = FUSION_METHOD,
+         weights: Optional[Sequence[float]] = None, k: float = FUSION_RRF_K,
+         limit: Optional[int] = None) -> List[Tuple[Document, float]]:
+    """Fuse ranked lists into [(doc, fused_score)], best first.
+
+    A document appearing in several lists is kept once (first occurrence).
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown fusion method {method!r}, expected one of {METHODS}")
+    weights = list(weights) if weights is not None else FUSION_WEIGHTS
+    weights = (weights + [1.0] * len(results_list))[:len(results_list)]
+
+    index = {}
+    docs = []
+    columns = []
     for results in results_list:
+        column = np.empty(len(results), dtype=np.int64)
         for rank, doc in enumerate(results):
-            key = doc.page_content.strip()
-            score = 1 / (k + rank)
-            score_dict[key] += score
-            doc_map[key] = doc  # lưu giữ full document
-
-    # Sắp xếp theo tổng điểm RRF
-    sorted_docs = sorted(score_dict.items(), key=lambda x: x[1], reverse=True)
-    return [doc_map[content] for content, _ in sorted_docs]
+            key = doc_key(doc)
+            position = index.get(key)
+            if position is None:
+                position = index[key] = len(docs)
+                docs.append(doc)
+            column[rank] = position
+        columns.append(column)
+    if not docs:
+        return []
+
+    # Mỗi danh sách cộng phần đóng góp của nó vào vector điểm chung
+    fused = np.zeros(len(docs), dtype=np.float64)
+    for results, column, weight in zip(results_list, columns, weights):
+        if not len(column):
+            continue
+        if method == "rrf":
+            contribution = weight / (k + np.arange(1, len(column) + 1, dtype=np.float64))
+        elif method == "linear":
+            contribution = weight * _min_max(_raw_scores(results))
+        else:
+            contribution = weight * _max_norm(_raw_scores(results))
+        # Một chunk xuất hiện 2 lần trong cùng danh sách -> cộng dồn như cũ
+        np.add.at(fused, column, contribution)
+
+    # Sắp xếp ổn định: hòa điểm thì giữ thứ tự xuất hiện
+    order = np.argsort(-fused, kind="stable")
+    if limit is not None:
+        order = order[:limit]
+    return [(docs[i], float(fused[i])) for i in order]
+
+
+def rrf_fusion(results_list, k=60, with_scores=False):
+    fused = fuse(results_list, method="rrf", weights=[1.0] * len(results_list), k=k)
+    if with_scores:
+        return fused
+    return [doc for doc, _ in fused]
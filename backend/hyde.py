@@ -1,7 +1,7 @@
 
 
-def get_hypo_doc(query,llm):
-    prompt = f"""
+def _hyde_prompt(query):
+    return f"""
 Bạn là một trợ lý tạo tài liệu giả định (HyDE).
 Nhiệm vụ: Tạo một đoạn văn bản ngắn 3–5 câu MÔ PHỎNG nội dung tài liệu thực tế có thể chứa thông tin để trả lời câu hỏi.
 Yêu cầu nghiêm ngặt:
@@ -12,5 +12,13 @@ Yêu cầu nghiêm ngặt:
 
 Câu hỏi: "{query}"
 """
-    response = llm.invoke(prompt)
+
+
+def get_hypo_doc(query,llm):
+    response = llm.invoke(_hyde_prompt(query))
+    return response.content
+
+
+async def aget_hypo_doc(query, llm):
+    response = await llm.ainvoke(_hyde_prompt(query))
     return response.content
\ No newline at end of file
@@ -0,0 +1,112 @@
+import os
+import platform
+import re
+
+from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from util import print_timestamp
+
+# ==== CPU inference backends ====
+# torch      : model fp32 PyTorch như trước
+# onnx       : ONNX Runtime fp32
+# onnx-int8  : ONNX Runtime + dynamic int8 quantization (ít RAM, nhanh hơn trên CPU)
+# Model ONNX được export một lần vào ONNX_MODEL_DIR và dùng lại ở các lần khởi động sau.
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "data/onnx_models")
+
+
+def detect_quantization() -> str:
+    """Best int8 quantization config for this CPU: arm64 | avx512_vnni | avx512 | avx2"""
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = next((line.split(":", 1)[1].split() for line in f if line.startswith("flags")), [])
+    except OSError:
+        flags = []
+    if "avx512_vnni" in flags:
+        return "avx512_vnni"
+    if "avx512f" in flags:
+        return "avx512"
+    return "avx2"
+
+
+# arm64 | avx2 | avx512 | avx512_vnni, mặc định theo CPU của máy chạy
+ONNX_QUANTIZATION = os.getenv("ONNX_QUANTIZATION") or detect_quantization()
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# API (embed câu hỏi) và ingestion worker (embed chunk) phải dùng cùng một model
+EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "intfloat/multilingual-e5-large")
+
+
+def _export_onnx(model_cls, model_name: str, backend: str):
+    """Export (and quantize) once; returns (local path, ONNX file name)"""
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    path = os.path.join(ONNX_MODEL_DIR, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+    file_name = "onnx/model.onnx"
+    if backend == "onnx-int8":
+        file_name = f"onnx/model_qint8_{ONNX_QUANTIZATION}.onnx"
+
+    if not os.path.exists(os.path.join(path, file_name)):
+        print_timestamp(f"Exporting {model_name} to ONNX ({backend})...")
+        model = model_cls(model_name, backend="onnx", device="cpu")
+        model.save_pretrained(path)
+        if backend == "onnx-int8":
+            export_dynamic_quantized_onnx_model(model, quantization_config=ONNX_QUANTIZATION, model_name_or_path=path)
+    return path, file_name
+
+
+def embedding_model_id(embeddings) -> str:
+    """Identity of the vectors a model produces: model + backend + ONNX file (precision/quantization).
+
+    Used in embedding cache keys and recorded in the index manifest, so fp32
+    and int8 vectors are never mixed.
+    """
+    model_name = getattr(embeddings, "model_name", None)
+    if not model_name:
+        raise ValueError(f"{type(embeddings).__name__} has no model_name to identify its vectors")
+    model_kwargs = getattr(embeddings, "model_kwargs", None) or {}
+    backend = model_kwargs.get("backend", "torch")
+    if backend == "torch":
+        return model_name
+    file_name = (model_kwargs.get("model_kwargs") or {}).get("file_name", "onnx/model.onnx")
+    # model_name là thư mục export trong ONNX_MODEL_DIR: chỉ giữ tên model
+    return f"{os.path.basename(os.path.normpath(model_name))}@{backend}:{file_name}"
+
+
+def load_embedding_model(model_name: str, backend: str = INFERENCE_BACKEND, normalize: bool = True):
+    """HuggingFaceEmbeddings on the selected backend (same embed_query/embed_documents interface)"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    if backend == "torch":
+        return HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={"device": "cpu"},
+            encode_kwargs={"normalize_embeddings": normalize}
+        )
+
+    from sentence_transformers import SentenceTransformer
+    path, file_name = _export_onnx(SentenceTransformer, model_name, backend)
+    return HuggingFaceEmbeddings(
+        model_name=path,
+        model_kwargs={"device": "cpu", "backend": "onnx", "model_kwargs": {"file_name": file_name}},
+        encode_kwargs={"normalize_embeddings": normalize}
+    )
+
+
+def load_cross_encoder(model_name: str, backend: str = INFERENCE_BACKEND):
+    """HuggingFaceCrossEncoder on the selected backend (same score() interface)"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    if backend == "torch":
+        return HuggingFaceCrossEncoder(model_name=model_name)
+
+    from sentence_transformers import CrossEncoder
+    path, file_name = _export_onnx(CrossEncoder, model_name, backend)
+    return HuggingFaceCrossEncoder(
+        model_name=path,
+        model_kwargs={"device": "cpu", "backend": "onnx", "model_kwargs": {"file_name": file_name}}
+    )
@@ -0,0 +1,176 @@
+import os
+import queue
+import threading
+import time
+from typing import Callable, Iterable, List, Tuple
+
+from telemetry import record, in_context
+
+# ==== Bounded streaming ingestion pipeline ====
+# split -> BM25 bulk index -> embed -> Qdrant upsert, mỗi stage một thread,
+# nối với nhau bằng queue có giới hạn: stage sau chậm thì stage trước phải chờ
+# (backpressure), nên bộ nhớ chỉ giữ vài batch thay vì cả corpus.
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "2"))
+INGEST_PROGRESS_INTERVAL = float(os.getenv("INGEST_PROGRESS_INTERVAL", "2"))
+
+_DONE = object()
+
+
+def batched(items: Iterable, size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ChunkBatch:
+    """Fixed-size group of splits flowing through the pipeline.
+
+    `progress` is the fraction (0..1) of the whole job covered once this batch
+    is done; `last` marks the end of a document.
+    """
+    __slots__ = ("file", "splits", "vectors", "progress", "last")
+
+    def __init__(self, file: dict, splits: list, progress: float, last: bool = False):
+        self.file = file
+        self.splits = splits
+        self.vectors = None
+        self.progress = progress
+        self.last = last
+
+
+class StageCounter:
+    def __init__(self, name: str):
+        self.name = name
+        self.chunks = 0
+        self.busy = 0.0
+        self.progress = 0.0
+
+    def add(self, batch: ChunkBatch, seconds: float):
+        self.chunks += len(batch.splits)
+        self.busy += seconds
+        self.progress = max(self.progress, batch.progress)
+
+    def snapshot(self) -> dict:
+        # chunks_per_sec tính trên thời gian stage thực sự làm việc -> thấy ngay stage nghẽn
+        return {
+            "chunks": self.chunks,
+            "chunks_per_sec": round(self.chunks / self.busy, 1) if self.busy else 0.0,
+            "percent": round(100 * self.progress, 1)
+        }
+
+
+class PipelineError(Exception):
+    def __init__(self, stage: str, error: Exception):
+        super().__init__(f"{stage}: {error}")
+        self.stage = stage
+        self.error = error
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def run_pipeline(source: Iterable[ChunkBatch], stages: List[Tuple[str, Callable[[ChunkBatch], None]]],
+                 on_progress: Callable[[dict], None] = None, source_name: str = "split",
+                 queue_size: int = INGEST_QUEUE_SIZE, interval: float = INGEST_PROGRESS_INTERVAL) -> dict:
+    """Stream batches from `source` through `stages` in order, one thread per stage.
+
+    Each stage is (name, fn) where fn(batch) works in place. `on_progress` gets
+    the per-stage counters every `interval` seconds. Returns the final counters;
+    the first stage failure stops the pipeline and is raised as PipelineError.
+    """
+    counters = [StageCounter(source_name)] + [StageCounter(name) for name, _ in stages]
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    stop = threading.Event()
+    errors = []
+
+    def fail(name, e):
+        errors.append(PipelineError(name, e))
+        stop.set()
+
+    def produce():
+        items = iter(source)
+        try:
+            while True:
+                start = time.perf_counter()
+                batch = next(items, _DONE)
+                if batch is _DONE:
+                    break
+                elapsed = time.perf_counter() - start
+                counters[0].add(batch, elapsed)
+                record(f"ingest.{source_name}", elapsed * 1000, attrs={"chunks": len(batch.splits)})
+                if not _put(queues[0], batch, stop):
+                    return
+            _put(queues[0], _DONE, stop)
+        except Exception as e:
+            fail(source_name, e)
+        finally:
+            # Đóng generator (và file tạm đang mở) nếu pipeline dừng giữa chừng
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+    def consume(i):
+        name, fn = stages[i]
+        out = queues[i + 1] if i + 1 < len(queues) else None
+        try:
+            while True:
+                batch = _get(queues[i], stop)
+                if batch is _DONE:
+                    break
+                start = time.perf_counter()
+                try:
+                    fn(batch)
+                except Exception as e:
+                    record(f"ingest.{name}", (time.perf_counter() - start) * 1000, type(e).__name__)
+                    raise
+                elapsed = time.perf_counter() - start
+                counters[i + 1].add(batch, elapsed)
+                record(f"ingest.{name}", elapsed * 1000, attrs={"chunks": len(batch.splits)})
+                if out is not None and not _put(out, batch, stop):
+                    return
+            if out is not None:
+                _put(out, _DONE, stop)
+        except Exception as e:
+            fail(name, e)
+
+    # in_context: span của các stage mang request_id/user của job
+    threads = [threading.Thread(target=in_context(produce), name=f"ingest-{source_name}", daemon=True)]
+    threads += [threading.Thread(target=in_context(consume), args=(i,), name=f"ingest-{name}", daemon=True)
+                for i, (name, _) in enumerate(stages)]
+    for thread in threads:
+        thread.start()
+
+    def report():
+        return {counter.name: counter.snapshot() for counter in counters}
+
+    while any(thread.is_alive() for thread in threads):
+        threads[-1].join(timeout=interval)
+        if on_progress is not None and not stop.is_set():
+            on_progress(report())
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return report()
@@ -0,0 +1,165 @@
+import os
+import uuid
+from typing import List
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from dense import ensure_collection, upsert_vectors, delete_document
+from document_status import update_document_status, update_document_progress, get_indexed_files, \
+    reset_indexed_files, set_indexed_file, remove_indexed_file, get_indexed_model, set_indexed_model
+from embedding_cache import CachedEmbeddings
+from embedding_engine import get_embedding_engine, EMBED_BATCH_SIZE, EMBED_WORKERS
+from inference_backends import embedding_model_id
+from sparse import ensure_index_bm25, index_splits_bm25, delete_document_bm25, refresh_index_bm25
+from ingest_pipeline import ChunkBatch, batched, run_pipeline
+from pdf_loader import download_pdf, iter_pdf_pages
+from uploads3 import S3Upload
+from telemetry import span
+from util import print_timestamp
+
+
+def chunk_id(file_key: str, index: int) -> str:
+    """Deterministic chunk ID, shared by the Qdrant point and the ES document"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{file_key}#{index}"))
+
+
+def iter_splits(splitter, pages, file: dict, username: str):
+    """Split pages lazily, tagging each chunk with its document and deterministic ID"""
+    file_name = os.path.basename(file["key"])
+    index = 0
+    for page in pages:
+        for split in splitter.split_documents([page]):
+            split.metadata["source"] = file_name
+            split.metadata["username"] = username
+            split.metadata["file_key"] = file["key"]
+            split.metadata["content_hash"] = file["etag"]
+            split.metadata["chunk_id"] = chunk_id(file["key"], index)
+            index += 1
+            yield split
+
+
+def iter_batches(splitter, files: List[dict], username: str, indexed: dict, s3_client, bucket_name: str,
+                 batch_size: int):
+    """Download, extract and split `files` one after another as fixed-size ChunkBatches"""
+    for i, file in enumerate(files):
+        if file["key"] in indexed:
+            # Phiên bản cũ có thể có nhiều chunk hơn -> xóa trước khi upsert
+            deindex_document(username, file["key"])
+
+        print_timestamp(f"Loading document: {file['key']}")
+        with download_pdf(s3_client, bucket_name, file["key"]) as path:
+            pages = iter_pdf_pages(path, source=file["key"])
+            for splits in batched(iter_splits(splitter, pages, file, username), batch_size):
+                # Tiến độ = số file đã xong + phần trang đã đọc của file hiện tại
+                page = splits[-1].metadata
+                yield ChunkBatch(file, splits, (i + (page["page"] + 1) / page["total_pages"]) / len(files))
+        yield ChunkBatch(file, [], (i + 1) / len(files), last=True)
+
+
+def deindex_document(username: str, file_key: str):
+    """Remove one document's chunks from Qdrant and Elasticsearch"""
+    with span("ingest.deindex"):
+        delete_document(username, file_key)
+        delete_document_bm25(username, file_key)
+
+
+def remove_document(username: str, file_key: str):
+    """Deindex a deleted document if it was indexed and drop it from the manifest"""
+    indexed = get_indexed_files(username) or {}
+    if file_key in indexed:
+        deindex_document(username, file_key)
+        remove_indexed_file(username, file_key)
+
+
+def process_files(embed_model, files: List[dict], username: str, answer_cache=None,
+                  bucket_name: str = "arag", s3_client=None):
+    """Incrementally sync the user's index with `files` (S3 listing: key, etag).
+
+    Only new or changed documents (by S3 key + ETag) are embedded and
+    upserted; chunks of documents no longer in S3 are deleted.
+    """
+    print_timestamp("Start processing files")
+    s3_client = s3_client or S3Upload().s3
+
+    # Update status to processing
+    update_document_status(username, "processing", [file["key"] for file in files])
+
+    # Chunk không đổi (cùng model + backend + nội dung) không phải embed lại;
+    # phần còn lại đi qua engine batch theo độ dài / nhiều process
+    model_id = embedding_model_id(embed_model)
+    embeddings = CachedEmbeddings(get_embedding_engine(embed_model), model_name=model_id)
+
+    try:
+        indexed = get_indexed_files(username)
+        # Corpus cũ (index toàn bộ, chưa có file_key) -> rebuild một lần
+        legacy = indexed is None
+        if legacy:
+            reset_indexed_files(username)
+            indexed = {}
+
+        # Không trộn vector của model/backend khác (vd. fp32 và int8) trong một collection
+        indexed_model = get_indexed_model(username)
+        if indexed and indexed_model and indexed_model != model_id:
+            raise ValueError(f"{username}'s index was built with {indexed_model}, this process embeds with "
+                             f"{model_id}: use the same INFERENCE_BACKEND or reindex the user")
+        if indexed_model != model_id:
+            set_indexed_model(username, model_id)
+
+        ensure_collection(username, embed_model, reset=legacy)
+        ensure_index_bm25(username, reset=legacy)
+
+        current = {file["key"]: file for file in files}
+        removed = [key for key in indexed if key not in current]
+        changed = [file for file in files if indexed.get(file["key"]) != file["etag"]]
+        print_timestamp(f"{len(changed)} new/changed, {len(removed)} removed, "
+                        f"{len(files) - len(changed)} unchanged documents")
+
+        for file_key in removed:
+            print_timestamp(f"Removing document: {file_key}")
+            deindex_document(username, file_key)
+            remove_indexed_file(username, file_key)
+
+        # --- Choose text splitter ---
+        splitter = RecursiveCharacterTextSplitter(chunk_size=10000, chunk_overlap=500)
+
+        def index_bm25(batch: ChunkBatch):
+            if batch.splits:
+                index_splits_bm25(username, batch.splits, refresh=False)
+
+        def embed(batch: ChunkBatch):
+            if batch.splits:
+                batch.vectors = embeddings.embed_documents([split.page_content for split in batch.splits])
+
+        def upsert(batch: ChunkBatch):
+            if batch.splits:
+                upsert_vectors(username, batch.splits, batch.vectors)
+            if batch.last:
+                refresh_index_bm25(username)
+                # Ghi manifest sau mỗi file để lần chạy sau không làm lại phần đã xong
+                set_indexed_file(username, batch.file["key"], batch.file["etag"])
+                print_timestamp(f"Indexed document: {batch.file['key']}")
+
+        progress = run_pipeline(
+            iter_batches(splitter, changed, username, indexed, s3_client, bucket_name,
+                         EMBED_BATCH_SIZE * EMBED_WORKERS),
+            [("bm25", index_bm25), ("embed", embed), ("qdrant", upsert)],
+            on_progress=lambda counters: update_document_progress(username, counters)
+        )
+        print_timestamp(f"Pipeline throughput: {progress}")
+
+        report = embeddings.report()
+        print_timestamp(f"Finished processing files, embedding cache: {report}")
+
+        # Update status to processed
+        update_document_status(username, "processed", extra={"embedding_cache": report, "progress": progress})
+
+    except Exception as e:
+        print_timestamp(f"Error processing files: {e}")
+        # Update status to error
+        update_document_status(username, "error")
+        # Để worker quyết định retry
+        raise
+    finally:
+        # Corpus đã thay đổi -> câu trả lời cũ trong cache không còn đúng
+        if answer_cache is not None:
+            answer_cache.invalidate(username)
@@ -0,0 +1,269 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# ==== Durable job queue for ingestion ====
+# API chỉ enqueue job; worker process (worker.py) claim job một cách atomic,
+# retry khi lỗi và chạy tối đa một job mỗi user tại một thời điểm.
+# Mặc định là SQLite (WAL) trong thư mục data/ dùng chung giữa API và worker.
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "sqlite")
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "jobs.sqlite3"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "30"))
+# Worker gia hạn lease trong lúc chạy; lease hết hạn = worker đã chết -> job được claim lại
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    username TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    lease_until REAL,
+    worker TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_run_after ON jobs (status, run_after);
+CREATE INDEX IF NOT EXISTS jobs_username_status ON jobs (username, status);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    username TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class Job(object):
+    __slots__ = ("id", "kind", "username", "payload", "status", "attempts", "max_attempts", "worker", "error",
+                 "created_at", "updated_at")
+
+    def __init__(self, row):
+        self.id = row["id"]
+        self.kind = row["kind"]
+        self.username = row["username"]
+        self.payload = json.loads(row["payload"])
+        self.status = row["status"]
+        self.attempts = row["attempts"]
+        self.max_attempts = row["max_attempts"]
+        self.worker = row["worker"]
+        self.error = row["error"]
+        self.created_at = row["created_at"]
+        self.updated_at = row["updated_at"]
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class SQLiteJobQueue(object):
+    """Job queue stored in one SQLite file, safe to share between processes.
+
+    Claiming runs inside `BEGIN IMMEDIATE`, so two workers never get the same
+    job, and a job is only claimable while its user has no other live job.
+    """
+
+    def __init__(self, path: str = JOB_QUEUE_PATH, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 retry_delay: float = JOB_RETRY_DELAY, lease_seconds: float = JOB_LEASE_SECONDS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Một connection cho mỗi thread; isolation_level=None để tự quản lý transaction
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        return _Transaction(conn)
+
+    def enqueue(self, kind: str, username: str, payload: dict = None, coalesce: bool = True) -> int:
+        """Queue a job and return its ID.
+
+        With `coalesce`, a job of the same kind still waiting for this user is
+        reused (its payload replaced) instead of queueing a duplicate run.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE kind = ? AND username = ? AND status = ? ORDER BY id LIMIT 1",
+                (kind, username, QUEUED)
+            ).fetchone() if coalesce else None
+            if row is not None:
+                conn.execute("UPDATE jobs SET payload = ?, updated_at = ? WHERE id = ?",
+                             (json.dumps(payload or {}), now, row["id"]))
+                return row["id"]
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, username, payload, status, max_attempts, run_after, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, username, json.dumps(payload or {}), QUEUED, self.max_attempts, now, now, now)
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker: str):
+        """Atomically take the oldest runnable job, or return None"""
+        now = time.time()
+        with self._transaction() as conn:
+            # Job RUNNING có lease quá hạn -> worker đã chết (vd. OOM vì chính job này):
+            # trả lại hàng đợi, hoặc FAILED nếu đã dùng hết số lần thử
+            conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN ? ELSE ? END, "
+                "error = 'Lease expired: worker died or stalled', worker = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE status = ? AND lease_until < ?",
+                (FAILED, QUEUED, now, RUNNING, now)
+            )
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? AND run_after <= ? AND username NOT IN "
+                "(SELECT username FROM jobs WHERE status = ?) ORDER BY run_after, id LIMIT 1",
+                (QUEUED, now, RUNNING)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, worker = ?, lease_until = ?, updated_at = ? "
+                "WHERE id = ?",
+                (RUNNING, worker, now + self.lease_seconds, now, row["id"])
+            )
+            return Job(conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        """Extend the lease; False if the job is no longer running for `worker`"""
+        now = time.time()
+        cursor = self._connect().execute(
+            "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = ?",
+            (now + self.lease_seconds, now, job_id, worker, RUNNING)
+        )
+        return cursor.rowcount > 0
+
+    def complete(self, job_id: int, worker: str) -> bool:
+        """Mark the job done; False if `worker` lost it (lease expired and reclaimed)"""
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = ?, lease_until = NULL, error = NULL, updated_at = ? "
+            "WHERE id = ? AND worker = ? AND status = ?",
+            (DONE, time.time(), job_id, worker, RUNNING)
+        )
+        return cursor.rowcount > 0
+
+    def fail(self, job_id: int, worker: str, error: str) -> bool:
+        """Record a failed attempt; returns True if the job will be retried.
+
+        Does nothing (returns False) if `worker` no longer holds the job.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ? AND worker = ? AND status = ?",
+                               (job_id, worker, RUNNING)).fetchone()
+            if row is None:
+                return False
+            retry = row["attempts"] < row["max_attempts"]
+            # Backoff lũy thừa: retry_delay, 2*retry_delay, 4*retry_delay...
+            run_after = now + self.retry_delay * 2 ** (row["attempts"] - 1) if retry else now
+            conn.execute(
+                "UPDATE jobs SET status = ?, run_after = ?, lease_until = NULL, worker = NULL, error = ?, "
+                "updated_at = ? WHERE id = ?",
+                (QUEUED if retry else FAILED, run_after, error, now, job_id)
+            )
+            return retry
+
+    def get(self, job_id: int):
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job(row) if row is not None else None
+
+    def active_job(self, username: str, kind: str = None):
+        """The user's running or queued job (running first), or None"""
+        query = "SELECT * FROM jobs WHERE username = ? AND status IN (?, ?)"
+        params = [username, RUNNING, QUEUED]
+        if kind is not None:
+            query += " AND kind = ?"
+            params.append(kind)
+        row = self._connect().execute(query + " ORDER BY status = ? DESC, id LIMIT 1",
+                                      params + [RUNNING]).fetchone()
+        return Job(row) if row is not None else None
+
+    def latest_job(self, username: str, kind: str = None):
+        query = "SELECT * FROM jobs WHERE username = ?"
+        params = [username]
+        if kind is not None:
+            query += " AND kind = ?"
+            params.append(kind)
+        row = self._connect().execute(query + " ORDER BY id DESC LIMIT 1", params).fetchone()
+        return Job(row) if row is not None else None
+
+    # ---- Events between processes ----
+    # Worker ghi "corpus_changed" sau khi index; API poll để xóa semantic cache của user đó.
+    def publish(self, kind: str, username: str):
+        self._connect().execute("INSERT INTO events (kind, username, created_at) VALUES (?, ?, ?)",
+                                (kind, username, time.time()))
+
+    def events_since(self, last_id: int, kind: str = None):
+        """[(id, kind, username)] of events after `last_id`"""
+        query = "SELECT id, kind, username FROM events WHERE id > ?"
+        params = [last_id]
+        if kind is not None:
+            query += " AND kind = ?"
+            params.append(kind)
+        return [tuple(row) for row in self._connect().execute(query + " ORDER BY id", params).fetchall()]
+
+    def last_event_id(self) -> int:
+        return self._connect().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def prune(self, older_than: float = 7 * 86400):
+        """Delete finished jobs and events older than `older_than` seconds"""
+        cutoff = time.time() - older_than
+        conn = self._connect()
+        conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (DONE, FAILED, cutoff))
+        conn.execute("DELETE FROM events WHERE created_at < ?", (cutoff,))
+
+
+class _Transaction(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+BACKENDS = {
+    "sqlite": SQLiteJobQueue,
+}
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Process-wide queue for the backend selected by JOB_QUEUE_BACKEND"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            if JOB_QUEUE_BACKEND not in BACKENDS:
+                raise ValueError(f"Unknown JOB_QUEUE_BACKEND {JOB_QUEUE_BACKEND!r}, expected one of {sorted(BACKENDS)}")
+            _queue = BACKENDS[JOB_QUEUE_BACKEND]()
+        return _queue
@@ -1,7 +1,13 @@
+import os
+import threading
+
+import numpy as np
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnableLambda
 
+from telemetry import span
+
 # Prompt chỉ yêu cầu trả về label
 classification_prompt = PromptTemplate.from_template("""
 You are a routing classifier. Classify the user's question into exactly one of:
@@ -13,22 +19,160 @@ Return only one lowercase word: retrieve, search, or chitchat.
 Question: {question}
 """)
 
+# Câu hỏi mẫu cho từng label; centroid embedding của mỗi nhóm dùng để phân loại local
+ROUTER_PROTOTYPES = {
+    "retrieve": [
+        "Tài liệu nói gì về chủ đề này?",
+        "Tóm tắt nội dung chương 2 trong file tôi đã tải lên.",
+        "Theo tài liệu, định nghĩa của khái niệm này là gì?",
+        "Trong báo cáo, doanh thu năm ngoái là bao nhiêu?",
+        "Liệt kê các bước được mô tả trong hướng dẫn.",
+        "Tác giả của tài liệu đưa ra kết luận gì?",
+        "What does the document say about the refund policy?",
+        "Summarize the uploaded PDF.",
+        "According to the report, what are the main findings?",
+        "Which section of my file explains the installation steps?",
+    ],
+    "search": [
+        "Thời tiết Hà Nội hôm nay thế nào?",
+        "Tin tức mới nhất về giá vàng hôm nay.",
+        "Tỷ giá đô la hôm nay là bao nhiêu?",
+        "Kết quả trận bóng đá tối qua.",
+        "Ai đang là chủ tịch nước hiện nay?",
+        "Giá iPhone mới nhất trên thị trường là bao nhiêu?",
+        "What is the latest news about the stock market?",
+        "Who won the election this year?",
+        "What is the weather forecast for tomorrow?",
+        "Current price of Bitcoin.",
+    ],
+    "chitchat": [
+        "Xin chào!",
+        "Bạn khỏe không?",
+        "Cảm ơn bạn nhiều nhé.",
+        "Bạn tên là gì?",
+        "Kể cho tôi một câu chuyện cười.",
+        "Tạm biệt, hẹn gặp lại.",
+        "Hello, how are you?",
+        "Thanks, that was helpful!",
+        "Who are you?",
+        "Good morning!",
+    ],
+}
+
+# Dưới các ngưỡng này router local không đủ tự tin và sẽ hỏi LLM
+ROUTER_MIN_SCORE = float(os.getenv("ROUTER_MIN_SCORE", "0.80"))
+ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "0.02"))
+ROUTER_MODE = os.getenv("ROUTER_MODE", "local")  # local | llm
+
 
 # === Router chain ===
-def build_router_node(llm):
+VALID_LABELS = {"retrieve", "search", "chitchat"}
+
+
+class PrototypeRouter(object):
+    """Nearest-centroid classifier over the embedding model already loaded for retrieval."""
+
+    def __init__(self, embed_model, prototypes=None, min_score=ROUTER_MIN_SCORE, min_margin=ROUTER_MIN_MARGIN):
+        prototypes = prototypes or ROUTER_PROTOTYPES
+        self.embed_model = embed_model
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.labels = list(prototypes)
+
+        centroids = []
+        for label in self.labels:
+            vectors = np.asarray(embed_model.embed_documents(prototypes[label]), dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            centroid = vectors.mean(axis=0)
+            centroids.append(centroid / np.linalg.norm(centroid))
+        self.centroids = np.vstack(centroids)
+
+        self._lock = threading.Lock()
+        self.counts = {"local": 0, "fallback": 0}
+        self.label_counts = {label: 0 for label in VALID_LABELS}
+
+    def classify(self, embedding):
+        """Return (label, confident, scores) for a question embedding"""
+        # Chia ngoài chỗ: embedding của caller còn được dùng cho retrieval / cache
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        scores = self.centroids @ vector
+        order = np.argsort(scores)[::-1]
+        best, second = float(scores[order[0]]), float(scores[order[1]])
+        confident = best >= self.min_score and best - second >= self.min_margin
+        return self.labels[order[0]], confident, dict(zip(self.labels, scores.tolist()))
+
+    def record(self, label, fallback):
+        with self._lock:
+            self.counts["fallback" if fallback else "local"] += 1
+            self.label_counts[label] = self.label_counts.get(label, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.counts["local"] + self.counts["fallback"]
+            return {
+                "total": total,
+                "local": self.counts["local"],
+                "fallback": self.counts["fallback"],
+                "fallback_rate": self.counts["fallback"] / total if total else 0.0,
+                "labels": dict(self.label_counts),
+            }
+
+
+def _to_state(question, label, embedding=None):
+    label = label.strip().lower()
+    if label not in VALID_LABELS:
+        label = "chitchat"
+
+    state = {
+        "classification": label,
+        "question": question
+    }
+    if embedding is not None:
+        # Tái sử dụng embedding của câu hỏi ở các bước sau (semantic cache)
+        state["question_embedding"] = embedding
+    return state
+
+
+def build_router_node(llm, prototype_router=None):
     classification_chain = classification_prompt | llm | StrOutputParser()
 
     def classify(state):
         question = state["question"]
-        label = classification_chain.invoke({"question": question}).strip().lower()
-        valid_labels = {"retrieve", "search", "chitchat"}
-        print(label)
-        if label not in valid_labels:
-            label = "chitchat"
-
-        return {
-            "classification": label,
-            "question": question
-        }
-
-    return RunnableLambda(classify)
+        embedding = None
+        with span("route") as attrs:
+            if prototype_router is not None:
+                embedding = prototype_router.embed_model.embed_query(question)
+                label, confident, _ = prototype_router.classify(embedding)
+                if confident:
+                    prototype_router.record(label, fallback=False)
+                    attrs.update(label=label, fallback=False)
+                    return _to_state(question, label, embedding)
+
+            label = classification_chain.invoke({"question": question})
+            result = _to_state(question, label, embedding)
+            if prototype_router is not None:
+                prototype_router.record(result["classification"], fallback=True)
+            attrs.update(label=result["classification"], fallback=True)
+            return result
+
+    async def aclassify(state):
+        question = state["question"]
+        embedding = None
+        with span("route") as attrs:
+            if prototype_router is not None:
+                embedding = await prototype_router.embed_model.aembed_query(question)
+                label, confident, _ = prototype_router.classify(embedding)
+                if confident:
+                    prototype_router.record(label, fallback=False)
+                    attrs.update(label=label, fallback=False)
+                    return _to_state(question, label, embedding)
+
+            label = await classification_chain.ainvoke({"question": question})
+            result = _to_state(question, label, embedding)
+            if prototype_router is not None:
+                prototype_router.record(result["classification"], fallback=True)
+            attrs.update(label=result["classification"], fallback=True)
+            return result
+
+    return RunnableLambda(classify, afunc=aclassify)
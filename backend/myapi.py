@@ -1,3 +1,4 @@
+import asyncio
 import json
 from typing import List, Optional
 import traceback
@@ -8,45 +9,45 @@ from authlib.integrations.starlette_client import OAuth
 from botocore.exceptions import ClientError
 from elasticsearch import Elasticsearch
 from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
-from langchain_core.runnables import RunnableBranch
 from fastapi import FastAPI, Request
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.messages import AIMessage, HumanMessage
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
-from starlette.responses import RedirectResponse, HTMLResponse, JSONResponse
+from starlette.responses import RedirectResponse, HTMLResponse, JSONResponse, StreamingResponse, PlainTextResponse
 import uuid
 from datetime import datetime, timezone
 
-from main import build_router_node
 from uploads3 import S3Upload
+from streaming_upload import stream_upload, UploadError
 import io
-from langchain_community.document_loaders import PyPDFLoader
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_experimental.text_splitter import SemanticChunker
-from langchain_qdrant import QdrantVectorStore
 import os
-from fastapi import BackgroundTasks
 from pydantic import BaseModel
 
-from elastic_search import index_splits_bm25
 from util import print_timestamp
-from rag_pipeline import create_rag_chain, \
-    create_search_chain, create_chat_chain
+from telemetry import RequestContextMiddleware, registry as span_registry, span, set_user
+from rag_pipeline import build_chain_registry
+from clients import init_clients, close_clients
+from auth import CognitoTokenVerifier, TokenAuthenticator, InvalidToken, JWKSUnavailable
+from semantic_cache import SemanticAnswerCache
+from chat_history import ConversationStore
+from document_status import update_document_status, get_document_status
+from document_catalog import get_document_catalog, sync_catalog, DOCUMENT_PAGE_SIZE, DOCUMENT_MAX_PAGE_SIZE
+from job_queue import get_job_queue, JOB_POLL_INTERVAL
+from worker import CORPUS_CHANGED
 from contextlib import asynccontextmanager
-from langchain.retrievers.document_compressors import CrossEncoderReranker
-from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+from reranker import Reranker
+from inference_backends import INFERENCE_BACKEND, EMBED_MODEL_NAME, load_embedding_model, load_cross_encoder
 
 
 # load model
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print_timestamp("🚀 Loading embedding model...")
+    print_timestamp(f"🚀 Loading embedding model ({INFERENCE_BACKEND})...")
 
-    app.state.embed_model = HuggingFaceEmbeddings(
-        model_name="intfloat/multilingual-e5-large",
-        model_kwargs={"device": "cpu"},
-        encode_kwargs={"normalize_embeddings": True}
-    )
+    app.state.embed_model = load_embedding_model(EMBED_MODEL_NAME)
 
     # app.state.embed_model = HuggingFaceEmbeddings(
     #     model_name="./models/bge-m3",
@@ -55,10 +56,8 @@ async def lifespan(app: FastAPI):
     # )
     print_timestamp("🚀 Finish loading embedding model...")
     print_timestamp("🚀 Loading reranker model...")
-    cross_encoder = HuggingFaceCrossEncoder(
-        model_name="BAAI/bge-reranker-v2-m3",
-    )
-    app.state.reranker = CrossEncoderReranker(model=cross_encoder,top_n=5)
+    cross_encoder = load_cross_encoder("BAAI/bge-reranker-v2-m3")
+    app.state.reranker = Reranker(cross_encoder, top_n=5)
     app.state.llm = ChatGoogleGenerativeAI(
         model="gemini-2.5-flash",
         temperature=0.5,
@@ -66,9 +65,43 @@ async def lifespan(app: FastAPI):
     )
     print_timestamp("🚀 Finish loading reranker model...")
 
+    # Build the chain graph once; username/session_id come from the runnable config
+    app.state.answer_cache = SemanticAnswerCache()
+    app.state.chains = build_chain_registry(
+        app.state.llm, app.state.embed_model, app.state.reranker, app.state.answer_cache
+    )
+
+    # Pooled Qdrant/Elasticsearch clients shared by every request
+    init_clients()
+
+    # Ingestion chạy ở worker process; API chỉ enqueue job và nghe event corpus thay đổi
+    app.state.job_queue = get_job_queue()
+    # Kiểm tra/tạo bucket một lần lúc khởi động (S3Upload cache kết quả)
+    if not await run_in_threadpool(aws.ensure_bucket, "arag"):
+        print_timestamp("⚠️ S3 bucket 'arag' is not available, uploads will retry the check")
+    watcher = asyncio.create_task(watch_corpus_changes(app))
+
 
     yield  # <== Sau yield là logic khi shutdown (nếu cần)
     print_timestamp("🧹 App shutdown. Clean up if needed.")
+    watcher.cancel()
+    close_clients()
+
+
+async def watch_corpus_changes(app: FastAPI):
+    """Invalidate cached answers of users whose documents a worker re-indexed"""
+    job_queue = app.state.job_queue
+    last_id = await run_in_threadpool(job_queue.last_event_id)
+    while True:
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+        try:
+            events = await run_in_threadpool(job_queue.events_since, last_id, CORPUS_CHANGED)
+        except Exception as e:
+            print(f"Error polling job events: {e}")
+            continue
+        for event_id, _, username in events:
+            app.state.answer_cache.invalidate(username)
+            last_id = event_id
 
 
 app = FastAPI(lifespan=lifespan)
@@ -89,8 +122,33 @@ app.add_middleware(
 )
 
 app.add_middleware(SessionMiddleware, secret_key=os.urandom(24))
+# request_id cho mọi span của request + histogram thời gian từng endpoint
+app.add_middleware(RequestContextMiddleware)
+
 
+def get_cognito_user(token: str) -> dict:
+    """Fetch user attributes from Cognito (remote call)"""
+    user_data = cognito_client.get_user(AccessToken=token)
 
+    email = ""
+    user_id = ""
+    username = user_data["Username"]
+
+    for attr in user_data["UserAttributes"]:
+        if attr["Name"] == "email":
+            email = attr["Value"]
+        elif attr["Name"] == "sub":
+            user_id = attr["Value"]
+
+    return {
+        "user_id": user_id,
+        "email": email,
+        "username": username
+    }
+
+
+# Sync dependency on purpose: FastAPI runs it in the threadpool, so the
+# occasional Cognito call (JWKS refresh, first email lookup) never stalls the event loop.
 def auth_middleware(request: Request):
     token = request.cookies.get("access_token")
     if not token:
@@ -105,196 +163,109 @@ def auth_middleware(request: Request):
         )
 
     try:
-        user_data = cognito_client.get_user(AccessToken=token)
-
-        email = ""
-        user_id = ""
-        username = user_data["Username"]
-
-        for attr in user_data["UserAttributes"]:
-            if attr["Name"] == "email":
-                email = attr["Value"]
-            elif attr["Name"] == "sub":
-                user_id = attr["Value"]
-
-        return {
-            "user_id": user_id,
-            "email": email,
-            "username": username
-        }
-    except ClientError:
+        # Verify chữ ký + claims tại local, chỉ gọi Cognito khi chưa có email trong cache
+        with span("auth"):
+            user_data = authenticator.authenticate(token)
+        set_user(user_data["username"])
+        return user_data
+    except (InvalidToken, ClientError):
         raise HTTPException(status_code=401, detail="Invalid token")
+    except JWKSUnavailable:
+        # Chưa lấy được JWKS lần nào: lỗi phía server, không phải token sai
+        raise HTTPException(status_code=503, detail="Token verification unavailable")
 
 
 aws = S3Upload()
+document_catalog = get_document_catalog()
 
-# Document status tracking
-def get_document_status_table():
-    return dynamodb.Table('DocumentStatus')
+# Upload documents and process
+@app.post("/api/upload/")
+async def upload_files(request: Request, user_data: dict = Depends(auth_middleware)):
+    """Stream the multipart `files` field straight into S3 (see streaming_upload)"""
+    bucket_name = "arag"
+    username = user_data["username"]
 
-def update_document_status(username: str, status: str, file_keys: List[str] = None):
-    """Update document processing status for a user"""
-    table = get_document_status_table()
-    timestamp = datetime.now(timezone.utc).isoformat()
-    
-    try:
-        if status == "processing":
-            # Start processing - store file keys being processed
-            table.put_item(Item={
-                "username": username,
-                "status": status,
-                "file_keys": file_keys or [],
-                "started_at": timestamp,
-                "updated_at": timestamp
-            })
-        else:
-            # Update existing status
-            table.update_item(
-                Key={"username": username},
-                UpdateExpression="SET #status = :status, updated_at = :updated_at",
-                ExpressionAttributeNames={"#status": "status"},
-                ExpressionAttributeValues={
-                    ":status": status,
-                    ":updated_at": timestamp
-                }
-            )
-    except Exception as e:
-        print(f"Error updating document status: {e}")
+    if not await run_in_threadpool(aws.ensure_bucket, bucket_name):
+        return {"error": "Bucket creation failed"}
 
-def get_document_status(username: str):
-    """Get current document processing status for a user"""
-    table = get_document_status_table()
     try:
-        response = table.get_item(Key={"username": username})
-        if 'Item' in response:
-            return response['Item']
-        return {"status": "no_documents", "updated_at": datetime.now(timezone.utc).isoformat()}
-    except Exception as e:
-        print(f"Error getting document status: {e}")
-        return {"status": "no_documents", "updated_at": datetime.now(timezone.utc).isoformat()}
+        uploaded = await stream_upload(request.stream(), request.headers.get("content-type", ""),
+                                       aws.s3, bucket_name, username)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-# Upload documents and process
-@app.post("/api/upload/")
-async def upload_files( files: List[UploadFile] = File(...),
-                       user_data: dict = Depends(auth_middleware)):
     results = []
-    bucket_name = "arag"
-    username = user_data["username"]
-    all_file_urls = []
     file_keys = []
-
-    if not aws.is_bucket_exist(bucket_name):
-        created = aws.create_bucket(bucket_name)
-        if not created:
-            return {"error": "Bucket creation failed"}
-
-    for file in files:
-        contents = await file.read()
-        file_stream = io.BytesIO(contents)
-        file_url = aws.upload_file_to_s3(file_stream, file.filename, bucket_name, username)
-        if file_url:
-            # Extract file key from URL
-            file_key = file_url.split('/')[-1]
-            file_keys.append(file_key)
-            all_file_urls.append(file_url)
-            results.append({"filename": file.filename, "url": file_url, "size": file.size, "type": file.content_type})
-        else:
-            results.append({"filename": file.filename, "error": "Upload failed"})
+    for file in uploaded:
+        if "error" in file:
+            results.append({"filename": file["filename"], "error": file["error"]})
+            continue
+        file_info = aws._file_info(username, file["key"], file["size"], file["etag"], file["last_modified"])
+        await run_in_threadpool(document_catalog.put, username, file_info)
+        file_keys.append(file["key"])
+        results.append({"filename": file["filename"], "key": file["key"], "size": file["size"],
+                        "type": file["content_type"]})
+    if not results:
+        raise HTTPException(status_code=400, detail="No files in request")
 
     # Update status to indicate documents are waiting but not processed
-    update_document_status(username, "waiting", file_keys)
+    await run_in_threadpool(update_document_status, username, "waiting", file_keys)
 
     return {"files": results}
 
-def process_files(embed_model, file_urls: List[str], username: str):
-    all_splits = []
-
-    print_timestamp("Start processing files")
-
-    # Update status to processing
-    update_document_status(username, "processing")
-
-    try:
-        # --- Choose text splitter ---
-        print_timestamp("Initializing text splitter")
-        # splitter = SemanticChunker(
-        #     embeddings=embed_model,
-        #     breakpoint_threshold_type="percentile",
-        #     breakpoint_threshold_amount=95
-        # )
-
-        splitter = RecursiveCharacterTextSplitter(chunk_size=10000, chunk_overlap=500)
-
-        # --- Load and split documents ---
-        for file_url in file_urls:
-            print_timestamp(f"Loading document: {file_url}")
-            loader = PyPDFLoader(file_url)
-            docs = loader.load()
-
-            print_timestamp(f"Splitting document: {file_url}")
-            splits = splitter.split_documents(docs)
-            # full_text = "\n\n".join([doc.page_content for doc in docs])
-            # big_doc = Document(page_content=full_text)
-
-            # print_timestamp(f"Splitting document: {file_url}")
-            # splits = splitter.split_documents([big_doc])
-
-            file_name = os.path.basename(file_url)
-            for split in splits:
-                split.metadata["source"] = file_name
-                split.metadata["username"] = username
-                all_splits.append(split)
-
-         # --- Index to Elasticsearch ---
-        print_timestamp("Index to Elasticsearch" )
-        index_splits_bm25(username, all_splits),
-
-        # --- Index to Qdrant ---
-        print_timestamp("Indexing to Qdrant")
-
-        vectordb = QdrantVectorStore.from_documents(
-            documents=all_splits,
-            embedding=embed_model,
-            url="https://6fbd9042-2153-49e0-8c5b-d9da2f8d9e60.us-west-2-0.aws.cloud.qdrant.io:6333",
-            api_key=os.environ["Qdrant_api_key"],
-            collection_name=username,
-            force_recreate=True,
-            timeout=30
-
-        )
-
-        print_timestamp("Finished processing files")
-        
-        # Update status to processed
-        update_document_status(username, "processed")
-        
-    except Exception as e:
-        print_timestamp(f"Error processing files: {e}")
-        # Update status to error
-        update_document_status(username, "error")
-
 # Get documents
 @app.get("/api/documents/")
-async def list_documents(user_data: dict = Depends(auth_middleware)):
-    """List all documents for the authenticated user"""
+async def list_documents(limit: int = DOCUMENT_PAGE_SIZE, cursor: Optional[str] = None,
+                         user_data: dict = Depends(auth_middleware)):
+    """List the user's documents from the catalog, newest first.
+
+    Pass `next_cursor` back as `cursor` for the next page; download URLs come
+    from /api/documents/{file_key}/url.
+    """
     bucket_name = "arag"
     username = user_data["username"]
+    limit = max(1, min(limit, DOCUMENT_MAX_PAGE_SIZE))
 
     try:
-        files = aws.list_user_files(bucket_name, username)
-        return {"documents": files}
+        documents, next_cursor = await run_in_threadpool(document_catalog.page, username, limit, cursor)
+        if not documents and cursor is None:
+            # Catalog trống: tài liệu upload trước khi có catalog -> backfill từ S3 một lần
+            files = await run_in_threadpool(aws.list_user_files, bucket_name, username)
+            if files:
+                await run_in_threadpool(sync_catalog, document_catalog, username, files)
+                documents, next_cursor = await run_in_threadpool(document_catalog.page, username, limit)
+        return {"documents": documents, "next_cursor": next_cursor}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail="Failed to list documents")
 
+# Get a download URL for one document (ký URL khi cần, không ký cả danh sách)
+@app.get("/api/documents/{file_key:path}/url")
+async def get_document_url(file_key: str, user_data: dict = Depends(auth_middleware)):
+    bucket_name = "arag"
+    username = user_data["username"]
+
+    if not file_key.startswith(f"{username}/"):
+        raise HTTPException(status_code=403, detail="You can only access your own files")
+    document = await run_in_threadpool(document_catalog.get, username, file_key)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    expiration = 3600
+    return {"key": file_key, "url": aws.get_presigned_url(bucket_name, file_key, expiration), "expires_in": expiration}
+
 # Get document processing status
 @app.get("/api/documents/status")
 async def get_documents_status(user_data: dict = Depends(auth_middleware)):
     """Get the current processing status of documents for the user"""
     username = user_data["username"]
     try:
-        status = get_document_status(username)
+        status = await run_in_threadpool(get_document_status, username)
+        job = await run_in_threadpool(app.state.job_queue.latest_job, username, "process_documents")
+        if job is not None:
+            status["job"] = {"id": job.id, "status": job.status, "attempts": job.attempts, "error": job.error}
         return status
     except Exception as e:
         print(f"Error getting document status: {e}")
@@ -302,32 +273,34 @@ async def get_documents_status(user_data: dict = Depends(auth_middleware)):
 
 # Process documents manually
 @app.post("/api/documents/process")
-async def process_documents(background_tasks: BackgroundTasks, user_data: dict = Depends(auth_middleware)):
+async def process_documents(user_data: dict = Depends(auth_middleware)):
     """Manually trigger document processing"""
     username = user_data["username"]
     bucket_name = "arag"
+    job_queue = app.state.job_queue
     
     try:
-        # Get current status
-        current_status = get_document_status(username)
-        
         # Check if documents are already being processed
-        if current_status.get("status") == "processing":
+        # (queue chỉ chạy một job mỗi user nên không còn race giữa hai request)
+        active = await run_in_threadpool(job_queue.active_job, username, "process_documents")
+        if active is not None and active.status == "running":
             raise HTTPException(status_code=400, detail="Documents are already being processed")
         
-        # Get user's documents
-        files = aws.list_user_files(bucket_name, username)
-        if not files:
+        # Get user's documents (DynamoDB/S3 phân trang -> chạy ngoài event loop)
+        file_keys = await run_in_threadpool(document_catalog.keys, username)
+        if not file_keys:
+            # Lỗi S3 phải thành 500: không enqueue job đối chiếu với danh sách rỗng
+            files = await run_in_threadpool(lambda: list(aws.iter_user_files(bucket_name, username)))
+            await run_in_threadpool(sync_catalog, document_catalog, username, files)
+            file_keys = [file["key"] for file in files]
+        if not file_keys:
             raise HTTPException(status_code=400, detail="No documents to process")
         
-        # Get file URLs for processing
-        file_urls = [file["url"] for file in files]
-        
-        # Start processing in background
-        embed_model = app.state.embed_model
-        background_tasks.add_task(process_files, embed_model, file_urls, username)
+        # Worker process sẽ index (chỉ file mới/thay đổi được index lại)
+        job_id = await run_in_threadpool(job_queue.enqueue, "process_documents", username, {"bucket_name": bucket_name})
+        await run_in_threadpool(update_document_status, username, "processing", file_keys)
         
-        return {"message": "Document processing started"}
+        return {"message": "Document processing started", "job_id": job_id}
         
     except HTTPException:
         raise
@@ -347,15 +320,19 @@ async def delete_document(file_key: str, user_data: dict = Depends(auth_middlewa
         raise HTTPException(status_code=403, detail="You can only delete your own files")
 
     # Check if documents are being processed
-    current_status = get_document_status(username)
+    current_status = await run_in_threadpool(get_document_status, username)
     if current_status.get("status") == "processing":
         raise HTTPException(status_code=400, detail="Cannot delete documents while processing")
 
     try:
-        success = aws.delete_file_from_s3(bucket_name, file_key)
+        success = await run_in_threadpool(aws.delete_file_from_s3, bucket_name, file_key)
         if success:
-            # Update status to indicate documents need processing
-            update_document_status(username, "waiting")
+            await run_in_threadpool(document_catalog.remove, username, file_key)
+            # Chỉ xóa chunk của tài liệu này khỏi Qdrant/ES, không cần index lại;
+            # đi qua queue để không chạy song song với job index của cùng user
+            await run_in_threadpool(app.state.job_queue.enqueue, "deindex_document", username,
+                                    {"file_key": file_key}, coalesce=False)
+            app.state.answer_cache.invalidate(username)
             return {"message": "Document deleted successfully"}
         else:
             raise HTTPException(status_code=500, detail="Failed to delete document")
@@ -391,6 +368,38 @@ class ChatRequestNew(BaseModel):
     conv_id: str
     question: str
 
+async def ensure_conversation(user_id: str, conv_id: str):
+    """Raise 404 unless the conversation exists and belongs to the user"""
+    # boto3 là blocking nên chạy trong threadpool để không chặn event loop
+    response = await run_in_threadpool(
+        conversations_table.get_item,
+        Key={
+            "user_id": user_id,
+            "conv_id": conv_id
+        }
+    )
+
+    if 'Item' not in response:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+
+async def touch_conversation(user_id: str, conv_id: str, question: str):
+    """Cập nhật last_message và updated_at trong conversation"""
+    timestamp = datetime.now(timezone.utc).isoformat()
+    await run_in_threadpool(
+        conversations_table.update_item,
+        Key={
+            "user_id": user_id,
+            "conv_id": conv_id
+        },
+        UpdateExpression="SET last_message = :last_message, updated_at = :updated_at",
+        ExpressionAttributeValues={
+            ":last_message": question[:100] + ("..." if len(question) > 100 else ""),
+            ":updated_at": timestamp
+        }
+    )
+
+
 # send a message
 @app.post("/api/chat/send")
 async def chat_send(req: ChatRequestNew, user_data: dict = Depends(auth_middleware)):
@@ -400,49 +409,16 @@ async def chat_send(req: ChatRequestNew, user_data: dict = Depends(auth_middlewa
         username = user_data["username"]
 
         # Kiểm tra conversation có tồn tại và thuộc về user không
-        response = conversations_table.get_item(
-            Key={
-                "user_id": user_id,
-                "conv_id": req.conv_id
-            }
-        )
+        await ensure_conversation(user_id, req.conv_id)
 
-        if 'Item' not in response:
-            raise HTTPException(status_code=404, detail="Conversation not found")
-
-        embed_model = app.state.embed_model
-        llm = app.state.llm
-        reranker = app.state.reranker
-        rag_chain = create_rag_chain(llm, embed_model,reranker, username)
-        search_chain = create_search_chain(llm)
-        chat_chain = create_chat_chain(llm)
-        router_node = build_router_node(llm)
-
-        full_chain = router_node | RunnableBranch(
-            (lambda state: state["classification"] == "retrieve", rag_chain),
-            (lambda state: state["classification"] == "search", search_chain),
-            (lambda state: state["classification"] == "chitchat", chat_chain),
-            chat_chain  # fallback
-        )
+        full_chain = app.state.chains["full"]
         session_id = f"{user_id}#{req.conv_id}"
 
-        # Gọi chain với session_id
-        config = {"configurable": {"session_id": session_id}}
-        bot_response = full_chain.invoke({"question": req.question}, config=config)
+        # Gọi chain với session_id và username
+        config = {"configurable": {"session_id": session_id, "username": username}}
+        bot_response = await full_chain.ainvoke({"question": req.question}, config=config)
 
-        # Cập nhật last_message và updated_at trong conversation
-        timestamp = datetime.now(timezone.utc).isoformat()
-        conversations_table.update_item(
-            Key={
-                "user_id": user_id,
-                "conv_id": req.conv_id
-            },
-            UpdateExpression="SET last_message = :last_message, updated_at = :updated_at",
-            ExpressionAttributeValues={
-                ":last_message": req.question[:100] + ("..." if len(req.question) > 100 else ""),
-                ":updated_at": timestamp
-            }
-        )
+        await touch_conversation(user_id, req.conv_id, req.question)
 
         return {"response": bot_response}
 
@@ -454,6 +430,80 @@ async def chat_send(req: ChatRequestNew, user_data: dict = Depends(auth_middlewa
         raise HTTPException(status_code=500, detail="Failed to send message")
 
 
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# send a message, streaming the answer as server-sent events
+@app.post("/api/chat/stream")
+async def chat_stream(req: ChatRequestNew, user_data: dict = Depends(auth_middleware)):
+    """Stream the answer token by token.
+
+    Events: "meta" (routing label + sources), then "token" chunks, then
+    "done"; "error" replaces the rest if generation fails midway.
+    """
+    user_id = user_data["user_id"]
+    username = user_data["username"]
+
+    await ensure_conversation(user_id, req.conv_id)
+
+    chains = app.state.chains
+    session_id = f"{user_id}#{req.conv_id}"
+    config = {"configurable": {"session_id": session_id, "username": username}}
+
+    async def event_stream():
+        try:
+            state = await chains["router"].ainvoke({"question": req.question}, config=config)
+            label = state["classification"]
+            history = chains["history"](session_id)
+            messages = await history.aget_messages()
+
+            answer_cache = chains["answer_cache"] if label == "retrieve" else None
+            cached = None
+            if answer_cache is not None:
+                embedding = state.get("question_embedding")
+                if embedding is None:
+                    embedding = await app.state.embed_model.aembed_query(req.question)
+                with span("answer_cache.lookup"):
+                    cached = answer_cache.lookup(username, embedding)
+
+            answer = []
+            if cached is not None:
+                yield sse_event("meta", {"classification": label, "sources": cached.sources, "cached": True})
+                answer.append(cached.answer)
+                yield sse_event("token", {"text": cached.answer})
+            else:
+                inputs = await chains["contexts"][label].ainvoke(
+                    {"question": req.question, "history": messages}, config=config
+                )
+                meta = {"classification": label, "sources": inputs.get("sources", []), "cached": False}
+                if "context_stats" in inputs:
+                    meta["context"] = inputs["context_stats"]
+                yield sse_event("meta", meta)
+
+                async for token in chains["answers"][label].astream(inputs, config=config):
+                    answer.append(token)
+                    yield sse_event("token", {"text": token})
+
+                if answer_cache is not None:
+                    answer_cache.store(username, embedding, req.question, "".join(answer), inputs.get("sources", []))
+
+            # Lưu lịch sử sau khi stream xong, giống RunnableWithMessageHistory
+            await history.aadd_messages([HumanMessage(content=req.question), AIMessage(content="".join(answer))])
+            await touch_conversation(user_id, req.conv_id, req.question)
+            yield sse_event("done", {})
+        except Exception as e:
+            print("Error in chat_stream:", str(e))
+            traceback.print_exc()
+            yield sse_event("error", {"detail": "Failed to send message"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 oauth = OAuth()
 oauth.register(
     name='oidc',
@@ -470,6 +520,25 @@ async def get_current_user(user_data: dict = Depends(auth_middleware)):
     return user_data
 
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """In-process counters for caches, routing, reranking and prompt sizes"""
+    prototype_router = app.state.chains["prototype_router"]
+    return {
+        "answer_cache": app.state.answer_cache.stats(),
+        "router": prototype_router.stats() if prototype_router is not None else None,
+        "reranker": app.state.reranker.stats() if app.state.reranker is not None else None,
+        "context": app.state.chains["context_packer"].stats(),
+        "stages": span_registry.stats(),
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Per-stage latency histograms in the Prometheus text format"""
+    return PlainTextResponse(span_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # Conversation Management APIs
 @app.get("/api/conversations")
 async def get_conversations(user_data: dict = Depends(auth_middleware)):
@@ -477,7 +546,8 @@ async def get_conversations(user_data: dict = Depends(auth_middleware)):
     try:
         user_id = user_data["user_id"]
 
-        response = conversations_table.query(
+        response = await run_in_threadpool(
+            conversations_table.query,
             KeyConditionExpression=Key('user_id').eq(user_id),
             ScanIndexForward=False  # Sắp xếp theo timestamp mới nhất
         )
@@ -517,10 +587,10 @@ async def create_conversation(
             "name": final_name,
             "created_at": timestamp,
             "updated_at": timestamp,
-            "history": ""
+            "message_count": 0
         }
 
-        conversations_table.put_item(Item=conversation_item)
+        await run_in_threadpool(conversations_table.put_item, Item=conversation_item)
 
         return {
             "conv_id": conv_id,
@@ -546,7 +616,8 @@ async def update_conversation(
         timestamp = datetime.now(timezone.utc).isoformat()
 
         # Kiểm tra conversation có tồn tại và thuộc về user không
-        response = conversations_table.get_item(
+        response = await run_in_threadpool(
+            conversations_table.get_item,
             Key={
                 "user_id": user_id,
                 "conv_id": conv_id
@@ -557,7 +628,8 @@ async def update_conversation(
             raise HTTPException(status_code=404, detail="Conversation not found")
 
         # Cập nhật conversation
-        conversations_table.update_item(
+        await run_in_threadpool(
+            conversations_table.update_item,
             Key={
                 "user_id": user_id,
                 "conv_id": conv_id
@@ -591,7 +663,8 @@ async def delete_conversation(
         user_id = user_data["user_id"]
 
         # Kiểm tra conversation có tồn tại và thuộc về user không
-        response = conversations_table.get_item(
+        response = await run_in_threadpool(
+            conversations_table.get_item,
             Key={
                 "user_id": user_id,
                 "conv_id": conv_id
@@ -601,8 +674,10 @@ async def delete_conversation(
         if 'Item' not in response:
             raise HTTPException(status_code=404, detail="Conversation not found")
 
-        # Xóa conversation
-        conversations_table.delete_item(
+        # Xóa các message trước, rồi tới conversation
+        await run_in_threadpool(conversation_store.delete, user_id, conv_id)
+        await run_in_threadpool(
+            conversations_table.delete_item,
             Key={
                 "user_id": user_id,
                 "conv_id": conv_id
@@ -619,12 +694,19 @@ async def delete_conversation(
 
 
 @app.get("/api/conversations/{conv_id}/history")
-async def get_conversation_history(conv_id: str, user_data: dict = Depends(auth_middleware)):
-    """Return normalized message history for a specific conversation"""
+async def get_conversation_history(conv_id: str, limit: int = 50, before: Optional[int] = None,
+                                   user_data: dict = Depends(auth_middleware)):
+    """Return one page of messages of a conversation, oldest first.
+
+    Pages go backwards in time: pass `next_before` from the response as
+    `before` to load older messages.
+    """
     try:
         user_id = user_data["user_id"]
+        limit = max(1, min(limit, 200))
 
-        response = conversations_table.get_item(
+        response = await run_in_threadpool(
+            conversations_table.get_item,
             Key={
                 "user_id": user_id,
                 "conv_id": conv_id
@@ -634,36 +716,27 @@ async def get_conversation_history(conv_id: str, user_data: dict = Depends(auth_
         if 'Item' not in response:
             raise HTTPException(status_code=404, detail="Conversation not found")
 
-        item = response['Item']
-        raw_history = item.get("history", []) or []
-
-        messages = []
-        # Normalize LangChain DynamoDBChatMessageHistory format to frontend shape
-        for index, entry in enumerate(raw_history):
-            try:
-                # Support multiple possible shapes
-                if isinstance(entry, dict):
-                    entry_type = entry.get("type") or entry.get("role") or ""
-                    data = entry.get("data") or {}
-                    content = data.get("content") or entry.get("content") or ""
-                else:
-                    # Fallback if stored as plain string
-                    entry_type = "ai"
-                    content = str(entry)
-
-                sender = "user" if entry_type in ("human", "user") else "bot"
-                messages.append({
-                    "id": f"{index}",
-                    "content": content,
-                    "sender": sender,
-                    # Timestamps are not stored per-message in this history; use conversation timestamps if needed
-                    "timestamp": item.get("updated_at") or item.get("created_at") or datetime.now(timezone.utc).isoformat(),
-                })
-            except Exception:
-                # Skip malformed entries but continue
-                continue
-
-        return {"conv_id": conv_id, "messages": messages}
+        # Conversation cũ (history nằm trong một item) được chuyển sang message items lần đầu đọc
+        await run_in_threadpool(conversation_store.migrate_legacy, user_id, conv_id, response['Item'])
+        items = await run_in_threadpool(conversation_store.page, user_id, conv_id, limit, before)
+
+        messages = [
+            {
+                "id": str(item["seq"]),
+                "content": item.get("content", ""),
+                "sender": "user" if item.get("type") == "human" else "bot",
+                "timestamp": item.get("created_at", ""),
+            }
+            for item in reversed(items)
+        ]
+        oldest = int(items[-1]["seq"]) if items else None
+
+        return {
+            "conv_id": conv_id,
+            "messages": messages,
+            "has_more": oldest is not None and oldest > 1,
+            "next_before": oldest if oldest is not None and oldest > 1 else None,
+        }
 
     except HTTPException:
         raise
@@ -675,8 +748,15 @@ region = os.getenv("AWS_REGION_NAME")
 cognito_client = boto3.client("cognito-idp", region_name=region)
 dynamodb = boto3.resource('dynamodb', region_name=region)
 conversations_table = dynamodb.Table('Conversations')
+conversation_store = ConversationStore(conversations_table=conversations_table)
 
 USER_POOL_ID = "ap-southeast-1_XpQcyxaue"
+COGNITO_ISSUER = f"https://cognito-idp.{USER_POOL_ID.split('_')[0]}.amazonaws.com/{USER_POOL_ID}"
+
+authenticator = TokenAuthenticator(
+    CognitoTokenVerifier(COGNITO_ISSUER, client_id=os.getenv("AWS_CLIENT_ID")),
+    fetch_user=get_cognito_user,
+)
 
 
 class RegisterRequest(BaseModel):
@@ -772,26 +852,11 @@ async def login_user(request: LoginRequest):
         access_token = response['AuthenticationResult']['AccessToken']
         refresh_token = response['AuthenticationResult']['RefreshToken']
 
-        user_data = cognito_client.get_user(
-            AccessToken=access_token
-        )
-        email = ""
-        user_id = ""
-        username = user_data["Username"]
-
-        for attr in user_data["UserAttributes"]:
-            if attr["Name"] == "email":
-                email = attr["Value"]
-            elif attr["Name"] == "sub":
-                user_id = attr["Value"]
+        user = get_cognito_user(access_token)
 
         return {
             "status": "success",
-            "user": {
-                "user_id": user_id,
-                "email": email,
-                "username": username
-            },
+            "user": user,
             "access_token": access_token,
             "refresh_token": refresh_token
         }
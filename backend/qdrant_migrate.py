@@ -0,0 +1,92 @@
+"""Copy per-user Qdrant collections into the shared multi-tenant collection.
+
+    cd backend && python qdrant_migrate.py --all
+    cd backend && python qdrant_migrate.py alice bob --delete-source
+
+Points keep their IDs, vectors and payload; metadata.username is set to the
+source collection's name. Re-running is safe (upserts by ID). A source
+collection is deleted only with --delete-source and only once the shared
+collection holds at least as many points for that user. Switch the app to
+QDRANT_TENANCY=shared after the migration.
+"""
+import argparse
+
+from qdrant_client import models
+
+from clients import get_qdrant_client
+from dense import QDRANT_SHARED_COLLECTION, USERNAME_FIELD, create_shared_collection
+from util import print_timestamp
+
+
+def _vector_size(client, collection_name: str) -> int:
+    vectors = client.get_collection(collection_name).config.params.vectors
+    if not isinstance(vectors, models.VectorParams):
+        raise ValueError(f"{collection_name} uses named vectors, expected a single unnamed vector")
+    return vectors.size
+
+
+def migrate_collection(client, username: str, target: str = QDRANT_SHARED_COLLECTION, batch_size: int = 256,
+                       delete_source: bool = False) -> int:
+    """Copy one user's collection into `target`; returns the number of points copied"""
+    dim = _vector_size(client, username)
+    if client.collection_exists(target) and _vector_size(client, target) != dim:
+        raise ValueError(f"{username} has {dim}-d vectors, {target} has {_vector_size(client, target)}-d")
+    create_shared_collection(client, dim, target)
+
+    copied, offset = 0, None
+    while True:
+        points, offset = client.scroll(username, limit=batch_size, offset=offset, with_payload=True,
+                                       with_vectors=True)
+        if points:
+            client.upsert(target, points=[
+                models.PointStruct(
+                    id=point.id,
+                    vector=point.vector,
+                    payload={**point.payload, "metadata": {**(point.payload or {}).get("metadata", {}),
+                                                           "username": username}}
+                )
+                for point in points
+            ])
+            copied += len(points)
+        if offset is None:
+            break
+
+    tenant = models.Filter(must=[models.FieldCondition(key=USERNAME_FIELD, match=models.MatchValue(value=username))])
+    migrated = client.count(target, count_filter=tenant, exact=True).count
+    source = client.count(username, exact=True).count
+    print_timestamp(f"{username}: copied {copied} points, {migrated}/{source} in {target}")
+    if delete_source:
+        if migrated < source:
+            raise RuntimeError(f"{username}: only {migrated}/{source} points in {target}, keeping the source")
+        client.delete_collection(username)
+    return copied
+
+
+def main(args):
+    client = get_qdrant_client()
+    usernames = args.usernames
+    if args.all:
+        usernames = [c.name for c in client.get_collections().collections if c.name != args.target]
+    if not usernames:
+        raise SystemExit("Nothing to migrate: pass usernames or --all")
+
+    failed = []
+    for username in usernames:
+        try:
+            migrate_collection(client, username, args.target, args.batch_size, args.delete_source)
+        except Exception as e:
+            print_timestamp(f"❌ {username}: {e}")
+            failed.append(username)
+    print_timestamp(f"Migrated {len(usernames) - len(failed)}/{len(usernames)} collections into {args.target}")
+    if failed:
+        raise SystemExit(f"Failed: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("usernames", nargs="*", help="collections (usernames) to migrate")
+    parser.add_argument("--all", action="store_true", help="every collection except the target")
+    parser.add_argument("--target", default=QDRANT_SHARED_COLLECTION)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--delete-source", action="store_true", help="drop each source collection once verified")
+    main(parser.parse_args())
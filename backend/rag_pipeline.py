@@ -1,63 +1,163 @@
 # ==== Imports ====
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
 from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.runnables import RunnableMap, RunnablePassthrough, RunnableLambda, RunnableConfig
+from langchain_core.runnables import RunnableMap, RunnablePassthrough, RunnableLambda, RunnableConfig, RunnableBranch
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.callbacks import BaseCallbackHandler
 
 from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain_community.chat_message_histories import DynamoDBChatMessageHistory
 from langchain_tavily import TavilySearch
 
-from elastic_search import bm25_search
+from sparse import bm25_search
 from util import print_timestamp
+from telemetry import span, record, in_context
 # ==== Custom Retrieval Functions ====
-from hyde import get_hypo_doc  # HyDE: sinh câu hỏi giả định
+from hyde import get_hypo_doc, aget_hypo_doc  # HyDE: sinh câu hỏi giả định
 from dense import find_similarity  # Tìm kiếm dense (vector)
 
-from fusion import rrf_fusion  # Fusion hai kết quả
+from fusion import fuse, FUSION_METHOD  # Fusion hai kết quả
+from main import build_router_node, PrototypeRouter, ROUTER_MODE
+from context_packer import ContextPacker, history_tokens
+from chat_history import WindowedChatHistory, HistorySummarizer
+
+
 
 
+# Mỗi nhánh retrieval có timeout riêng; nhánh nào quá hạn/lỗi thì bị bỏ qua
+# và chỉ fuse các nhánh còn lại (vd. HyDE chậm -> chỉ dùng kết quả BM25).
+DENSE_TIMEOUT = float(os.getenv("RETRIEVE_DENSE_TIMEOUT", "10"))
+SPARSE_TIMEOUT = float(os.getenv("RETRIEVE_SPARSE_TIMEOUT", "5"))
 
+_retrieval_pool = ThreadPoolExecutor(max_workers=int(os.getenv("RETRIEVE_POOL_SIZE", "16")))
 
-def retrieve(query: str, llm, embed_model, username: str) -> list[Document]:
+
+def _dense_branch(query: str, llm, embed_model, username: str) -> list[Document]:
     print_timestamp("🧠 [HyDE] Generating hypothetical document...")
-    hypo_doc = get_hypo_doc(query, llm)
+    with span("hyde"):
+        hypo_doc = get_hypo_doc(query, llm)
     print("📄 Hypothetical Document:\n", hypo_doc)
 
     print_timestamp("📍 [Embed] Embedding hypo_doc and finding dense similarity...")
-    hypo_emb = embed_model.embed_query(hypo_doc)
-    dense_results = find_similarity(hypo_emb, k=10, embed_model=embed_model, username=username)
-    print(f"🔎 Dense results: {[doc.metadata.get('source', '') for doc in dense_results]}")
+    with span("embed"):
+        hypo_emb = embed_model.embed_query(hypo_doc)
+    with span("dense_search") as attrs:
+        results = find_similarity(hypo_emb, k=10, embed_model=embed_model, username=username)
+        attrs["hits"] = len(results)
+    return results
+
 
+async def _adense_branch(query: str, llm, embed_model, username: str) -> list[Document]:
+    print_timestamp("🧠 [HyDE] Generating hypothetical document...")
+    with span("hyde"):
+        hypo_doc = await aget_hypo_doc(query, llm)
+
+    print_timestamp("📍 [Embed] Embedding hypo_doc and finding dense similarity...")
+    with span("embed"):
+        hypo_emb = await embed_model.aembed_query(hypo_doc)
+    with span("dense_search") as attrs:
+        results = await asyncio.to_thread(find_similarity, hypo_emb, 10, embed_model, username)
+        attrs["hits"] = len(results)
+    return results
+
+
+def _sparse_branch(query: str, username: str) -> list[Document]:
     print_timestamp("🔍 Lexical search...")
-    sparse_results = bm25_search(username,query)
+    with span("bm25") as attrs:
+        results = bm25_search(username, query)
+        attrs["hits"] = len(results)
+    return results
+
+
+def _branch_failed(name: str, error: BaseException, timeout: float) -> list[Document]:
+    if isinstance(error, (asyncio.TimeoutError, FutureTimeoutError)):
+        print_timestamp(f"⚠️ [{name}] timed out after {timeout}s, fusing without it")
+    else:
+        print_timestamp(f"⚠️ [{name}] failed, fusing without it: {error!r}")
+    return []
+
+
+def _fuse(dense_results: list[Document], sparse_results: list[Document], limit: int = 10) -> list[Document]:
+    print(f"🔎 Dense results: {[doc.metadata.get('source', '') for doc in dense_results]}")
     print(f"🧾 Sparse results: {[doc.metadata.get('source', '') for doc in sparse_results]}")
 
-    print_timestamp("🔗 [Fusion] RRF Fusion of dense + sparse...")
-    combined_results = rrf_fusion([dense_results,sparse_results])
+    print_timestamp(f"🔗 [Fusion] {FUSION_METHOD} fusion of dense + sparse...")
+    combined_results = []
+    with span("fusion", method=FUSION_METHOD):
+        for doc, score in fuse([dense_results, sparse_results], limit=limit):
+            # Reranker dùng điểm fusion để quyết định có cần rerank hay không
+            doc.metadata["fusion_score"] = score
+            combined_results.append(doc)
     print("✅ Top 5 after fusion:")
     for i, doc in enumerate(combined_results[:5]):
         print(f"  {i + 1}.- {doc.page_content}...")
 
-    return combined_results[:10]
+    return combined_results
+
+
+def retrieve(query: str, llm, embed_model, username: str, limit: int = 10) -> list[Document]:
+    """Run the dense (HyDE -> embed -> Qdrant) and BM25 branches in parallel and fuse them."""
+    started = time.monotonic()
+    # in_context: span trong thread của pool vẫn mang request_id/user
+    dense_future = _retrieval_pool.submit(in_context(_dense_branch), query, llm, embed_model, username)
+    sparse_future = _retrieval_pool.submit(in_context(_sparse_branch), query, username)
+
+    results = []
+    for name, future, timeout in (("Dense", dense_future, DENSE_TIMEOUT), ("BM25", sparse_future, SPARSE_TIMEOUT)):
+        try:
+            # timeout tính từ lúc fan-out, không cộng dồn giữa các nhánh
+            results.append(future.result(timeout=max(0.0, started + timeout - time.monotonic())))
+        except Exception as e:
+            future.cancel()
+            results.append(_branch_failed(name, e, timeout))
+
+    return _fuse(*results, limit=limit)
+
+
+async def _abranch(name: str, coro, timeout: float) -> list[Document]:
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except Exception as e:
+        return _branch_failed(name, e, timeout)
+
+
+async def aretrieve(query: str, llm, embed_model, username: str, limit: int = 10) -> list[Document]:
+    """Async version of retrieve: both branches run concurrently on the event loop."""
+    dense_results, sparse_results = await asyncio.gather(
+        _abranch("Dense", _adense_branch(query, llm, embed_model, username), DENSE_TIMEOUT),
+        _abranch("BM25", asyncio.to_thread(_sparse_branch, query, username), SPARSE_TIMEOUT),
+    )
+    return _fuse(dense_results, sparse_results, limit=limit)
 
 
 # ==== Chains ====
-def create_rag_chain(llm, embed_model, reranker, username):
-    def _retrieve(inputs: dict) -> dict:
-        query = inputs["question"]
-        docs = retrieve(query, llm, embed_model, username)
-        # print("⚖️ [Reranker] Re-ranking fused results...")
-        # reranked_docs = reranker.compress_documents(docs,query)
+# Mỗi nhánh gồm 2 bước: "context" (retrieve/search, trả về context + sources)
+# và "answer" (prompt | llm). Endpoint streaming gọi riêng từng bước.
+def _context_inputs(inputs: dict, context: str, sources: list, context_stats: dict = None) -> dict:
+    result = {
+        "context": context,
+        "sources": sources,
+        "question": inputs["question"],
+        "history": inputs.get("history", [])
+    }
+    if context_stats is not None:
+        result["context_stats"] = context_stats
+    return result
+
 
-        return {
-            "context": "\n\n".join(doc.page_content for doc in docs),
-            "question": query,
-            "history": inputs.get("history", [])
-        }
+def _doc_sources(docs: list[Document]) -> list[dict]:
+    return [
+        {"source": doc.metadata.get("source", ""), "page": doc.metadata.get("page")}
+        for doc in docs
+    ]
 
-    chain = RunnableLambda(_retrieve) | rag_prompt | llm | StrOutputParser()
+
+def _with_history(chain):
     return RunnableWithMessageHistory(
         chain,
         get_session_history=get_history_session,
@@ -66,40 +166,223 @@ def create_rag_chain(llm, embed_model, reranker, username):
     )
 
 
-search_tool = TavilySearch(max_results=3)
+class LLMSpanHandler(BaseCallbackHandler):
+    """Records `stage` (whole generation) and `stage`.first_token spans for every LLM call"""
+    # Chạy ngay trong event loop/thread gọi LLM, không qua executor
+    run_inline = True
 
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._runs = {}
 
-def create_search_chain(llm):
-    def search_with_tavily(inputs: dict):
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._runs[run_id] = [time.perf_counter(), False]
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._runs[run_id] = [time.perf_counter(), False]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None and not run[1]:
+            run[1] = True
+            record(f"{self.stage}.first_token", (time.perf_counter() - run[0]) * 1000)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            record(self.stage, (time.perf_counter() - run[0]) * 1000)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            record(self.stage, (time.perf_counter() - run[0]) * 1000, type(error).__name__)
+
+
+_generation_spans = LLMSpanHandler("llm.generate")
+
+
+def create_answer_chain(prompt, llm):
+    return prompt | llm.with_config(callbacks=[_generation_spans]) | StrOutputParser()
+
+
+def create_rag_context(llm, embed_model, reranker, packer=None):
+    """Retrieve -> fuse -> (optional) cross-encoder rerank -> pack into the token budget.
+
+    `reranker` and `packer` may be None (then the chunks are joined as is).
+    """
+    # Có reranker thì lấy nhiều ứng viên hơn rồi để reranker chọn top_n
+    limit = reranker.candidates if reranker is not None else 10
+
+    def _build(inputs: dict, docs: list[Document]) -> dict:
+        if packer is None:
+            return _context_inputs(inputs, "\n\n".join(doc.page_content for doc in docs), _doc_sources(docs))
+        context, used_docs, report = packer.pack(inputs["question"], docs, history_tokens(inputs.get("history")))
+        return _context_inputs(inputs, context, _doc_sources(used_docs), report)
+
+    def _retrieve(inputs: dict, config: RunnableConfig) -> dict:
         query = inputs["question"]
-        docs = search_tool.invoke(query)
-        context = "\n\n".join(
-            doc["content"] for doc in docs["results"] if doc.get("content")
-        )
-        return {
-            "context": context,
-            "question": query,
-            "history": inputs.get("history", [])
-        }
+        # username đi theo config của từng request, chain được dùng chung cho mọi user
+        username = config["configurable"]["username"]
+        docs = retrieve(query, llm, embed_model, username, limit)
+        if reranker is not None:
+            with span("rerank"):
+                docs = reranker.rerank(query, docs)
+        with span("context_pack"):
+            return _build(inputs, docs)
 
-    chain = RunnableLambda(search_with_tavily) | search_prompt | llm | StrOutputParser()
-    return RunnableWithMessageHistory(
-        chain,
-        get_session_history=get_history_session,
-        input_messages_key="question",
-        history_messages_key="history"
+    async def _aretrieve(inputs: dict, config: RunnableConfig) -> dict:
+        query = inputs["question"]
+        username = config["configurable"]["username"]
+        docs = await aretrieve(query, llm, embed_model, username, limit)
+        if reranker is not None:
+            # Cross-encoder chạy CPU -> không chặn event loop
+            with span("rerank"):
+                docs = await asyncio.to_thread(reranker.rerank, query, docs)
+        with span("context_pack"):
+            return _build(inputs, docs)
+
+    return RunnableLambda(_retrieve, afunc=_aretrieve)
+
+
+def create_cached_rag_answer(context, answer, embed_model, answer_cache):
+    """Serve near-duplicate questions from answer_cache, otherwise retrieve + generate and store."""
+    def _answer(inputs: dict, config: RunnableConfig) -> str:
+        username = config["configurable"]["username"]
+        # `is None`: embedding có thể là ndarray (truth value không xác định)
+        embedding = inputs.get("question_embedding")
+        if embedding is None:
+            embedding = embed_model.embed_query(inputs["question"])
+        with span("answer_cache.lookup"):
+            hit = answer_cache.lookup(username, embedding)
+        if hit is not None:
+            print_timestamp(f"♻️ [Cache] Semantic cache hit ({hit.score:.3f}): {hit.question}")
+            return hit.answer
+
+        context_inputs = context.invoke(inputs, config)
+        text = answer.invoke(context_inputs, config)
+        answer_cache.store(username, embedding, inputs["question"], text, context_inputs["sources"])
+        return text
+
+    async def _aanswer(inputs: dict, config: RunnableConfig) -> str:
+        username = config["configurable"]["username"]
+        embedding = inputs.get("question_embedding")
+        if embedding is None:
+            embedding = await embed_model.aembed_query(inputs["question"])
+        with span("answer_cache.lookup"):
+            hit = answer_cache.lookup(username, embedding)
+        if hit is not None:
+            print_timestamp(f"♻️ [Cache] Semantic cache hit ({hit.score:.3f}): {hit.question}")
+            return hit.answer
+
+        context_inputs = await context.ainvoke(inputs, config)
+        text = await answer.ainvoke(context_inputs, config)
+        answer_cache.store(username, embedding, inputs["question"], text, context_inputs["sources"])
+        return text
+
+    return RunnableLambda(_answer, afunc=_aanswer)
+
+
+def create_rag_chain(llm, embed_model, reranker, packer=None):
+    return _with_history(create_rag_context(llm, embed_model, reranker, packer) | create_answer_chain(rag_prompt, llm))
+
+
+search_tool = TavilySearch(max_results=3)
+
+
+def _web_context(docs: dict) -> str:
+    return "\n\n".join(
+        doc["content"] for doc in docs["results"] if doc.get("content")
     )
 
 
+def _web_sources(docs: dict) -> list[dict]:
+    return [
+        {"source": doc.get("url", ""), "title": doc.get("title", "")}
+        for doc in docs["results"]
+    ]
+
+
+def create_search_context():
+    def search_with_tavily(inputs: dict):
+        with span("web_search"):
+            docs = search_tool.invoke(inputs["question"])
+        return _context_inputs(inputs, _web_context(docs), _web_sources(docs))
+
+    async def asearch_with_tavily(inputs: dict):
+        with span("web_search"):
+            docs = await search_tool.ainvoke(inputs["question"])
+        return _context_inputs(inputs, _web_context(docs), _web_sources(docs))
+
+    return RunnableLambda(search_with_tavily, afunc=asearch_with_tavily)
+
+
+def create_search_chain(llm):
+    return _with_history(create_search_context() | create_answer_chain(search_prompt, llm))
+
+
+def create_chat_context():
+    return RunnableLambda(lambda inputs: _context_inputs(inputs, "", []))
+
+
 def create_chat_chain(llm):
-    chain = chat_prompt | llm | StrOutputParser()
-    return RunnableWithMessageHistory(
-        chain,
-        get_session_history=get_history_session,
-        input_messages_key="question",
-        history_messages_key="history"
+    return _with_history(create_answer_chain(chat_prompt, llm))
+
+
+def build_chain_registry(llm, embed_model, reranker, answer_cache=None) -> dict:
+    """Build every chain once at startup.
+
+    Per-request values (session_id, username) are passed through
+    config["configurable"], so one graph serves every user and conversation.
+    With an answer_cache the RAG branch first looks for a near-duplicate question.
+    """
+    global history_summarizer
+    history_summarizer = HistorySummarizer(llm)
+
+    # Context của nhánh RAG được gói vừa ngân sách token thay vì nối nguyên các chunk
+    context_packer = ContextPacker()
+    contexts = {
+        "retrieve": create_rag_context(llm, embed_model, reranker, context_packer),
+        "search": create_search_context(),
+        "chitchat": create_chat_context(),
+    }
+    answers = {
+        "retrieve": create_answer_chain(rag_prompt, llm),
+        "search": create_answer_chain(search_prompt, llm),
+        "chitchat": create_answer_chain(chat_prompt, llm),
+    }
+    if answer_cache is not None:
+        rag_chain = _with_history(
+            create_cached_rag_answer(contexts["retrieve"], answers["retrieve"], embed_model, answer_cache)
+        )
+    else:
+        rag_chain = _with_history(contexts["retrieve"] | answers["retrieve"])
+    search_chain = _with_history(contexts["search"] | answers["search"])
+    chat_chain = _with_history(answers["chitchat"])
+    # Router local (embedding + centroid), chỉ gọi LLM khi không đủ tự tin
+    prototype_router = PrototypeRouter(embed_model) if ROUTER_MODE == "local" else None
+    router_node = build_router_node(llm, prototype_router)
+
+    full_chain = router_node | RunnableBranch(
+        (lambda state: state["classification"] == "retrieve", rag_chain),
+        (lambda state: state["classification"] == "search", search_chain),
+        (lambda state: state["classification"] == "chitchat", chat_chain),
+        chat_chain  # fallback
     )
 
+    return {
+        "router": router_node,
+        "prototype_router": prototype_router,
+        "contexts": contexts,
+        "answers": answers,
+        "history": get_history_session,
+        "answer_cache": answer_cache,
+        "context_packer": context_packer,
+        "retrieve": rag_chain,
+        "search": search_chain,
+        "chitchat": chat_chain,
+        "full": full_chain,
+    }
+
 
 # ==== Prompt Template ====
 rag_prompt = ChatPromptTemplate.from_messages([
@@ -149,17 +432,13 @@ Bạn là một chatbot thân thiện, lịch sự, trả lời ngắn gọn, r
 ])
 
 
+# Summarizer dùng chung, được tạo trong build_chain_registry (cần llm)
+history_summarizer = None
+
+
 def get_history_session(session_id: str):
     # Ghép session_id từ user_id#conv_id hoặc tách ra
     user_id, conv_id = session_id.split("#", 1)
 
-    return DynamoDBChatMessageHistory(
-        table_name="Conversations",
-        session_id=session_id,
-        primary_key_name="user_id",
-        key={
-            "user_id": user_id,
-            "conv_id": conv_id,
-        },
-        history_messages_key="history"
-    )
+    # Tóm tắt cuộn + cửa sổ message gần nhất, mỗi message là một item DynamoDB
+    return WindowedChatHistory(user_id, conv_id, summarizer=history_summarizer)
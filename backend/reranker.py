@@ -0,0 +1,178 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List
+
+from langchain_core.documents import Document
+
+from util import print_timestamp
+
+# ==== Cross-encoder reranking ====
+# Rerank các ứng viên sau RRF fusion bằng bge-reranker:
+# - chấm điểm theo batch; chunk dài được chia thành các cửa sổ RERANK_MAX_TOKENS,
+#   chấm RERANK_WINDOWS cửa sổ khớp từ khóa nhất, điểm của chunk = max
+# - cache điểm (query, passage) -> câu hỏi lặp lại không phải chấm lại
+# - bỏ qua rerank khi điểm fusion đã tách biệt rõ top_n với phần còn lại
+# - dừng sớm khi vượt ngân sách latency, phần chưa chấm giữ thứ tự fusion
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "5"))
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "8"))
+RERANK_MAX_TOKENS = int(os.getenv("RERANK_MAX_TOKENS", "320"))
+# Cắt trước theo ký tự để tokenizer không phải xử lý cả chunk 10k ký tự
+RERANK_CHARS_PER_TOKEN = int(os.getenv("RERANK_CHARS_PER_TOKEN", "4"))
+# Số cửa sổ mỗi chunk được đưa vào cross-encoder (chọn theo độ khớp từ khóa)
+RERANK_WINDOWS = int(os.getenv("RERANK_WINDOWS", "2"))
+RERANK_SKIP_MARGIN = float(os.getenv("RERANK_SKIP_MARGIN", "0.25"))
+RERANK_LATENCY_BUDGET_MS = float(os.getenv("RERANK_LATENCY_BUDGET_MS", "800"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+class Reranker(object):
+    """Reranks fused candidates (expects metadata["fusion_score"]) with a cross-encoder.
+
+    `cross_encoder` is anything with score(pairs) -> scores, e.g. the
+    HuggingFaceCrossEncoder returned by load_cross_encoder.
+    """
+
+    def __init__(self, cross_encoder, top_n=RERANK_TOP_N, candidates=RERANK_CANDIDATES,
+                 batch_size=RERANK_BATCH_SIZE, max_tokens=RERANK_MAX_TOKENS, skip_margin=RERANK_SKIP_MARGIN,
+                 latency_budget_ms=RERANK_LATENCY_BUDGET_MS, cache_size=RERANK_CACHE_SIZE,
+                 windows=RERANK_WINDOWS):
+        self.cross_encoder = cross_encoder
+        self.top_n = top_n
+        self.candidates = candidates
+        self.batch_size = batch_size
+        self.max_chars = max_tokens * RERANK_CHARS_PER_TOKEN
+        self.windows = max(1, windows)
+        self.skip_margin = skip_margin
+        self.latency_budget = latency_budget_ms / 1000
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.skipped = 0
+        self.truncated = 0
+        self.pairs_scored = 0
+        self.cache_hits = 0
+        self.budget_exceeded = 0
+
+        # Tokenizer cắt cặp (query, passage) ở max_tokens
+        client = getattr(cross_encoder, "client", None)
+        if client is not None and hasattr(client, "max_length"):
+            client.max_length = max_tokens
+
+    @staticmethod
+    def _key(query: str, passage: str) -> str:
+        return hashlib.sha1(f"{query}\x00{passage}".encode("utf-8")).hexdigest()
+
+    def _cached(self, key: str):
+        with self._lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _remember(self, keys: List[str], scores: List[float]):
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._cache[key] = score
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _count(self, **increments):
+        # rerank chạy trong thread pool: cộng counter dưới lock
+        with self._lock:
+            for name, value in increments.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def passage_windows(self, query: str, text: str) -> List[str]:
+        """Up to `windows` overlapping max_chars windows of `text` that share the most words with `query`"""
+        if len(text) <= self.max_chars:
+            return [text]
+        stride = self.max_chars * 3 // 4
+        starts = list(range(0, len(text) - self.max_chars, stride)) + [len(text) - self.max_chars]
+        windows = [text[start:start + self.max_chars] for start in starts]
+        terms = set(_WORD.findall(query.lower()))
+        overlap = [len(terms & set(_WORD.findall(window.lower()))) for window in windows]
+        # Hòa thì ưu tiên cửa sổ đứng trước (tiêu đề, mở đầu của chunk)
+        best = sorted(range(len(windows)), key=lambda i: (-overlap[i], i))[:self.windows]
+        return [windows[i] for i in sorted(best)]
+
+    def well_separated(self, docs: List[Document]) -> bool:
+        """True if the fused top_n already beats the rest by `skip_margin` (relative to the best score)"""
+        if len(docs) <= self.top_n:
+            return True
+        scores = [doc.metadata.get("fusion_score") for doc in docs[:self.top_n + 1]]
+        if any(score is None for score in scores) or scores[0] <= 0:
+            return False
+        return (scores[self.top_n - 1] - scores[self.top_n]) / scores[0] >= self.skip_margin
+
+    def rerank(self, query: str, docs: List[Document]) -> List[Document]:
+        """Top `top_n` of `docs` (in fused order) by cross-encoder score (max over each doc's windows)"""
+        docs = docs[:self.candidates]
+        if self.well_separated(docs):
+            self._count(calls=1, skipped=1)
+            return docs[:self.top_n]
+
+        started = time.perf_counter()
+        # pairs: (doc index, window); thứ tự fusion giữ nguyên
+        pairs = [(d, window) for d, doc in enumerate(docs) for window in self.passage_windows(query, doc.page_content)]
+        keys = [self._key(query, window) for _, window in pairs]
+        pair_scores = [self._cached(key) for key in keys]
+        missing = [i for i, score in enumerate(pair_scores) if score is None]
+        cache_hits = len(pairs) - len(missing)
+
+        # Chấm theo thứ tự fusion: ứng viên tốt nhất được chấm trước
+        batch_seconds = 0.0
+        pairs_scored = 0
+        over_budget = False
+        for start in range(0, len(missing), self.batch_size):
+            elapsed = time.perf_counter() - started
+            if start and elapsed + batch_seconds > self.latency_budget:
+                over_budget = True
+                break
+            batch = missing[start:start + self.batch_size]
+            batch_started = time.perf_counter()
+            batch_scores = [float(s) for s in self.cross_encoder.score([(query, pairs[i][1]) for i in batch])]
+            batch_seconds = time.perf_counter() - batch_started
+            for i, score in zip(batch, batch_scores):
+                pair_scores[i] = score
+            self._remember([keys[i] for i in batch], batch_scores)
+            pairs_scored += len(batch)
+
+        # Điểm của chunk = max các cửa sổ đã chấm; chunk chưa chấm cửa sổ nào giữ thứ tự fusion
+        scores = [None] * len(docs)
+        for (d, _), score in zip(pairs, pair_scores):
+            if score is not None and (scores[d] is None or score > scores[d]):
+                scores[d] = score
+        self._count(calls=1, pairs_scored=pairs_scored, cache_hits=cache_hits, budget_exceeded=int(over_budget),
+                    truncated=sum(len(doc.page_content) > self.max_chars for doc in docs))
+
+        scored = sorted((i for i, score in enumerate(scores) if score is not None), key=lambda i: -scores[i])
+        unscored = [i for i, score in enumerate(scores) if score is None]
+        order = (scored + unscored)[:self.top_n]
+        for i in order:
+            if scores[i] is not None:
+                docs[i].metadata["rerank_score"] = scores[i]
+        ranked = [docs[i] for i in order]
+        print_timestamp(f"⚖️ [Reranker] {len(scored)}/{len(docs)} scored from {len(pairs)} windows "
+                        f"({cache_hits} cached) in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return ranked
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "skipped": self.skipped,
+                "pairs_scored": self.pairs_scored,
+                "cache_hits": self.cache_hits,
+                "cache_entries": len(self._cache),
+                "budget_exceeded": self.budget_exceeded,
+                "windowed_passages": self.truncated,
+            }
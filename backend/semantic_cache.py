@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# ==== Semantic answer cache ====
+# Câu hỏi gần giống (cosine >= threshold) trên cùng corpus của user sẽ dùng lại
+# câu trả lời + sources đã sinh trước đó, bỏ qua router/HyDE/search/LLM.
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+
+
+class CachedAnswer(object):
+    __slots__ = ("question", "answer", "sources", "created_at", "score")
+
+    def __init__(self, question, answer, sources, created_at, score=1.0):
+        self.question = question
+        self.answer = answer
+        self.sources = sources
+        self.created_at = created_at
+        self.score = score
+
+
+class _UserEntries(object):
+    """Entries of one user plus a lazily rebuilt embedding matrix."""
+
+    def __init__(self):
+        self.keys = []
+        self.vectors = []
+        self.matrix = None
+
+    def add(self, key, vector):
+        self.keys.append(key)
+        self.vectors.append(vector)
+        self.matrix = None
+
+    def remove(self, key):
+        i = self.keys.index(key)
+        del self.keys[i]
+        del self.vectors[i]
+        self.matrix = None
+
+    def best(self, vector):
+        if not self.keys:
+            return None, 0.0
+        if self.matrix is None:
+            self.matrix = np.vstack(self.vectors)
+        scores = self.matrix @ vector
+        i = int(np.argmax(scores))
+        return self.keys[i], float(scores[i])
+
+
+class SemanticAnswerCache(object):
+    """Per-user cache of answers keyed by question embedding.
+
+    Global LRU order across users, a TTL per entry, and hit/miss counters.
+    Embeddings are L2-normalized here, so similarity is a dot product.
+    """
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+                 ttl=SEMANTIC_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (username, seq) -> CachedAnswer
+        self._users = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        user = self._users.get(key[0])
+        if user is not None:
+            user.remove(key)
+            if not user.keys:
+                del self._users[key[0]]
+
+    def lookup(self, username: str, embedding):
+        """Return the closest CachedAnswer above the threshold, or None"""
+        vector = self._normalize(embedding)
+        with self._lock:
+            user = self._users.get(username)
+            key, score = user.best(vector) if user is not None else (None, 0.0)
+            entry = self._entries.get(key) if key is not None else None
+
+            if entry is not None and time.time() - entry.created_at > self.ttl:
+                self._drop(key)
+                entry = None
+
+            if entry is None or score < self.threshold:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return CachedAnswer(entry.question, entry.answer, entry.sources, entry.created_at, score)
+
+    def store(self, username: str, embedding, question: str, answer: str, sources: list):
+        vector = self._normalize(embedding)
+        with self._lock:
+            self._seq += 1
+            key = (username, self._seq)
+            self._entries[key] = CachedAnswer(question, answer, sources, time.time())
+            self._users.setdefault(username, _UserEntries()).add(key, vector)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, username: str):
+        """Forget every answer of a user, e.g. after the corpus is re-indexed"""
+        with self._lock:
+            user = self._users.pop(username, None)
+            if user is None:
+                return
+            for key in user.keys:
+                self._entries.pop(key, None)
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "users": len(self._users),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,72 @@
+import os
+import threading
+
+import elastic_search
+from bm25_index import LocalBM25Index
+
+# ==== Sparse (BM25) retrieval backend ====
+# ingestion và rag_pipeline gọi các hàm *_bm25 bên dưới; backend chọn theo
+# SPARSE_BACKEND:
+# - elasticsearch : index theo user trên cluster ES (mặc định)
+# - local         : bm25_index.LocalBM25Index trong process, segment trên đĩa
+#                   (BM25_INDEX_DIR, dùng chung giữa API và worker)
+SPARSE_BACKEND = os.getenv("SPARSE_BACKEND", "elasticsearch")
+
+
+class ElasticsearchBM25(object):
+    """One Elasticsearch index per user (see elastic_search.py)"""
+
+    def ensure_index(self, username, reset=False):
+        return elastic_search.ensure_index_bm25(username, reset)
+
+    def index_splits(self, username, splits, refresh=True):
+        return elastic_search.index_splits_bm25(username, splits, refresh)
+
+    def refresh(self, username):
+        return elastic_search.refresh_index_bm25(username)
+
+    def delete_document(self, username, file_key, refresh=True):
+        return elastic_search.delete_document_bm25(username, file_key, refresh)
+
+    def search(self, username, query):
+        return elastic_search.bm25_search(username, query)
+
+
+BACKENDS = {
+    "elasticsearch": ElasticsearchBM25,
+    "local": LocalBM25Index,
+}
+
+_sparse_index = None
+_sparse_lock = threading.Lock()
+
+
+def get_sparse_index():
+    """Process-wide sparse index for the backend selected by SPARSE_BACKEND"""
+    global _sparse_index
+    with _sparse_lock:
+        if _sparse_index is None:
+            if SPARSE_BACKEND not in BACKENDS:
+                raise ValueError(f"Unknown SPARSE_BACKEND {SPARSE_BACKEND!r}, expected one of {sorted(BACKENDS)}")
+            _sparse_index = BACKENDS[SPARSE_BACKEND]()
+        return _sparse_index
+
+
+def ensure_index_bm25(username, reset=False):
+    return get_sparse_index().ensure_index(username, reset)
+
+
+def index_splits_bm25(username, splits, refresh=True):
+    return get_sparse_index().index_splits(username, splits, refresh)
+
+
+def refresh_index_bm25(username):
+    return get_sparse_index().refresh(username)
+
+
+def delete_document_bm25(username, file_key, refresh=True):
+    return get_sparse_index().delete_document(username, file_key, refresh)
+
+
+def bm25_search(username, query):
+    return get_sparse_index().search(username, query)
@@ -0,0 +1,222 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional
+
+from python_multipart.multipart import MultipartParser, MultipartState, parse_options_header
+
+from util import print_timestamp
+
+# ==== Streaming uploads ====
+# Body multipart/form-data của /api/upload/ được parse theo từng chunk và đẩy
+# thẳng vào S3 multipart upload, không đọc cả file vào RAM:
+# - mỗi file giữ tối đa một buffer S3_UPLOAD_PART_SIZE
+# - tối đa S3_UPLOAD_MAX_INFLIGHT part đang upload mỗi request; hết slot thì
+#   ngừng đọc request (backpressure về phía client)
+# - part của nhiều file upload song song trên một thread pool dùng chung;
+#   file nhỏ hơn một part đi bằng một put_object
+S3_UPLOAD_PART_SIZE = int(os.getenv("S3_UPLOAD_PART_SIZE", str(8 * 1024 * 1024)))
+S3_UPLOAD_MAX_INFLIGHT = int(os.getenv("S3_UPLOAD_MAX_INFLIGHT", "4"))
+S3_UPLOAD_THREADS = int(os.getenv("S3_UPLOAD_THREADS", "16"))
+
+# S3 yêu cầu mọi part (trừ part cuối) >= 5 MiB
+_MIN_PART_SIZE = 5 * 1024 * 1024
+
+_executor = ThreadPoolExecutor(max_workers=S3_UPLOAD_THREADS, thread_name_prefix="s3-upload")
+
+
+class UploadError(Exception):
+    pass
+
+
+class S3ObjectWriter(object):
+    """Writes one object to S3 from a stream of chunks using bounded part buffers"""
+
+    def __init__(self, s3_client, bucket: str, key: str, slots: asyncio.Semaphore,
+                 part_size: int = S3_UPLOAD_PART_SIZE, content_type: Optional[str] = None,
+                 filename: Optional[str] = None):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.filename = filename or os.path.basename(key)
+        self.slots = slots
+        self.part_size = max(part_size, _MIN_PART_SIZE)
+        self.content_type = content_type
+        self.buffer = bytearray()
+        self.size = 0
+        self.upload_id = None
+        self.parts = []
+        self.pending = []
+
+    def write(self, data: bytes):
+        self.buffer += data
+        self.size += len(data)
+
+    async def _run(self, fn, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, lambda: fn(**kwargs))
+
+    async def _upload_part(self, number: int, body: bytes):
+        try:
+            response = await self._run(self.s3.upload_part, Bucket=self.bucket, Key=self.key,
+                                       UploadId=self.upload_id, PartNumber=number, Body=body)
+            return {"PartNumber": number, "ETag": response["ETag"]}
+        finally:
+            self.slots.release()
+
+    async def flush(self, final: bool = False):
+        """Send every full part in the buffer (and the remainder if `final`)"""
+        while len(self.buffer) >= self.part_size or (final and self.buffer and self.upload_id):
+            if self.upload_id is None:
+                extra = {"ContentType": self.content_type} if self.content_type else {}
+                response = await self._run(self.s3.create_multipart_upload, Bucket=self.bucket, Key=self.key, **extra)
+                self.upload_id = response["UploadId"]
+            with memoryview(self.buffer) as view:
+                body = bytes(view[:self.part_size])
+            del self.buffer[:self.part_size]
+            # Chờ slot trước khi nhận thêm dữ liệu: giới hạn RAM mỗi request
+            await self.slots.acquire()
+            self.pending.append(asyncio.ensure_future(self._upload_part(len(self.pending) + 1, body)))
+
+    async def close(self) -> dict:
+        """Finish the object; returns {"size", "etag", "last_modified"}"""
+        try:
+            await self.flush(final=True)
+            if self.upload_id is None:
+                extra = {"ContentType": self.content_type} if self.content_type else {}
+                response = await self._run(self.s3.put_object, Bucket=self.bucket, Key=self.key,
+                                           Body=bytes(self.buffer), **extra)
+            else:
+                self.parts = await asyncio.gather(*self.pending)
+                response = await self._run(self.s3.complete_multipart_upload, Bucket=self.bucket, Key=self.key,
+                                           UploadId=self.upload_id, MultipartUpload={"Parts": self.parts})
+            self.buffer = bytearray()
+            return {"size": self.size, "etag": response["ETag"], "last_modified": datetime.now(timezone.utc)}
+        except BaseException:
+            await self.abort()
+            raise
+
+    async def abort(self):
+        self.buffer = bytearray()
+        for future in self.pending:
+            future.cancel()
+        await asyncio.gather(*self.pending, return_exceptions=True)
+        if self.upload_id is not None:
+            try:
+                await self._run(self.s3.abort_multipart_upload, Bucket=self.bucket, Key=self.key,
+                                UploadId=self.upload_id)
+            except Exception as e:
+                print(f"Abort multipart upload failed: {e}")
+            self.upload_id = None
+
+
+async def stream_upload(stream: AsyncIterator[bytes], content_type: str, s3_client, bucket: str, username: str,
+                        field: str = "files", part_size: int = S3_UPLOAD_PART_SIZE,
+                        max_inflight: int = S3_UPLOAD_MAX_INFLIGHT) -> List[dict]:
+    """Upload every file of a multipart/form-data body to `<username>/<timestamp>_<filename>`.
+
+    Returns one entry per file, in body order: {"filename", "key", "size",
+    "etag", "last_modified", "content_type"} or {"filename", "error"}.
+    Raises UploadError for a malformed or truncated body; nothing is left in S3 then.
+    """
+    _, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise UploadError("Missing multipart boundary")
+
+    slots = asyncio.Semaphore(max_inflight)
+    prefix = str(int(time.time()))
+    state = {"headers": {}, "field": b"", "value": b"", "writer": None}
+    writers = []  # mọi file đã bắt đầu, theo thứ tự trong body
+    ended = []  # file vừa đọc xong trong lần parser.write gần nhất
+
+    def on_part_begin():
+        state["headers"] = {}
+
+    def on_header_field(data, start, end):
+        state["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["field"].lower()] = state["value"]
+        state["field"], state["value"] = b"", b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        filename = disposition.get(b"filename")
+        if disposition.get(b"name", b"").decode("utf-8", "replace") != field or not filename:
+            # Field khác (không phải file) thì bỏ qua
+            state["writer"] = None
+            return
+        filename = os.path.basename(filename.decode("utf-8", "replace").replace("\\", "/"))
+        part_type = state["headers"].get(b"content-type", b"").decode("latin-1") or None
+        writer = S3ObjectWriter(s3_client, bucket, f"{username}/{prefix}_{filename}", slots, part_size,
+                                part_type, filename)
+        writers.append(writer)
+        state["writer"] = writer
+
+    def on_part_data(data, start, end):
+        if state["writer"] is not None:
+            state["writer"].write(data[start:end])
+
+    def on_part_end():
+        if state["writer"] is not None:
+            ended.append(state["writer"])
+        state["writer"] = None
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+
+    closing = []
+    try:
+        async for chunk in stream:
+            parser.write(chunk)
+            # File đã đọc xong: hoàn tất ở background, file sau tiếp tục stream
+            closing.extend(asyncio.ensure_future(writer.close()) for writer in ended)
+            ended.clear()
+            if state["writer"] is not None:
+                await state["writer"].flush()
+        parser.finalize()
+    except BaseException:
+        for writer in writers[len(closing):]:
+            await writer.abort()
+        await asyncio.gather(*closing, return_exceptions=True)
+        raise
+
+    outcomes = await asyncio.gather(*closing, return_exceptions=True)
+    if len(closing) < len(writers) or parser.state != MultipartState.END:
+        # Body bị cắt trước boundary kết thúc (finalize() không báo lỗi): hủy multipart
+        # upload của file dở dang, xóa file đã xong để request không ghi một nửa
+        for writer in writers[len(closing):]:
+            await writer.abort()
+        for writer, outcome in zip(writers, outcomes):
+            if not isinstance(outcome, BaseException):
+                try:
+                    await writer._run(s3_client.delete_object, Bucket=bucket, Key=writer.key)
+                except Exception as e:
+                    print(f"Delete failed: {e}")
+        raise UploadError("Request body ended before the closing multipart boundary")
+
+    results = []
+    for writer, outcome in zip(writers, outcomes):
+        if isinstance(outcome, BaseException):
+            print(f"Upload failed: {outcome}")
+            results.append({"filename": writer.filename, "error": "Upload failed"})
+        else:
+            results.append({"filename": writer.filename, "key": writer.key, "content_type": writer.content_type,
+                            **outcome})
+    uploaded = [result for result in results if "key" in result]
+    print_timestamp(f"⬆️ [Upload] {len(uploaded)}/{len(results)} files, "
+                    f"{sum(result['size'] for result in uploaded) / 1e6:.1f} MB for {username}")
+    return results
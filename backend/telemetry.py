@@ -0,0 +1,265 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+# ==== Per-stage latency instrumentation ====
+# span("retrieve.dense") đo thời gian một bước (ms), gắn request_id + user của
+# request hiện tại (contextvar) và:
+# - cộng vào histogram theo stage -> GET /metrics (định dạng Prometheus)
+# - in một dòng JSON (SPAN_LOG=1, mặc định tắt: >10 dòng stdout mỗi request chat
+#   nằm ngay trên hot path đang đo) để grep/aggregate theo request_id
+# Worker process có registry riêng, phục vụ ở WORKER_METRICS_PORT.
+SPAN_LOG = os.getenv("SPAN_LOG", "0") == "1"
+# Ngưỡng bucket của histogram (ms)
+SPAN_BUCKETS_MS = [float(b) for b in os.getenv(
+    "SPAN_BUCKETS_MS", "1,2.5,5,10,25,50,100,250,500,1000,2500,5000,10000,30000,60000,120000").split(",")]
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "arag")
+
+
+class RequestContext(object):
+    """Mutable per-request state; auth fills in `username` once the token is verified"""
+    __slots__ = ("request_id", "username")
+
+    def __init__(self, request_id: str, username: Optional[str] = None):
+        self.request_id = request_id
+        self.username = username
+
+
+_context = contextvars.ContextVar("request_context", default=None)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def current_context() -> Optional[RequestContext]:
+    return _context.get()
+
+
+@contextmanager
+def request_context(request_id: Optional[str] = None, username: Optional[str] = None):
+    """Bind a request ID (and user) to everything recorded inside the block, e.g. one worker job"""
+    token = _context.set(RequestContext(request_id or new_request_id(), username))
+    try:
+        yield _context.get()
+    finally:
+        _context.reset(token)
+
+
+def set_user(username: str):
+    context = _context.get()
+    if context is not None:
+        context.username = username
+
+
+def in_context(fn):
+    """Wrap `fn` to run in a copy of the caller's context (for ThreadPoolExecutor.submit)"""
+    context = contextvars.copy_context()
+    return functools.partial(context.run, fn)
+
+
+class Histogram(object):
+    __slots__ = ("counts", "sum", "count", "errors")
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * (buckets + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+
+
+class SpanRegistry(object):
+    """Latency histograms keyed by stage name"""
+
+    def __init__(self, buckets_ms=SPAN_BUCKETS_MS):
+        self.buckets_ms = sorted(buckets_ms)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, duration_ms: float, error: bool = False):
+        index = bisect_left(self.buckets_ms, duration_ms)
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(len(self.buckets_ms))
+            histogram.counts[index] += 1
+            histogram.sum += duration_ms
+            histogram.count += 1
+            histogram.errors += error
+
+    def _snapshot(self):
+        with self._lock:
+            return {stage: (list(h.counts), h.sum, h.count, h.errors) for stage, h in sorted(self._histograms.items())}
+
+    def _quantile(self, counts, count, q: float) -> float:
+        """Bucket-interpolated quantile, the same estimate histogram_quantile() gives"""
+        rank = q * count
+        seen, lower = 0, 0.0
+        for upper, n in zip(self.buckets_ms + [float("inf")], counts):
+            if n and seen + n >= rank:
+                if upper == float("inf"):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = upper
+        return lower
+
+    def stats(self) -> dict:
+        """{stage: {count, errors, avg_ms, p50_ms, p95_ms}} for /api/metrics"""
+        result = {}
+        for stage, (counts, total, count, errors) in self._snapshot().items():
+            result[stage] = {
+                "count": count,
+                "errors": errors,
+                "avg_ms": total / count if count else 0.0,
+                "p50_ms": self._quantile(counts, count, 0.5),
+                "p95_ms": self._quantile(counts, count, 0.95),
+            }
+        return result
+
+    def render(self) -> str:
+        """Prometheus text exposition (durations in seconds, as Prometheus expects)"""
+        name = f"{METRICS_NAMESPACE}_stage_duration_seconds"
+        lines = [f"# HELP {name} Duration of each request/ingestion stage.", f"# TYPE {name} histogram"]
+        errors = []
+        for stage, (counts, total, count, error_count) in self._snapshot().items():
+            label = stage.replace("\\", "\\\\").replace('"', '\\"')
+            cumulative = 0
+            for upper, n in zip(self.buckets_ms, counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{{stage="{label}",le="{upper / 1000:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{stage="{label}",le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{stage="{label}"}} {total / 1000:.6f}')
+            lines.append(f'{name}_count{{stage="{label}"}} {count}')
+            errors.append(f'{METRICS_NAMESPACE}_stage_errors_total{{stage="{label}"}} {error_count}')
+        if errors:
+            lines += [f"# HELP {METRICS_NAMESPACE}_stage_errors_total Stages that raised.",
+                      f"# TYPE {METRICS_NAMESPACE}_stage_errors_total counter"] + errors
+        return "\n".join(lines) + "\n"
+
+
+registry = SpanRegistry()
+
+
+def record(stage: str, duration_ms: float, error: Optional[str] = None, attrs: Optional[dict] = None):
+    registry.observe(stage, duration_ms, error is not None)
+    if not SPAN_LOG:
+        return
+    context = _context.get()
+    entry = {
+        "ts": datetime.now().isoformat(timespec="milliseconds"),
+        "span": stage,
+        "ms": round(duration_ms, 2),
+        "request_id": context.request_id if context else None,
+        "user": context.username if context else None,
+    }
+    if error is not None:
+        entry["error"] = error
+    if attrs:
+        entry.update(attrs)
+    print(json.dumps(entry, ensure_ascii=False, default=str))
+
+
+@contextmanager
+def span(stage: str, **attrs):
+    """Time the block as `stage`; the yielded dict can take extra attributes for the log line"""
+    started = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        record(stage, (time.perf_counter() - started) * 1000, error, attrs)
+
+
+def traced(stage: str):
+    """Decorator form of span() for sync and async functions"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0"):
+    """Serve GET /metrics from a daemon thread (for processes without the FastAPI app)"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+class RequestContextMiddleware(object):
+    """ASGI middleware: assigns a request ID (X-Request-ID in/out) and times the whole request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = dict(scope.get("headers") or []).get(b"x-request-id", b"").decode("latin-1")[:64]
+        request_id = request_id or new_request_id()
+        status = {"code": 500}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        with request_context(request_id):
+            started = time.perf_counter()
+            error = None
+            try:
+                await self.app(scope, receive, send_with_id)
+            except BaseException as e:
+                error = type(e).__name__
+                raise
+            finally:
+                # 5xx trả về bình thường (không raise) vẫn là lỗi của request
+                if error is None and status["code"] >= 500:
+                    error = f"HTTP {status['code']}"
+                # Dùng path của route (vd. /api/documents/{file_key:path}) để số stage không bùng nổ
+                route = scope.get("route")
+                path = getattr(route, "path", None) or "unmatched"
+                if path != "/metrics":
+                    record(f"http {scope['method']} {path}", (time.perf_counter() - started) * 1000, error,
+                           {"status": status["code"]})
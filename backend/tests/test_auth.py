@@ -0,0 +1,179 @@
+import time
+
+import pytest
+import requests
+from joserfc import jwt
+from joserfc.jwk import RSAKey
+
+from auth import CognitoTokenVerifier, InvalidToken, JWKSUnavailable
+
+ISSUER = "https://cognito-idp.ap-southeast-1.amazonaws.com/ap-southeast-1_test"
+CLIENT_ID = "test-client"
+
+
+def make_key(kid):
+    return RSAKey.generate_key(2048, parameters={"kid": kid}, private=True)
+
+
+def jwks(*keys):
+    return {"keys": [key.as_dict(private=False) for key in keys]}
+
+
+def make_token(key, **overrides):
+    now = int(time.time())
+    claims = {
+        "sub": "user-1",
+        "iss": ISSUER,
+        "token_use": "access",
+        "client_id": CLIENT_ID,
+        "username": "alice",
+        "iat": now,
+        "exp": now + 3600,
+    }
+    claims.update(overrides)
+    claims = {name: value for name, value in claims.items() if value is not None}
+    return jwt.encode({"alg": "RS256", "kid": key.kid}, claims, key)
+
+
+class FakeJWKS(object):
+    """Serves the current key set; counts fetches and can be made to fail"""
+
+    def __init__(self, *keys):
+        self.document = jwks(*keys)
+        self.fetches = 0
+        self.error = None
+
+    def __call__(self):
+        self.fetches += 1
+        if self.error is not None:
+            raise self.error
+        return self.document
+
+
+@pytest.fixture
+def key():
+    return make_key("key-1")
+
+
+@pytest.fixture
+def fetch(key):
+    return FakeJWKS(key)
+
+
+@pytest.fixture
+def verifier(fetch):
+    return CognitoTokenVerifier(ISSUER, CLIENT_ID, fetch_jwks=fetch, leeway=0)
+
+
+def test_valid_token(verifier, key):
+    claims = verifier.verify(make_token(key))
+    assert claims["sub"] == "user-1"
+    assert claims["username"] == "alice"
+
+
+def test_expired_token(verifier, key):
+    now = int(time.time())
+    with pytest.raises(InvalidToken):
+        verifier.verify(make_token(key, iat=now - 7200, exp=now - 3600))
+
+
+def test_wrong_issuer(verifier, key):
+    with pytest.raises(InvalidToken):
+        verifier.verify(make_token(key, iss="https://cognito-idp.us-east-1.amazonaws.com/us-east-1_other"))
+
+
+def test_wrong_token_use(verifier, key):
+    with pytest.raises(InvalidToken):
+        verifier.verify(make_token(key, token_use="id"))
+
+
+def test_wrong_client_id(verifier, key):
+    with pytest.raises(InvalidToken):
+        verifier.verify(make_token(key, client_id="another-client"))
+
+
+def test_id_token_audience_is_not_a_client_id(verifier, key):
+    # ID token: client chỉ nằm trong aud, không có client_id
+    with pytest.raises(InvalidToken):
+        verifier.verify(make_token(key, token_use="id", client_id=None, aud=CLIENT_ID))
+
+
+def test_token_signed_by_unknown_key(verifier, fetch, key):
+    verifier.verify(make_token(key))
+    with pytest.raises(InvalidToken):
+        verifier.verify(make_token(make_key("key-1")))
+
+
+def test_unknown_kid_refetches_jwks(verifier, fetch, key):
+    verifier.verify(make_token(key))
+    assert fetch.fetches == 1
+
+    # Pool thêm key mới; token ký bằng kid chưa có trong cache ép refetch
+    verifier._fetched_at -= 61
+    rotated = make_key("key-2")
+    fetch.document = jwks(key, rotated)
+    assert verifier.verify(make_token(rotated))["sub"] == "user-1"
+    assert fetch.fetches == 2
+
+
+def test_unknown_kid_refetch_is_rate_limited(verifier, fetch, key):
+    verifier.verify(make_token(key))
+    with pytest.raises(InvalidToken):
+        verifier.verify(make_token(make_key("key-2")))
+    with pytest.raises(InvalidToken):
+        verifier.verify(make_token(make_key("key-3")))
+    assert fetch.fetches == 1
+
+
+def test_key_rotation(verifier, fetch, key):
+    verifier.verify(make_token(key))
+
+    # Cognito thay hẳn key: token cũ bị từ chối sau khi JWKS hết hạn
+    rotated = make_key("key-2")
+    fetch.document = jwks(rotated)
+    verifier._fetched_at -= verifier.jwks_ttl + 1
+    assert verifier.verify(make_token(rotated))["sub"] == "user-1"
+    with pytest.raises(InvalidToken):
+        verifier.verify(make_token(key))
+
+
+def test_failed_refresh_keeps_last_key_set(verifier, fetch, key):
+    verifier.verify(make_token(key))
+    fetch.error = requests.ConnectionError("network down")
+    verifier._fetched_at -= verifier.jwks_ttl + 1
+
+    assert verifier.verify(make_token(key))["sub"] == "user-1"
+    assert fetch.fetches == 2
+    # Trong thời gian backoff không gọi lại JWKS
+    assert verifier.verify(make_token(key))["sub"] == "user-1"
+    assert fetch.fetches == 2
+
+
+def test_failed_refresh_with_unknown_kid_is_invalid_token(verifier, fetch, key):
+    verifier.verify(make_token(key))
+    verifier._fetched_at -= 61
+    fetch.error = requests.HTTPError("503 Server Error")
+    with pytest.raises(InvalidToken):
+        verifier.verify(make_token(make_key("key-2")))
+
+
+def test_failed_refresh_retries_after_backoff(verifier, fetch, key):
+    verifier.verify(make_token(key))
+    fetch.error = requests.ConnectionError("network down")
+    verifier._fetched_at -= verifier.jwks_ttl + 1
+    verifier.verify(make_token(key))
+
+    fetch.error = None
+    verifier._retry_at = 0.0
+    verifier.verify(make_token(key))
+    assert fetch.fetches == 3
+    assert verifier._failures == 0
+
+
+def test_no_key_set_is_unavailable(verifier, fetch, key):
+    fetch.error = requests.ConnectionError("network down")
+    with pytest.raises(JWKSUnavailable):
+        verifier.verify(make_token(key))
+    with pytest.raises(JWKSUnavailable):
+        verifier.verify(make_token(key))
+    assert fetch.fetches == 1
@@ -1,4 +1,5 @@
 import boto3
+from botocore.exceptions import ClientError
 import os
 import time
 
@@ -8,6 +9,7 @@ region = os.getenv("AWS_REGION_NAME")
 class S3Upload(object):
     def __init__(self):
         self.s3 = boto3.client('s3', region_name=region)
+        self._known_buckets = set()
 
     def is_bucket_exist(self, bucket_name):
         try:
@@ -27,6 +29,21 @@ class S3Upload(object):
             return False
         return True
 
+    def ensure_bucket(self, bucket_name):
+        """Create the bucket if needed; the answer is cached for the life of the process"""
+        if bucket_name in self._known_buckets:
+            return True
+        try:
+            self.s3.head_bucket(Bucket=bucket_name)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchBucket'):
+                print("Check bucket error:", e)
+                return False
+            if not self.create_bucket(bucket_name):
+                return False
+        self._known_buckets.add(bucket_name)
+        return True
+
     def get_presigned_url(self, bucket_name, s3_key, expiration=3600):
         return self.s3.generate_presigned_url(
             'get_object',
@@ -35,56 +52,38 @@ class S3Upload(object):
         )
 
     def upload_file_to_s3(self, file, object_name, bucket_name, username):
+        """Upload and return the object's catalog entry (see _file_info), or None"""
         unique_prefix = str(int(time.time()))
         file_path = f"{username}/{unique_prefix}_{object_name}"
-        s3_file_url = f"http://{bucket_name}.s3.amazonaws.com/{file_path}"
         try:
-            response = self.s3 .upload_fileobj(
+            self.s3 .upload_fileobj(
                 file,
                 bucket_name,
                 file_path
             )
-            return self.get_presigned_url(bucket_name,file_path)
+            head = self.s3.head_object(Bucket=bucket_name, Key=file_path)
+            return self._file_info(username, file_path, head['ContentLength'], head['ETag'], head['LastModified'])
         except Exception as e:
             print(f"Upload failed: {e}")
             return None
 
+    def iter_user_files(self, bucket_name, username):
+        """Yield every file of a user, following list_objects_v2 pagination (no URL signing)"""
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{username}/"):
+            for obj in page.get('Contents', []):
+                key = obj['Key']
+
+                # Skip if it's just a folder
+                if key.endswith('/'):
+                    continue
+
+                yield self._file_info(username, key, obj['Size'], obj['ETag'], obj['LastModified'])
+
     def list_user_files(self, bucket_name, username):
         """List all files for a specific user in S3"""
         try:
-            response = self.s3.list_objects_v2(
-                Bucket=bucket_name,
-                Prefix=f"{username}/"
-            )
-
-            
-            files = []
-            if 'Contents' in response:
-                for obj in response['Contents']:
-                    key = obj['Key']
-                    
-                    # Skip if it's just a folder
-                    if key.endswith('/'):
-                        continue
-                    
-                    # Extract filename from key (remove username prefix and timestamp)
-                    filename_parts = key.replace(f"{username}/", "").split('_', 1)
-                    if len(filename_parts) > 1:
-                        original_filename = filename_parts[1]
-                    else:
-                        original_filename = filename_parts[0]
-
-                    
-                    file_info = {
-                        'key': key,
-                        'filename': original_filename,
-                        'url': self.get_presigned_url(bucket_name, key),
-                        'size': obj['Size'],
-                        'last_modified': obj['LastModified'].isoformat(),
-                        'type': self._get_file_type(original_filename)
-                    }
-                    files.append(file_info)
-            return files
+            return list(self.iter_user_files(bucket_name, username))
         except Exception as e:
 
             import traceback
@@ -100,6 +99,23 @@ class S3Upload(object):
             print(f"Delete failed: {e}")
             return False
 
+    def _file_info(self, username, key, size, etag, last_modified):
+        # Extract filename from key (remove username prefix and timestamp)
+        filename_parts = key.replace(f"{username}/", "", 1).split('_', 1)
+        if len(filename_parts) > 1:
+            original_filename = filename_parts[1]
+        else:
+            original_filename = filename_parts[0]
+
+        return {
+            'key': key,
+            'filename': original_filename,
+            'size': size,
+            'etag': etag.strip('"'),
+            'last_modified': last_modified.isoformat(),
+            'type': self._get_file_type(original_filename)
+        }
+
     def _get_file_type(self, filename):
         """Get file type from filename extension"""
         if '.' not in filename:
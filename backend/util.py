@@ -1,8 +1,13 @@
 from datetime import datetime
 
+from telemetry import current_context
+
 # ========== Function ==========
 def print_timestamp(step_name):
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {step_name}")
+    # Thời gian tới ms + request_id để ghép log với span của cùng request
+    context = current_context()
+    request_id = f" [{context.request_id}]" if context is not None else ""
+    print(f"[{datetime.now().isoformat(sep=' ', timespec='milliseconds')}]{request_id} {step_name}")
 
 
 # def process_upload_document():
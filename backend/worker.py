@@ -0,0 +1,157 @@
+"""Ingestion worker: claims jobs from the job queue and runs them outside the API process.
+
+    cd backend && python worker.py --processes 2
+
+Each process loads its own embedding model and handles one job at a time;
+the queue guarantees at most one running job per user across all workers.
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+
+from job_queue import get_job_queue, JOB_POLL_INTERVAL
+from telemetry import request_context, span, start_metrics_server
+from util import print_timestamp
+
+INGEST_WORKER_PROCESSES = int(os.getenv("INGEST_WORKER_PROCESSES", "1"))
+# Histogram các stage ingestion của worker (process i dùng port + i); 0 = tắt
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9101"))
+
+# Worker ghi event này sau mỗi job; API poll để xóa semantic cache của user
+CORPUS_CHANGED = "corpus_changed"
+
+
+def build_handlers(embed_model, aws):
+    """Job kind -> handler(job) for the ingestion jobs enqueued by the API"""
+    from document_catalog import get_document_catalog, sync_catalog
+    from ingestion import process_files, remove_document
+
+    def process_documents(job):
+        bucket_name = job.payload.get("bucket_name", "arag")
+        # Liệt kê lại S3 lúc chạy: job có thể đã chờ trong lúc user upload/xóa thêm.
+        # Lỗi S3 phải làm job fail (queue retry/backoff): đối chiếu catalog/index với
+        # một danh sách rỗng do lỗi sẽ xóa toàn bộ tài liệu của user
+        files = list(aws.iter_user_files(bucket_name, job.username))
+        try:
+            # Đồng bộ catalog với S3 (file upload ngoài API, file đã bị xóa)
+            sync_catalog(get_document_catalog(), job.username, files)
+        except Exception as e:
+            print_timestamp(f"Document catalog sync failed for {job.username}: {e}")
+        process_files(embed_model, files, job.username, bucket_name=bucket_name, s3_client=aws.s3)
+
+    def deindex_document(job):
+        remove_document(job.username, job.payload["file_key"])
+
+    return {
+        "process_documents": process_documents,
+        "deindex_document": deindex_document,
+    }
+
+
+def _keep_alive(job_queue, job, done: threading.Event):
+    # Gia hạn lease để worker khác không claim lại job đang chạy
+    while not done.wait(job_queue.lease_seconds / 3):
+        try:
+            if not job_queue.heartbeat(job.id, job.worker):
+                print_timestamp(f"Lost the lease on job {job.id}, another worker may rerun it")
+                return
+        except Exception as e:
+            print_timestamp(f"Heartbeat failed for job {job.id}: {e}")
+
+
+def run_job(job_queue, handlers: dict, job):
+    done = threading.Event()
+    threading.Thread(target=_keep_alive, args=(job_queue, job, done), daemon=True).start()
+    try:
+        handler = handlers.get(job.kind)
+        if handler is None:
+            raise ValueError(f"Unknown job kind {job.kind!r}")
+        # Span của job mang request_id "job-<id>" và user của job
+        with request_context(f"job-{job.id}", job.username), span(f"job.{job.kind}", attempt=job.attempts):
+            handler(job)
+        if job_queue.complete(job.id, job.worker):
+            print_timestamp(f"Job {job.id} ({job.kind}, {job.username}) done")
+        else:
+            print_timestamp(f"Job {job.id} ({job.kind}, {job.username}) done, but its lease had expired")
+    except Exception as e:
+        traceback.print_exc()
+        retry = job_queue.fail(job.id, job.worker, f"{type(e).__name__}: {e}")
+        print_timestamp(f"Job {job.id} ({job.kind}, {job.username}) failed "
+                        f"(attempt {job.attempts}/{job.max_attempts}{', will retry' if retry else ''})")
+    finally:
+        done.set()
+        # Index có thể đã thay đổi một phần kể cả khi lỗi
+        job_queue.publish(CORPUS_CHANGED, job.username)
+
+
+def run_worker(job_queue, handlers: dict, worker_id: str, stop=None, poll_interval: float = JOB_POLL_INTERVAL):
+    """Claim and run jobs until `stop` is set"""
+    print_timestamp(f"Worker {worker_id} started")
+    while stop is None or not stop.is_set():
+        job = job_queue.claim(worker_id)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        print_timestamp(f"Worker {worker_id} claimed job {job.id} ({job.kind}, {job.username})")
+        run_job(job_queue, handlers, job)
+    print_timestamp(f"Worker {worker_id} stopped")
+
+
+def serve(stop=None, metrics_port: int = WORKER_METRICS_PORT):
+    """Load the models/clients once, then work the queue"""
+    from clients import init_clients, close_clients
+    from inference_backends import INFERENCE_BACKEND, EMBED_MODEL_NAME, load_embedding_model
+    from uploads3 import S3Upload
+
+    if metrics_port:
+        start_metrics_server(metrics_port)
+        print_timestamp(f"Serving worker metrics on :{metrics_port}/metrics")
+    print_timestamp(f"Loading embedding model ({INFERENCE_BACKEND})...")
+    embed_model = load_embedding_model(EMBED_MODEL_NAME)
+    init_clients()
+    try:
+        run_worker(get_job_queue(), build_handlers(embed_model, S3Upload()),
+                   f"{socket.gethostname()}-{os.getpid()}", stop)
+    finally:
+        close_clients()
+
+
+def _serve_child(stop, index):
+    # Ctrl-C / SIGTERM chỉ do process cha xử lý: job đang chạy được làm nốt
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    serve(stop, WORKER_METRICS_PORT + index if WORKER_METRICS_PORT else 0)
+
+
+def main(processes: int):
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+
+    def shutdown(signum, frame):
+        print_timestamp("Stopping workers after their current job...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    if processes <= 1:
+        serve(stop)
+        return
+
+    children = [context.Process(target=_serve_child, args=(stop, i), name=f"ingest-worker-{i}")
+                for i in range(processes)]
+    for child in children:
+        child.start()
+    for child in children:
+        child.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=INGEST_WORKER_PROCESSES)
+    main(parser.parse_args().processes)
@@ -11,6 +11,7 @@ import {
   Play,
   CheckCircle,
   AlertCircle,
+  ExternalLink,
 } from "lucide-react";
 
 interface DocumentsPanelProps {
@@ -24,6 +25,10 @@ export function DocumentsPanel({ onClose }: DocumentsPanelProps) {
     uploadDocuments,
     deleteDocument,
     processDocuments,
+    getDocumentUrl,
+    loadMoreDocuments,
+    hasMoreDocuments,
+    isLoadingMore,
     isUploading,
     isProcessing,
     isLoading,
@@ -49,6 +54,24 @@ export function DocumentsPanel({ onClose }: DocumentsPanelProps) {
     }
   };
 
+  const handleOpenDocument = async (documentId: string) => {
+    // Open the tab synchronously so the popup blocker allows it, then point it
+    // at the presigned URL once the backend has signed it
+    const tab = window.open("", "_blank");
+    try {
+      const url = await getDocumentUrl(documentId);
+      if (tab) {
+        tab.opener = null;
+        tab.location.href = url;
+      } else {
+        window.open(url, "_blank", "noopener");
+      }
+    } catch (error) {
+      tab?.close();
+      console.error("Open document error:", error);
+    }
+  };
+
   const formatFileSize = (bytes: number) => {
     if (bytes === 0) return "0 Bytes";
     const k = 1024;
@@ -272,6 +295,13 @@ export function DocumentsPanel({ onClose }: DocumentsPanelProps) {
                     </p>
 
                     <div className="flex space-x-2 mt-3">
+                      <button
+                        onClick={() => handleOpenDocument(doc.id)}
+                        className="flex items-center space-x-1 px-3 py-1 text-xs rounded-md transition-colors bg-blue-600 text-white hover:bg-blue-700"
+                      >
+                        <ExternalLink className="w-3 h-3" />
+                        <span>Open</span>
+                      </button>
                       <button
                         onClick={() => deleteDocument(doc.id)}
                         disabled={!canDelete}
@@ -289,6 +319,15 @@ export function DocumentsPanel({ onClose }: DocumentsPanelProps) {
                 </div>
               </div>
             ))}
+            {hasMoreDocuments && (
+              <button
+                onClick={() => loadMoreDocuments()}
+                disabled={isLoadingMore}
+                className="w-full py-2 text-sm rounded-md border border-gray-200 text-gray-600 hover:bg-gray-50 disabled:opacity-50 disabled:cursor-not-allowed"
+              >
+                {isLoadingMore ? "Loading..." : "Load more"}
+              </button>
+            )}
           </div>
         )}
       </div>
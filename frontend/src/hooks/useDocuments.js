@@ -1,8 +1,10 @@
-import { useMutation, useQuery, useQueryClient } from "@tanstack/react-query";
+import { useInfiniteQuery, useMutation, useQuery, useQueryClient } from "@tanstack/react-query";
 import CustomAxios from "../config/CustomAxios";
 import useDocumentStore from "../stores/useDocumentStore";
 import { useEffect } from "react";
 
+const DOCUMENTS_PAGE_SIZE = 50;
+
 // API functions
 const documentsAPI = {
   uploadDocuments: async (files) => {
@@ -19,34 +21,42 @@ const documentsAPI = {
     return response.data;
   },
 
-  getDocuments: async () => {
+  getDocuments: async ({ pageParam }) => {
     try {
-      const response = await CustomAxios.get("/api/documents/");
+      // Backend returns the catalog page by page; one request per page
+      const response = await CustomAxios.get("/api/documents/", {
+        params: { limit: DOCUMENTS_PAGE_SIZE, ...(pageParam ? { cursor: pageParam } : {}) },
+      });
 
       if (!response.data.documents) {
         console.warn("⚠️ No documents field in response:", response.data);
-        return [];
+        return { documents: [], nextCursor: null };
       }
 
       // Transform backend response to match frontend format
       const transformedDocuments = response.data.documents.map((doc) => ({
         id: doc.key, // Use S3 key as unique ID
         name: doc.filename,
-        url: doc.url,
         size: doc.size,
         uploadDate: doc.last_modified,
         type: doc.type,
         s3Key: doc.key, // Keep S3 key for deletion
       }));
 
-      return transformedDocuments;
+      return { documents: transformedDocuments, nextCursor: response.data.next_cursor || null };
     } catch {
       // Fallback to localStorage for backward compatibility
       const documents = JSON.parse(localStorage.getItem("documents") || "[]");
-      return documents;
+      return { documents, nextCursor: null };
     }
   },
 
+  // Presigned download URL, generated on demand
+  getDocumentUrl: async (documentId) => {
+    const response = await CustomAxios.get(`/api/documents/${encodeURIComponent(documentId)}/url`);
+    return response.data.url;
+  },
+
   getDocumentStatus: async () => {
     try {
       const response = await CustomAxios.get("/api/documents/status");
@@ -118,9 +128,12 @@ export const useUploadDocuments = () => {
 export const useDocuments = () => {
   const { setDocuments } = useDocumentStore();
 
-  const query = useQuery({
+  // Only the first page is fetched up front; further pages are loaded on demand
+  const query = useInfiniteQuery({
     queryKey: ["documents"],
     queryFn: documentsAPI.getDocuments,
+    initialPageParam: null,
+    getNextPageParam: (lastPage) => lastPage.nextCursor,
     staleTime: 30000, // Consider data fresh for 30 seconds
     retry: 2,
   });
@@ -128,7 +141,7 @@ export const useDocuments = () => {
   // Use useEffect to handle successful data
   useEffect(() => {
     if (query.data) {
-      setDocuments(query.data);
+      setDocuments(query.data.pages.flatMap((page) => page.documents));
     }
   }, [query.data, setDocuments]);
 
@@ -251,6 +264,10 @@ export const useDocumentManagement = () => {
     uploadDocuments,
     deleteDocument,
     processDocuments,
+    getDocumentUrl: documentsAPI.getDocumentUrl,
+    loadMoreDocuments: documentsQuery.fetchNextPage,
+    hasMoreDocuments: documentsQuery.hasNextPage,
+    isLoadingMore: documentsQuery.isFetchingNextPage,
     isUploading: uploadMutation.isPending,
     isDeleting: deleteMutation.isPending,
     isProcessing: processMutation.isPending,